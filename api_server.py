@@ -0,0 +1,355 @@
+"""Async HTTP API for the transform, outside Streamlit's rerun model.
+
+An ASGI (Starlette) app that serves the same TransformEngine as the UI, so
+the system prompt, response cache, rate limiting, key pool and hedging all
+behave the same. One engine and one set of Gemini clients are shared by every
+request. Admission control caps the transforms in flight and the queue in
+front of them; past that, requests get 503 with Retry-After instead of piling
+up behind the upstream quota.
+
+    python api_server.py --port 8000
+    uvicorn api_server:app --port 8000
+
+Endpoints:
+
+    POST /v1/transform          {"prompt": "..."} -> {"structured_prompt": "...", ...}
+    POST /v1/transform/batch    {"prompts": ["...", ...]} -> {"results": [...]}
+    POST /v1/transform/stream   {"prompt": "..."} -> text/event-stream of chunks
+    GET  /healthz               load and upstream state
+    GET  /metrics               Prometheus metrics for the API process
+"""
+import argparse
+import asyncio
+import hmac
+import json
+import os
+from contextlib import asynccontextmanager
+
+from anyio import to_thread
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+import gemini_client
+from resilience import CircuitOpenError
+from telemetry import build_telemetry
+from transform_engine import TransformEngine
+
+# Sent as Retry-After when the queue is full; queued requests finish quickly or time out
+OVERLOADED_RETRY_AFTER = 1
+
+_DONE = object()
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot get a transform slot"""
+
+
+class AdmissionControl:
+    """Caps the transforms in flight and the requests queued for a slot.
+
+    A request that finds the queue full, or waits longer than queue_timeout,
+    is turned away so the client can back off rather than time out.
+    """
+
+    def __init__(self, max_in_flight=32, max_queue=64, queue_timeout=10.0):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._slots = asyncio.Semaphore(max_in_flight)
+
+    async def acquire(self):
+        """Wait for a slot, or raise Overloaded"""
+        if self._slots.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Overloaded() from None
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._slots.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+        }
+
+
+class ApiService:
+    """Engine, admission control and telemetry shared by every API request"""
+
+    def __init__(self, engine, admission, telemetry, max_batch=100, batch_concurrency=8, max_prompt_chars=100000,
+                 api_token=None):
+        self.engine = engine
+        self.admission = admission
+        self.telemetry = telemetry
+        self.max_batch = max_batch
+        # Per batch request, so one large batch cannot fill the shared queue alone
+        self.batch_concurrency = batch_concurrency
+        self.max_prompt_chars = max_prompt_chars
+        self.api_token = api_token
+
+    @classmethod
+    def from_env(cls):
+        max_in_flight = int(os.getenv("API_MAX_CONCURRENCY", "32"))
+        return cls(
+            TransformEngine.from_env(),
+            AdmissionControl(
+                max_in_flight=max_in_flight,
+                max_queue=int(os.getenv("API_MAX_QUEUE", str(max_in_flight * 2))),
+                queue_timeout=float(os.getenv("API_QUEUE_TIMEOUT_SECONDS", "10")),
+            ),
+            # The API serves /metrics itself, so it does not collide with the app's endpoint
+            build_telemetry(serve_metrics=False),
+            max_batch=int(os.getenv("API_MAX_BATCH", "100")),
+            batch_concurrency=int(os.getenv("API_BATCH_CONCURRENCY", "8")),
+            max_prompt_chars=int(os.getenv("API_MAX_PROMPT_CHARS", "100000")),
+            api_token=os.getenv("API_TOKEN") or None,
+        )
+
+    def check_prompt(self, prompt):
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise ValueError("prompt must be a non-empty string")
+        if self.max_prompt_chars and len(prompt) > self.max_prompt_chars:
+            raise ValueError(f"prompt is longer than {self.max_prompt_chars} characters")
+        return prompt.strip()
+
+    async def transform(self, raw_prompt, mode="api"):
+        """(structured prompt, finished trace) for one prompt"""
+        trace = self.telemetry.start_request(mode)
+        try:
+            async with self.admission.slot():
+                structured_prompt = await self.engine.transform_async(raw_prompt, trace)
+        except Exception as e:
+            if trace.error is None:
+                trace.record_error(e)
+            raise
+        finally:
+            self.telemetry.finish(trace)
+        return structured_prompt, trace
+
+
+def error_response(exc):
+    """Status code, body and headers for a failed transform"""
+    if isinstance(exc, Overloaded):
+        return JSONResponse(
+            {"error": "overloaded", "detail": "Too many transforms in progress; retry shortly"},
+            status_code=503, headers={"Retry-After": str(OVERLOADED_RETRY_AFTER)},
+        )
+    if isinstance(exc, CircuitOpenError):
+        return JSONResponse(
+            {"error": "upstream_unavailable", "detail": str(exc)},
+            status_code=503, headers={"Retry-After": str(max(1, round(exc.retry_after)))},
+        )
+    if getattr(exc, "code", None) == 429:
+        return JSONResponse({"error": "upstream_throttled", "detail": str(exc)}, status_code=429,
+                            headers={"Retry-After": str(OVERLOADED_RETRY_AFTER)})
+    return JSONResponse({"error": "upstream_error", "detail": f"{type(exc).__name__}: {exc}"}, status_code=502)
+
+
+async def read_json(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise ValueError("request body must be JSON") from None
+    if not isinstance(body, dict):
+        raise ValueError("request body must be a JSON object")
+    return body
+
+
+def authorized(service, request):
+    if service.api_token is None:
+        return True
+    expected = f"Bearer {service.api_token}"
+    return hmac.compare_digest(request.headers.get("authorization", ""), expected)
+
+
+def endpoint(handler):
+    """Resolve the shared service, check the token and map bad input to 400"""
+    async def wrapped(request):
+        service = request.app.state.service
+        if not authorized(service, request):
+            return JSONResponse({"error": "unauthorized"}, status_code=401)
+        try:
+            return await handler(service, request)
+        except ValueError as e:
+            return JSONResponse({"error": "bad_request", "detail": str(e)}, status_code=400)
+    return wrapped
+
+
+@endpoint
+async def transform(service, request):
+    body = await read_json(request)
+    raw_prompt = service.check_prompt(body.get("prompt"))
+    try:
+        structured_prompt, trace = await service.transform(raw_prompt)
+    except Exception as e:
+        return error_response(e)
+    return JSONResponse({
+        "structured_prompt": structured_prompt,
+        "request_id": trace.request_id,
+        "cache": trace.cache,
+        "model": service.engine.model_name,
+    })
+
+
+@endpoint
+async def transform_batch(service, request):
+    body = await read_json(request)
+    prompts = body.get("prompts")
+    if not isinstance(prompts, list) or not prompts:
+        raise ValueError("prompts must be a non-empty list")
+    if len(prompts) > service.max_batch:
+        raise ValueError(f"at most {service.max_batch} prompts per batch")
+    raw_prompts = [service.check_prompt(prompt) for prompt in prompts]
+    batch_slots = asyncio.Semaphore(service.batch_concurrency)
+
+    async def one(index, raw_prompt):
+        async with batch_slots:
+            try:
+                structured_prompt, trace = await service.transform(raw_prompt, mode="api_batch")
+            except Exception as e:
+                result = {"index": index, "error": type(e).__name__, "detail": str(e)}
+                if isinstance(e, (Overloaded, CircuitOpenError)):
+                    result["retry_after"] = getattr(e, "retry_after", OVERLOADED_RETRY_AFTER)
+                return result
+        return {"index": index, "structured_prompt": structured_prompt, "cache": trace.cache}
+
+    # Results keep the input order; failures are reported per prompt
+    results = await asyncio.gather(*(one(index, raw_prompt) for index, raw_prompt in enumerate(raw_prompts)))
+    failed = sum("error" in result for result in results)
+    return JSONResponse({"results": results, "failed": failed}, status_code=207 if failed else 200)
+
+
+def _sse(data, event=None):
+    lines = f"event: {event}\n" if event else ""
+    return f"{lines}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@endpoint
+async def transform_stream(service, request):
+    body = await read_json(request)
+    raw_prompt = service.check_prompt(body.get("prompt"))
+    trace = service.telemetry.start_request("api_stream")
+    try:
+        await service.admission.acquire()
+    except Overloaded as e:
+        trace.record_error(e)
+        service.telemetry.finish(trace)
+        return error_response(e)
+
+    # The SDK stream is blocking, so each chunk is read on a worker thread.
+    # Reading the first chunk before responding lets failures up to the first
+    # token (throttling, open circuit) still return a proper status code.
+    chunks = service.engine.stream(raw_prompt, trace)
+    try:
+        first = await run_in_threadpool(next, chunks, _DONE)
+    except Exception as e:
+        service.admission.release()
+        service.telemetry.finish(trace)
+        return error_response(e)
+
+    async def events():
+        chunk = first
+        try:
+            while chunk is not _DONE:
+                yield _sse({"text": chunk})
+                chunk = await run_in_threadpool(next, chunks, _DONE)
+            yield _sse({"request_id": trace.request_id, "cache": trace.cache}, event="done")
+        except Exception as e:
+            # Headers are already sent; report the failure in-band
+            yield _sse({"error": type(e).__name__, "detail": str(e)}, event="error")
+        finally:
+            # A client that disconnects mid-stream closes the generator, which
+            # aborts the flight without caching a partial result
+            await run_in_threadpool(chunks.close)
+            service.admission.release()
+            service.telemetry.finish(trace)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+async def healthz(request):
+    service = request.app.state.service
+    guard = service.engine.guard
+    retry_after = guard.breaker.remaining_cooldown() if guard is not None else 0
+    return JSONResponse({
+        "status": "degraded" if retry_after else "ok",
+        "model": service.engine.model_name,
+        "admission": service.admission.stats(),
+        "upstream_retry_after": retry_after,
+    })
+
+
+async def metrics(request):
+    return PlainTextResponse(
+        request.app.state.service.telemetry.registry.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+@asynccontextmanager
+async def lifespan(app):
+    load_dotenv()
+    api_keys = gemini_client.api_keys_from_env()
+    if api_keys:
+        gemini_client.configure(api_keys[0])
+    elif not os.getenv("GEMINI_MODEL_FACTORY"):
+        raise RuntimeError("GEMINI_API_KEY is not set")
+    service = ApiService.from_env()
+    # Streaming reads run on worker threads; allow one per transform slot
+    limiter = to_thread.current_default_thread_limiter()
+    limiter.total_tokens = max(limiter.total_tokens, service.admission.max_in_flight + 8)
+    app.state.service = service
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route("/v1/transform", transform, methods=["POST"]),
+        Route("/v1/transform/batch", transform_batch, methods=["POST"]),
+        Route("/v1/transform/stream", transform_stream, methods=["POST"]),
+        Route("/healthz", healthz, methods=["GET"]),
+        Route("/metrics", metrics, methods=["GET"]),
+    ],
+    lifespan=lifespan,
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the MetaPromptor transform over HTTP")
+    parser.add_argument("--host", default=os.getenv("API_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("API_PORT", "8000")))
+    args = parser.parse_args(argv)
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="info")
+
+
+if __name__ == "__main__":
+    main()
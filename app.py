@@ -1,529 +1,349 @@
 import streamlit as st
-import streamlit.components.v1 as components
-import google.generativeai as genai
 from dotenv import load_dotenv
-import os
-import json
+import time
+import gemini_client
+from transform_engine import TransformEngine
+from resilience import CircuitOpenError
+from example_warmup import EXAMPLE_PROMPTS, ExampleWarmup
+from rerun_metrics import RerunTracker
+from telemetry import build_telemetry
+from history import build_history
+from theme_assets import theme_tags
+from copy_component import copy_button
+from live_preview import build_live_preview, prompt_watcher
+from transform_jobs import build_job_runner
+from session_memory import build_session_memory, text_bytes
 
 # Load environment variables
 load_dotenv()
 
+# The copy button finds the output text area in the page by this label
+OUTPUT_LABEL = "Your transformed prompt:"
+# ...and the live preview watcher finds the input by this one
+RAW_PROMPT_LABEL = "Enter your raw prompt here:"
+
+HISTORY_PAGE_SIZE = 10
+
+# How often a running background transform is checked for progress
+JOB_POLL_SECONDS = 0.3
+# How long a Transform click waits for its job before handing over to polling
+JOB_INLINE_WAIT_SECONDS = 0.1
+
 def init_session_state():
-    if "files_processed" not in st.session_state:
-        st.session_state.files_processed = False
-    if "file_info" not in st.session_state:
-        st.session_state.file_info = []
-    if "chat_history" not in st.session_state:
-        st.session_state.chat_history = []
-    if "clear_conversation" not in st.session_state:
-        st.session_state.clear_conversation = False
+    # Ids that start each history page after the first; the history itself stays in SQLite
+    if "history_cursors" not in st.session_state:
+        st.session_state.history_cursors = []
     # Initialize raw_prompt if it doesn't exist
     if "raw_prompt" not in st.session_state:
         st.session_state.raw_prompt = ""
-    # Add example trigger state
-    if "example_triggered" not in st.session_state:
-        st.session_state.example_triggered = False
 
 def configure_gemini():
     """Configure Gemini API"""
-    api_key = os.getenv("GEMINI_API_KEY")
-    if api_key:
-        genai.configure(api_key=api_key)
+    api_keys = gemini_client.api_keys_from_env()
+    if api_keys:
+        # Cheap on reruns: the SDK itself is only loaded by the first transform.
+        # With several keys this is only the default; each call is routed by the key pool
+        gemini_client.configure(api_keys[0])
         return True
     else:
         st.error("Google API Key not found. Please set the GOOGLE_API_KEY environment variable.")
         return False
 
-def get_system_prompt():
-    return """You are MetaPromptor, an expert AI prompt engineer built on Google's Gemini framework. Your goal is to take any user-provided "raw" prompt and transform it into a clear, detailed, and highly structured prompt that elicits the best possible response from downstream language models.
-
-When you receive a raw prompt, follow these steps exactly:
+@st.cache_resource
+def get_engine():
+    """Process-wide transform engine: one model and one response cache for every session"""
+    return TransformEngine.from_env()
 
-**Analyze the User's Intent**
-- Identify the primary objective: what the user ultimately wants to achieve.
-- Note any secondary objectives such as tone, style, format, or special requirements.
+@st.cache_resource
+def start_example_warmup():
+    """Load or precompute the Quick Examples outputs once per process"""
+    return ExampleWarmup(get_engine()).start()
 
-**Spot Ambiguities and Insert Clarifications**
-- If any part of the user's request is unclear, add a placeholder for a clarifying question in square brackets.
-- Example: [Clarifying Question: "Should the summary be under 100 words or under 200 words?"]
+@st.cache_resource
+def get_telemetry():
+    """Process-wide request metrics; starts the /metrics endpoint once"""
+    return build_telemetry()
 
-**Break the Task into Core Components**
-- Context: Describe any background information the model needs to know.
-- Role: Specify the persona or expertise the model should adopt (e.g., "an experienced science teacher").
-- Task: State exactly what the model must do (e.g., "Explain the concept using analogies").
-- Constraints: List any limitations (word count, vocabulary level, formatting rules, prohibited topics).
-- Examples: If helpful, provide a brief input/output example to illustrate the desired style or structure.
+@st.cache_resource
+def get_history():
+    """Process-wide transform history, or None when HISTORY_DB is empty"""
+    return build_history()
 
-**Add Meta-Instructions for Self-Reflection**
-- Prompt the model to think step by step ("List your sub-tasks before generating").
-- Instruct it to verify completeness ("After drafting, check that every objective is addressed").
-- Encourage consistency checks ("Ensure tone and formatting are uniform throughout").
+def record_history(raw_prompt, structured_prompt, mode):
+    """Persist a completed transform so it survives Clear All and page reloads"""
+    history = get_history()
+    if history is not None:
+        history.record(raw_prompt, structured_prompt, get_engine().model_name, mode)
 
-**Organize the Final Prompt in Plain English**
-- Use clear headings or bullet lists to delineate each component.
-- Write as a cohesive system message that can be pasted directly into any LLM setup.
+@st.cache_resource
+def get_jobs():
+    """Process-wide worker pool; transforms run here so reruns cannot abort them"""
+    return build_job_runner(get_engine(), get_telemetry())
 
-**Output Only the Ready-to-Use Prompt**
-- Do not include any commentary, analysis, or explanation—only the polished prompt itself.
+def submit_transform(raw_prompt, kind, count=1):
+    """Start a background transform, unless the same one is still running for this session"""
+    jobs = get_jobs()
+    job = jobs.get(st.session_state.get("transform_job"))
+    if job is not None and not job.done and job.same_request(kind, raw_prompt, count):
+        return job
+    job = jobs.submit(kind, raw_prompt, get_telemetry().start_request(kind), count)
+    st.session_state.transform_job = job.id
+    return job
 
-Example Transformation:
-
-Raw Prompt from User:
-"Explain quantum computing in simple terms for a 10-year-old."
+def collect_transform_job():
+    """Apply this session's finished background transform, if any, and return its trace"""
+    jobs = get_jobs()
+    job = jobs.get(st.session_state.get("transform_job"))
+    if job is None:
+        st.session_state.pop("transform_job", None)
+        return None
+    if not job.done:
+        return None
+    del st.session_state["transform_job"]
+    jobs.collect(job)
+    if job.error is not None:
+        st.session_state.transform_notice = job.error
+        return job.trace
+    if job.kind == "candidates":
+        # The texts go to the shared store; the session keeps only the scores
+        get_session_memory().put(st.session_state, "candidates", [candidate.text for candidate in job.result])
+        st.session_state.candidate_scores = [(candidate.score, candidate.missing) for candidate in job.result]
+        structured_prompt = job.result[0].text
+        st.session_state.transform_notice = f"✅ Generated {len(job.result)} variants; showing the best one."
+    else:
+        # Variants from an earlier transform no longer match the output
+        discard_candidates()
+        structured_prompt = job.result
+        st.session_state.transform_notice = "✅ Prompt transformed successfully!"
+    if structured_prompt:
+        store_structured_prompt(structured_prompt)
+        record_history(job.raw_prompt, structured_prompt, job.kind)
+    return job.trace
 
-Your Transformed System Prompt:
+def show_transform_notice():
+    """Outcome of the last collected transform, shown once"""
+    notice = st.session_state.pop("transform_notice", None)
+    if isinstance(notice, CircuitOpenError):
+        st.warning(f"⏳ Gemini is cooling down after repeated errors. Please try again in {notice.retry_after:.0f}s.")
+    elif isinstance(notice, Exception):
+        st.error(f"Error generating structured prompt: {str(notice)}")
+    elif notice:
+        st.success(notice)
 
-You are an experienced STEM educator who excels at making complex ideas simple and engaging for young children.
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def render_transform_progress():
+    """Polls this session's running transform; hands over to a full run once it is done"""
+    job = get_jobs().get(st.session_state.get("transform_job"))
+    if job is None or job.done:
+        rerun()
+    if job.kind == "stream" and job.chunks:
+        partial_text = job.partial_text()
+        record_payload(partial_text)
+        st.markdown(partial_text)
+    else:
+        label = f"{job.count} variants of your prompt" if job.kind == "candidates" else "your enhanced prompt"
+        st.info(f"✨ Crafting {label}... You can keep using the page meanwhile.")
 
-Context:
-- Audience: A curious 10-year-old with no background in physics or computing.
+@st.cache_resource
+def get_live_preview():
+    """Process-wide live preview settings and counters"""
+    return build_live_preview()
 
-Task:
-- Explain what quantum computing is, using everyday analogies.
-- Keep sentences short and lively.
+def render_live_preview(raw_prompt):
+    """Stream a preview for text typed so far; a newer edit stops it mid-stream"""
+    live_preview = get_live_preview()
+    trace = get_telemetry().start_request("preview")
+    chunks = live_preview.stream(get_engine(), raw_prompt, trace)
+    structured_prompt = None
+    try:
+        placeholder = st.empty()
+        with placeholder.container():
+            structured_prompt = st.write_stream(chunks)
+        record_payload(structured_prompt)
+        placeholder.empty()
+    except CircuitOpenError as e:
+        st.warning(f"⏳ Gemini is cooling down after repeated errors. Please try again in {e.retry_after:.0f}s.")
+    except Exception as e:
+        st.error(f"Error generating preview: {str(e)}")
+    finally:
+        # Also runs when Streamlit stops this run for newer text: the stale stream is dropped here
+        chunks.close()
+        trace.rendered()
+        get_telemetry().finish(trace)
+    if structured_prompt:
+        live_preview.previewed(st.session_state, raw_prompt)
+        store_structured_prompt(structured_prompt)
+    return structured_prompt or None
 
-Constraints:
-- Use language appropriate for a 10-year-old.
-- Limit the explanation to around 150 words.
-- Avoid technical jargon; if you must use a new term, define it immediately.
+@st.cache_resource
+def get_session_memory():
+    """Process-wide store for the prompt text of every session, with memory limits"""
+    return build_session_memory()
 
-Meta-Instructions:
-- Think step by step: first introduce the idea of bits, then describe how quantum bits differ.
-- After writing, review each sentence to ensure clarity and simplicity.
+def store_structured_prompt(structured_prompt):
+    """Save a transform result and refresh the output widget that shows it"""
+    get_session_memory().put(st.session_state, "structured_prompt", structured_prompt)
+    # The keyed text area keeps its own state, so it has to be updated too
+    st.session_state.structured_output = structured_prompt
 
-Output Format:
-- A single, engaging paragraph that reads like a story a child would understand."""
+def stored_prompt():
+    """This session's structured prompt, or None"""
+    return get_session_memory().get(st.session_state, "structured_prompt")
 
-def generate_structured_prompt(raw_prompt):
-    """Generate structured prompt using Gemini"""
-    try:
-        # Create the model
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        
-        # Combine system prompt with user's raw prompt
-        full_prompt = f"{get_system_prompt()}\n\nNow transform this raw prompt:\n\n{raw_prompt}"
-        
-        # Generate response
-        response = model.generate_content(full_prompt)
-        
-        return response.text
-    except Exception as e:
-        st.error(f"Error generating structured prompt: {str(e)}")
-        return None
+def discard_candidates():
+    get_session_memory().discard(st.session_state, "candidates")
+    st.session_state.pop("candidate_scores", None)
 
-def create_copy_button(text_to_copy):
-    """Create a simple copy mechanism using Streamlit components"""
-    import streamlit.components.v1 as components
-    import time
-    
-    # Create a unique ID for this instance
-    unique_id = str(int(time.time() * 1000))
-    
-    # Enhanced HTML with better styling for dark theme
-    copy_component = f"""
-    <div id="copy-container-{unique_id}" style="margin: 10px 0;">
-        <button id="copy-btn-{unique_id}" 
-                onclick="copyToClipboard{unique_id}()" 
-                style="
-                    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                    color: white;
-                    border: none;
-                    padding: 12px 24px;
-                    border-radius: 12px;
-                    cursor: pointer;
-                    font-weight: 600;
-                    font-size: 14px;
-                    width: 100%;
-                    box-shadow: 0 8px 16px rgba(102, 126, 234, 0.3);
-                    transition: all 0.3s cubic-bezier(0.175, 0.885, 0.32, 1.275);
-                    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-                    display: flex;
-                    align-items: center;
-                    justify-content: center;
-                    gap: 8px;
-                    min-height: 48px;
-                "
-                onmouseover="this.style.transform='translateY(-2px)'; this.style.boxShadow='0 12px 24px rgba(102, 126, 234, 0.4)'"
-                onmouseout="this.style.transform='translateY(0px)'; this.style.boxShadow='0 8px 16px rgba(102, 126, 234, 0.3)'"
-                >
-            <span style="font-size: 16px;">📋</span>
-            <span>Copy to Clipboard</span>
-        </button>
-        
-        <textarea id="copy-text-{unique_id}" 
-                  style="position: absolute; left: -9999px; opacity: 0;"
-                  readonly>{text_to_copy}</textarea>
-    </div>
-
-    <script>
-        function copyToClipboard{unique_id}() {{
-            const button = document.getElementById('copy-btn-{unique_id}');
-            const textArea = document.getElementById('copy-text-{unique_id}');
-            
-            try {{
-                // Method 1: Modern clipboard API
-                if (navigator.clipboard && window.isSecureContext) {{
-                    navigator.clipboard.writeText(textArea.value).then(() => {{
-                        button.innerHTML = '<span style="font-size: 16px;">✅</span><span>Copied!</span>';
-                        button.style.background = 'linear-gradient(135deg, #11998e 0%, #38ef7d 100%)';
-                        button.style.transform = 'scale(0.95)';
-                        setTimeout(() => {{
-                            button.innerHTML = '<span style="font-size: 16px;">📋</span><span>Copy to Clipboard</span>';
-                            button.style.background = 'linear-gradient(135deg, #667eea 0%, #764ba2 100%)';
-                            button.style.transform = 'scale(1)';
-                        }}, 2000);
-                    }}).catch(() => {{
-                        fallbackCopy{unique_id}();
-                    }});
-                }} else {{
-                    fallbackCopy{unique_id}();
-                }}
-            }} catch (err) {{
-                fallbackCopy{unique_id}();
-            }}
-        }}
-        
-        function fallbackCopy{unique_id}() {{
-            const button = document.getElementById('copy-btn-{unique_id}');
-            const textArea = document.getElementById('copy-text-{unique_id}');
-            
-            try {{
-                textArea.style.position = 'static';
-                textArea.style.opacity = '1';
-                textArea.select();
-                textArea.setSelectionRange(0, 99999);
-                
-                const successful = document.execCommand('copy');
-                
-                textArea.style.position = 'absolute';
-                textArea.style.opacity = '0';
-                
-                if (successful) {{
-                    button.innerHTML = '<span style="font-size: 16px;">✅</span><span>Copied!</span>';
-                    button.style.background = 'linear-gradient(135deg, #11998e 0%, #38ef7d 100%)';
-                    setTimeout(() => {{
-                        button.innerHTML = '<span style="font-size: 16px;">📋</span><span>Copy to Clipboard</span>';
-                        button.style.background = 'linear-gradient(135deg, #667eea 0%, #764ba2 100%)';
-                    }}, 2000);
-                }} else {{
-                    throw new Error('Copy command failed');
-                }}
-            }} catch (err) {{
-                button.innerHTML = '<span style="font-size: 16px;">⚠️</span><span>Manual Copy Needed</span>';
-                button.style.background = 'linear-gradient(135deg, #f093fb 0%, #f5576c 100%)';
-                setTimeout(() => {{
-                    button.innerHTML = '<span style="font-size: 16px;">📋</span><span>Copy to Clipboard</span>';
-                    button.style.background = 'linear-gradient(135deg, #667eea 0%, #764ba2 100%)';
-                }}, 3000);
-            }}
-        }}
-    </script>
-    """
-    
-    return copy_component
+def session_text_bytes():
+    """Size of the prompt text this session keeps in its own widget values"""
+    return sum(text_bytes(st.session_state.get(key)) for key in ("raw_prompt", "structured_output"))
 
 def inject_dark_theme_css():
     """Inject CSS to force dark theme and ensure proper styling"""
-    st.markdown("""
-    <style>
-    /* Force dark theme detection and set base colors */
-    .stApp {
-        background-color: #0e1117 !important;
-        color: #fafafa !important;
-    }
-    
-    /* Import Google Fonts */
-    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap');
-    
-    /* Set dark theme variables */
-    :root {
-        --background-color: rgba(30, 41, 59, 0.8) !important;
-        --border-color: #374151 !important;
-        --text-color: #f1f5f9 !important;
-        --card-bg: linear-gradient(135deg, rgba(30, 41, 59, 0.6) 0%, rgba(55, 65, 81, 0.6) 100%) !important;
-        --info-bg: rgba(59, 130, 246, 0.15) !important;
-        --warning-bg: rgba(245, 158, 11, 0.15) !important;
-        --error-bg: rgba(239, 68, 68, 0.15) !important;
-        --success-bg: rgba(16, 185, 129, 0.15) !important;
-        --divider-shadow: rgba(255, 255, 255, 0.1) !important;
-    }
-    
-    /* Global Styles */
-    .main .block-container {
-        padding-top: 2rem;
-        padding-bottom: 2rem;
-        max-width: 1200px;
-        background-color: #0e1117 !important;
-    }
-    
-    /* Header Styling */
-    .main-header {
-        text-align: center;
-        font-family: 'Inter', sans-serif;
-        font-weight: 700;
-        margin-bottom: 0.5rem;
-        color: #f1f5f9 !important;
-    }
-    
-    .main-header .gradient-text {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        -webkit-background-clip: text;
-        -webkit-text-fill-color: transparent;
-        background-clip: text;
-    }
-    
-    .main-header .emoji {
-        color: initial !important;
-        -webkit-text-fill-color: initial !important;
-        background: none !important;
-        display: inline-block;
-        margin-right: 0.5rem;
-    }
-    
-    .sub-header {
-        text-align: center;
-        color: #94a3b8 !important;
-        font-family: 'Inter', sans-serif;
-        font-weight: 400;
-        font-size: 1.1rem;
-        margin-bottom: 2rem;
-    }
-    
-    /* Card-like containers - Force dark theme */
-    .input-card, .output-card {
-        background: rgba(30, 41, 59, 0.8) !important;
-        border-radius: 16px;
-        padding: 1.5rem;
-        box-shadow: 0 4px 6px -1px rgba(0, 0, 0, 0.3), 0 2px 4px -1px rgba(0, 0, 0, 0.2) !important;
-        border: 1px solid #374151 !important;
-        margin-bottom: 1rem;
-        backdrop-filter: blur(10px);
-    }
-    
-    .input-card {
-        border-left: 4px solid #667eea !important;
-    }
-    
-    .output-card {
-        border-left: 4px solid #38ef7d !important;
-    }
-    
-    /* Section Headers */
-    .section-header {
-        font-family: 'Inter', sans-serif;
-        font-weight: 600;
-        font-size: 1.25rem;
-        color: #f1f5f9 !important;
-        margin-bottom: 1rem;
-        display: flex;
-        align-items: center;
-        gap: 0.5rem;
-    }
-    
-    /* Text areas - Force dark styling */
-    .stTextArea > div > div > textarea {
-        background-color: #1e293b !important;
-        color: #f1f5f9 !important;
-        border: 2px solid #374151 !important;
-        border-radius: 12px;
-        font-family: 'Inter', sans-serif;
-        transition: border-color 0.2s ease;
-    }
-    
-    .stTextArea > div > div > textarea:focus {
-        border-color: #667eea !important;
-        box-shadow: 0 0 0 3px rgba(102, 126, 234, 0.2) !important;
-        background-color: #1e293b !important;
-        color: #f1f5f9 !important;
-    }
-    
-    .stTextArea > div > div > textarea::placeholder {
-        color: #9ca3af !important;
-    }
-    
-    /* Buttons */
-    .stButton > button {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%) !important;
-        color: white !important;
-        border: none !important;
-        border-radius: 12px !important;
-        padding: 0.75rem 2rem !important;
-        font-weight: 600 !important;
-        font-family: 'Inter', sans-serif !important;
-        transition: all 0.3s ease !important;
-        box-shadow: 0 4px 6px -1px rgba(102, 126, 234, 0.3) !important;
-    }
-    
-    .stButton > button:hover {
-        transform: translateY(-2px) !important;
-        box-shadow: 0 8px 16px -4px rgba(102, 126, 234, 0.4) !important;
-    }
-    
-    /* Secondary button */
-    .stButton > button[kind="secondary"] {
-        background: linear-gradient(135deg, #64748b 0%, #475569 100%) !important;
-    }
-    
-    /* Info boxes */
-    .stInfo {
-        background: rgba(59, 130, 246, 0.15) !important;
-        border: 1px solid #3b82f6 !important;
-        border-radius: 12px !important;
-        color: #f1f5f9 !important;
-    }
-    
-    .stInfo > div {
-        color: #f1f5f9 !important;
-    }
-    
-    .stWarning {
-        background: rgba(245, 158, 11, 0.15) !important;
-        border: 1px solid #f59e0b !important;
-        border-radius: 12px !important;
-        color: #f1f5f9 !important;
-    }
-    
-    .stWarning > div {
-        color: #f1f5f9 !important;
-    }
-    
-    .stError {
-        background: rgba(239, 68, 68, 0.15) !important;
-        border: 1px solid #ef4444 !important;
-        border-radius: 12px !important;
-        color: #f1f5f9 !important;
-    }
-    
-    .stError > div {
-        color: #f1f5f9 !important;
-    }
-    
-    .stSuccess {
-        background: rgba(16, 185, 129, 0.15) !important;
-        border: 1px solid #10b981 !important;
-        border-radius: 12px !important;
-        color: #f1f5f9 !important;
-    }
-    
-    .stSuccess > div {
-        color: #f1f5f9 !important;
-    }
-    
-    /* Expander */
-    .streamlit-expanderHeader {
-        font-family: 'Inter', sans-serif !important;
-        font-weight: 500 !important;
-        border-radius: 8px !important;
-        background-color: rgba(30, 41, 59, 0.8) !important;
-        border: 1px solid #374151 !important;
-        color: #f1f5f9 !important;
-    }
-    
-    .streamlit-expanderContent {
-        background-color: rgba(30, 41, 59, 0.8) !important;
-        border: 1px solid #374151 !important;
-        border-top: none !important;
-        color: #f1f5f9 !important;
-    }
-    
-    /* Code blocks */
-    .stCodeBlock {
-        border-radius: 12px !important;
-        background-color: #1e293b !important;
-    }
-    
-    .stCodeBlock > div {
-        border-radius: 12px !important;
-        background-color: #1e293b !important;
-    }
-    
-    .stCodeBlock code {
-        color: #f1f5f9 !important;
-        background-color: #1e293b !important;
-    }
-    
-    /* Custom divider */
-    .custom-divider {
-        height: 2px;
-        background: linear-gradient(90deg, transparent, #667eea, transparent);
-        margin: 2rem 0;
-        border: none;
-        box-shadow: 0 2px 4px rgba(255, 255, 255, 0.1);
-    }
-    
-    /* Feature highlight boxes */
-    .feature-box {
-        background: linear-gradient(135deg, rgba(30, 41, 59, 0.6) 0%, rgba(55, 65, 81, 0.6) 100%) !important;
-        border-radius: 12px;
-        padding: 1rem;
-        margin: 0.5rem 0;
-        border-left: 4px solid #667eea;
-        border: 1px solid rgba(102, 126, 234, 0.3) !important;
-        color: #f1f5f9 !important;
-        backdrop-filter: blur(5px);
-    }
-    
-    /* All text elements should be light colored */
-    .stMarkdown, .stMarkdown p, .stMarkdown div, .stMarkdown span,
-    .stText, .stCaption, p, div, span {
-        color: #f1f5f9 !important;
-    }
-    
-    /* Column background */
-    .stColumn > div {
-        background-color: transparent !important;
-    }
-    
-    /* Fix any remaining dark text */
-    * {
-        color: #f1f5f9 !important;
-    }
-    
-    /* Exception for buttons and special elements */
-    .stButton > button,
-    .stButton > button *,
-    .copy-btn,
-    .copy-btn * {
-        color: white !important;
-    }
-    
-    /* Responsive design */
-    @media (max-width: 768px) {
-        .main .block-container {
-            padding-left: 1rem;
-            padding-right: 1rem;
-        }
-        
-        .input-card, .output-card {
-            padding: 1rem;
-        }
-        
-        .section-header {
-            font-size: 1.1rem;
-        }
-    }
-    
-    /* Smooth transitions */
-    * {
-        transition: background-color 0.3s ease, border-color 0.3s ease;
-    }
-    </style>
-    """, unsafe_allow_html=True)
+    # static/theme.css is minified once per process into a content-hashed static file;
+    # each rerun sends only the <link> to it, and the browser caches the stylesheet
+    theme = theme_tags()
+    record_payload(theme)
+    st.markdown(theme, unsafe_allow_html=True)
 
 def apply_custom_css():
     """Apply enhanced dark theme CSS"""
     inject_dark_theme_css()
 
-def set_example_prompt(example_text):
-    """Helper function to set example prompt"""
-    # Use a query parameter approach to trigger the change
-    st.query_params["example"] = example_text
+@st.cache_resource
+def get_rerun_tracker():
+    """Process-wide script run counters"""
+    return RerunTracker()
+
+def mark_action(action):
+    """Widget callback that names the user action behind the next script run"""
+    get_rerun_tracker().mark_action(st.session_state, action)
+
+def rerun():
+    """st.rerun(), charging the extra script run to the action that caused it"""
+    get_rerun_tracker().mark_programmatic_rerun(st.session_state)
     st.rerun()
 
+def record_payload(text):
+    """Count text sent to the browser in this run towards the per-run byte total"""
+    get_rerun_tracker().record_payload(st.session_state, text)
+
+def set_example_prompt(example_text):
+    """Button callback that loads an example before the script runs"""
+    mark_action("example")
+    # Callbacks run before widgets are created, so the text area can be set directly
+    st.session_state.raw_prompt = example_text
+    # Warmed-up examples show their output straight away
+    warm_output = get_engine().cached(example_text)
+    if warm_output is not None:
+        store_structured_prompt(warm_output)
+
+def use_candidate(index):
+    """Button callback that swaps the output for another generated variant"""
+    mark_action("candidate")
+    candidates = get_session_memory().get(st.session_state, "candidates")
+    if candidates is not None:
+        store_structured_prompt(candidates[index])
+
+def clear_all():
+    """Button callback that resets the input and output"""
+    mark_action("clear_all")
+    get_session_memory().discard(st.session_state, "structured_prompt")
+    if "structured_output" in st.session_state:
+        del st.session_state["structured_output"]
+    discard_candidates()
+    st.session_state.pop("live_preview_digest", None)
+    # A running transform finishes in the background, but no longer replaces the output
+    st.session_state.pop("transform_job", None)
+    st.session_state.raw_prompt = ""
+
+def reuse_history_entry(entry_id):
+    """Button callback that loads a past transform without calling the API"""
+    mark_action("history_reuse")
+    entry = get_history().get(entry_id)
+    if entry is not None:
+        raw_prompt, structured_prompt = entry
+        st.session_state.raw_prompt = raw_prompt
+        store_structured_prompt(structured_prompt)
+        # The panel is a fragment; the input and output need a full run to show the entry
+        st.session_state.history_reused = True
+
+def reset_history_pages():
+    st.session_state.history_cursors = []
+
+def show_older_history(before_id):
+    st.session_state.history_cursors.append(before_id)
+
+def show_newer_history():
+    st.session_state.history_cursors.pop()
+
+@st.fragment
+def render_history_panel():
+    """Searchable past transforms, one page at a time; searching and paging rerun only this panel"""
+    history = get_history()
+    if history is None:
+        return
+    if st.session_state.pop("history_reused", False):
+        rerun()
+    with st.expander("🕘 Transform History", expanded=False):
+        query = st.text_input(
+            "Search past prompts",
+            key="history_query",
+            on_change=reset_history_pages,
+            placeholder="Search raw and structured prompts..."
+        )
+        cursors = st.session_state.history_cursors
+        entries, has_more = history.page(
+            query, before_id=cursors[-1] if cursors else None, limit=HISTORY_PAGE_SIZE
+        )
+        if not entries:
+            st.caption("No matching transforms yet." if query.strip() else "Your transforms will be listed here.")
+        for entry in entries:
+            entry_col, button_col = st.columns([5, 1])
+            with entry_col:
+                record_payload(entry.raw_preview)
+                st.text(entry.raw_preview)
+                st.caption(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(entry.created_at))} · {entry.model}")
+            with button_col:
+                st.button(
+                    "↩️ Reuse",
+                    key=f"history_reuse_{entry.id}",
+                    on_click=reuse_history_entry,
+                    args=(entry.id,),
+                    help="Load this prompt and its result without calling the API"
+                )
+        newer_col, older_col = st.columns([1, 1])
+        with newer_col:
+            st.button("← Newer", key="history_newer", disabled=not cursors, on_click=show_newer_history)
+        with older_col:
+            st.button(
+                "Older →",
+                key="history_older",
+                disabled=not has_more,
+                on_click=show_older_history,
+                args=(entries[-1].id if entries else None,)
+            )
+
 def main():
+    tracker = get_rerun_tracker()
+    run_token = tracker.begin_run(st.session_state)
+    try:
+        render_page()
+    finally:
+        tracker.end_run(run_token)
+
+def render_page():
     # Initialize session state
     init_session_state()
     
+    # The widget copies count towards the session budgets. Evicted sessions lose their
+    # stored prompts; drop the widget copy of the output too so the page agrees
+    session_memory = get_session_memory()
+    output_released = session_memory.touch(st.session_state, session_text_bytes())
+    if output_released:
+        st.session_state.pop("structured_output", None)
+        st.session_state.pop("candidate_scores", None)
+    
     # Set page configuration with dark theme
     st.set_page_config(
         page_title="Deathstroke Prompt Engineer",
@@ -539,16 +359,88 @@ def main():
     if not configure_gemini():
         return
     
-    # Check for example query parameter
-    query_params = st.query_params
-    if "example" in query_params:
-        example_text = query_params["example"]
-        # Clear the query parameter and set the session state
-        st.query_params.clear()
-        if "raw_prompt" in st.session_state:
-            del st.session_state["raw_prompt"]
-        st.session_state.raw_prompt = example_text
-        st.rerun()
+    # Make the Quick Examples instant; runs in the background on first start
+    start_example_warmup()
+    
+    # Cache counters for operators
+    with st.sidebar:
+        cache_stats = get_engine().cache.stats()
+        st.markdown("### ⚡ Response Cache")
+        shared_hits = f" / {cache_stats['shared_hits']} shared" if get_engine().cache.shared is not None else ""
+        st.caption(
+            f"Hits: {cache_stats['memory_hits']} memory / {cache_stats['disk_hits']} disk{shared_hits} · "
+            f"Misses: {cache_stats['misses']} · Hit rate: {cache_stats['hit_rate']:.0%}"
+        )
+        near_index = get_engine().near_index
+        if near_index is not None:
+            st.caption(f"Near-duplicate hits: {near_index.hits} · Indexed prompts: {len(near_index)}")
+        replica_flights = get_engine().replica_flights
+        st.caption(
+            f"Coalesced duplicate requests: {get_engine().flights.coalesced}"
+            + (f" · {replica_flights.coalesced} from other replicas" if replica_flights is not None else "")
+        )
+        if st.session_state.get("live_preview"):
+            preview_stats = get_live_preview().stats()
+            st.caption(
+                f"Live preview: {preview_stats['edits']} edits → {preview_stats['previews']} previews · "
+                f"{preview_stats['upstream']} API calls · {preview_stats['cancelled']} stopped as stale"
+            )
+        job_stats = get_jobs().stats()
+        if job_stats["submitted"]:
+            st.caption(
+                f"Background transforms: {job_stats['running']} running · {job_stats['queued']} queued · "
+                f"{job_stats['submitted']} submitted"
+            )
+        analyzer = get_engine().analyzer
+        if analyzer is not None:
+            paths = analyzer.stats()
+            st.caption(
+                f"Pre-analysis: {paths['local']} assembled locally ({paths['local_rate']:.0%}) · "
+                f"{paths['assisted']} sent with hints · {paths['plain']} sent as is"
+            )
+        key_pool = get_engine().key_pool
+        if key_pool is not None:
+            key_stats = key_pool.stats()
+            healthy = sum(row["healthy"] for row in key_stats)
+            st.caption(f"🔑 API keys: {healthy}/{len(key_stats)} in rotation")
+            for row in key_stats:
+                status = "ok" if row["healthy"] else f"cooling {row['cooldown']:.0f}s"
+                st.caption(
+                    f"{row['key']}: {row['requests_last_minute']} req/min · "
+                    f"{row['tokens_last_minute']:,} tok/min · {row['throttled']} throttled · {status}"
+                )
+        hedger = get_engine().hedger
+        if hedger is not None:
+            hedge_stats = hedger.stats()
+            st.caption(
+                f"Hedged slow requests: {hedge_stats['hedged']} ({hedge_stats['hedge_rate']:.1%}) · "
+                f"Backup won: {hedge_stats['backup_wins']}"
+            )
+        cooldown = get_engine().guard.breaker.remaining_cooldown()
+        if cooldown > 0:
+            st.caption(f"🔌 Circuit open: Gemini calls paused for {cooldown:.0f}s")
+        
+        st.markdown("### ⏱️ Script Runs")
+        for action, run_stats in get_rerun_tracker().summary().items():
+            st.caption(
+                f"{action}: {run_stats['runs_per_action']:.1f} runs/action · "
+                f"{run_stats['mean_ms']:.0f} ms mean · {run_stats['max_ms']:.0f} ms max · "
+                f"{run_stats['mean_payload_bytes'] / 1024:.1f} KB/run"
+            )
+        
+        memory_stats = session_memory.stats()
+        get_telemetry().record_session_memory(memory_stats)
+        st.markdown("### 🧠 Session Memory")
+        st.caption(
+            f"{memory_stats['total_bytes'] / 1024:.1f} KB across {memory_stats['sessions']} sessions · "
+            f"{memory_stats['shared_bytes'] / 1024:.1f} KB shared for "
+            f"{memory_stats['referenced_bytes'] / 1024:.1f} KB referenced"
+        )
+        evictions = memory_stats["evictions"]
+        st.caption(
+            f"Released: {evictions['idle']} idle sessions · {evictions['total_budget']} over the total budget · "
+            f"{evictions['session_budget']} payloads over a session budget"
+        )
     
     # Header with enhanced styling
     st.markdown('<h1 class="main-header"><span class="emoji">🤖</span><span class="gradient-text">Deathstroke Prompt Engineer</span></h1>', unsafe_allow_html=True)
@@ -568,27 +460,70 @@ def main():
         
         # Use the session state value directly without trying to update it
         raw_prompt = st.text_area(
-            "Enter your raw prompt here:",
+            RAW_PROMPT_LABEL,
             height=250,
             placeholder="Example: Explain machine learning to a beginner in simple terms...",
             key="raw_prompt",
             help="Enter any basic instruction or question you want to improve"
         )
         
+        # Opt-in: preview while typing, one request per pause rather than per keystroke
+        live_text = None
+        live_preview_on = st.toggle(
+            "👁️ Live preview",
+            key="live_preview",
+            help="Preview the structured prompt as you type. A preview starts when you pause, "
+                 "and a preview for text you have since changed is stopped."
+        )
+        if live_preview_on:
+            live_preview = get_live_preview()
+            update = prompt_watcher(RAW_PROMPT_LABEL, debounce_ms=live_preview.debounce_ms)
+            live_text = live_preview.accept(update, st.session_state)
+        
+        # Local estimate only; exact counts are taken when the prompt is sent
+        budget = get_engine().budget
+        if budget is not None and raw_prompt.strip():
+            estimated_tokens = get_engine().estimated_input_tokens(raw_prompt)
+            if budget.over_budget(estimated_tokens):
+                st.warning(
+                    f"✂️ This request is about {estimated_tokens:,} tokens, over the "
+                    f"{budget.max_input_tokens:,}-token input budget. The middle of your prompt "
+                    f"will be shortened before it is sent."
+                )
+        
         # Generate button with enhanced styling
         col1a, col1b, col1c = st.columns([1, 2, 1])
         with col1b:
-            transform_clicked = st.button("🚀 Transform Prompt", type="primary", use_container_width=True)
+            transform_clicked = st.button(
+                "🚀 Transform Prompt",
+                type="primary",
+                use_container_width=True,
+                on_click=mark_action,
+                args=("transform",)
+            )
+            stream_output = st.toggle(
+                "⚡ Stream response",
+                value=True,
+                key="stream_output",
+                help="Show the structured prompt as it is generated instead of waiting for the full response"
+            )
+            candidate_count = st.select_slider(
+                "🎲 Variants",
+                options=[1, 2, 3, 4],
+                value=1,
+                key="candidate_count",
+                help="Generate several versions at once and show the best first. Variants are not streamed."
+            )
         
-        if transform_clicked:
-            if raw_prompt.strip():
-                with st.spinner("✨ Crafting your enhanced prompt..."):
-                    structured_prompt = generate_structured_prompt(raw_prompt)
-                    if structured_prompt:
-                        st.session_state.structured_prompt = structured_prompt
-                        st.success("✅ Prompt transformed successfully!")
+        if transform_clicked and raw_prompt.strip():
+            if candidate_count > 1:
+                job = submit_transform(raw_prompt, "candidates", candidate_count)
             else:
-                st.warning("⚠️ Please enter a raw prompt first!")
+                job = submit_transform(raw_prompt, "stream" if stream_output else "blocking")
+            # Cached and locally assembled results are ready at once and show in this run
+            job.wait(JOB_INLINE_WAIT_SECONDS)
+        elif transform_clicked:
+            st.warning("⚠️ Please enter a raw prompt first!")
     
     with col2:
         # Output section with card styling
@@ -598,29 +533,73 @@ def main():
         </div>
         """, unsafe_allow_html=True)
         
-        if hasattr(st.session_state, 'structured_prompt'):
+        # Spans of a transform picked up in this run, from the click to the rendered output
+        trace = collect_transform_job()
+        show_transform_notice()
+        if st.session_state.get("transform_job"):
+            render_transform_progress()
+        elif live_text and not transform_clicked:
+            render_live_preview(live_text)
+        
+        if output_released:
+            st.info(
+                "🧹 Your last structured prompt was cleared after a period of inactivity to save server memory."
+                + (" You can reuse it from Transform History." if get_history() is not None else "")
+            )
+        
+        structured_prompt = stored_prompt()
+        if structured_prompt is not None:
             # Display the structured prompt
+            if "structured_output" not in st.session_state:
+                st.session_state.structured_output = structured_prompt
             st.text_area(
-                "Your transformed prompt:",
-                value=st.session_state.structured_prompt,
+                OUTPUT_LABEL,
                 height=350,
                 key="structured_output",
                 help="This is your enhanced, structured prompt ready to use"
             )
             
+            record_payload(st.session_state.structured_output)
+            
+            # The other variants are one click away
+            candidates = session_memory.get(st.session_state, "candidates")
+            candidate_scores = st.session_state.get("candidate_scores")
+            if candidates and candidate_scores and len(candidates) > 1:
+                with st.expander(f"🎲 Variants ({len(candidates)}), ranked by section coverage", expanded=False):
+                    for index, (text, (score, missing)) in enumerate(zip(candidates, candidate_scores)):
+                        current = text == structured_prompt
+                        variant_col, button_col = st.columns([4, 1])
+                        with variant_col:
+                            missing = ", ".join(name.replace("_", " ") for name in missing)
+                            st.caption(
+                                f"Variant {index + 1} · score {score:.0%}"
+                                + (f" · missing {missing}" if missing else "")
+                                + (" · shown" if current else "")
+                            )
+                        with button_col:
+                            st.button(
+                                "Use",
+                                key=f"use_candidate_{index}",
+                                disabled=current,
+                                on_click=use_candidate,
+                                args=(index,)
+                            )
+            
             # Enhanced copy functionality
             col2a, col2b = st.columns([2, 1])
             
             with col2b:
-                # Working copy button with better styling
-                copy_button_html = create_copy_button(st.session_state.structured_prompt)
-                st.components.v1.html(copy_button_html, height=80)
+                # Reads the text area above in the browser, so the prompt is not sent twice
+                copy_button(OUTPUT_LABEL)
             
             with col2a:
                 # Manual copy backup with better presentation
                 with st.expander("📋 Manual Copy (Backup Method)", expanded=False):
-                    st.code(st.session_state.structured_prompt, language=None)
-                    st.caption("💡 Select all text above and use Ctrl+C (Windows/Linux) or Cmd+C (Mac)")
+                    st.caption("💡 Click in the text area, press Ctrl+A then Ctrl+C (Windows/Linux) or Cmd+A then Cmd+C (Mac)")
+                    # Only send a second copy of the prompt when someone asks for it
+                    if st.toggle("Show as code block", key="show_code_block"):
+                        record_payload(structured_prompt)
+                        st.code(structured_prompt, language=None)
             
         else:
             st.info("🎯 Your structured prompt will appear here after transformation.")
@@ -635,25 +614,24 @@ def main():
                 • Quality verification prompts
             </div>
             """, unsafe_allow_html=True)
+        
+        if trace is not None:
+            trace.rendered()
+            get_telemetry().finish(trace)
     
     # Enhanced instructions section
     st.markdown('<hr class="custom-divider">', unsafe_allow_html=True)
     
+    # Past transforms, searchable and reusable without another API call
+    render_history_panel()
+    
     # Quick examples section
     st.markdown("### 🌟 Quick Examples")
-    example_cols = st.columns(3)
-    
-    with example_cols[0]:
-        if st.button("📚 Educational Content", use_container_width=True):
-            set_example_prompt("Explain photosynthesis to middle school students")
-    
-    with example_cols[1]:
-        if st.button("📧 Marketing Copy", use_container_width=True):
-            set_example_prompt("Write a marketing email for a new fitness app")
+    example_cols = st.columns(len(EXAMPLE_PROMPTS))
     
-    with example_cols[2]:
-        if st.button("🎨 Creative Writing", use_container_width=True):
-            set_example_prompt("Write a short story about time travel")
+    for example_col, (label, example_text) in zip(example_cols, EXAMPLE_PROMPTS):
+        with example_col:
+            st.button(label, use_container_width=True, on_click=set_example_prompt, args=(example_text,))
     
     # Detailed instructions
     with st.expander("📖 How to Use This Tool", expanded=False):
@@ -691,14 +669,7 @@ def main():
     col_action1, col_action2, col_action3 = st.columns([1, 1, 1])
     
     with col_action2:
-        if st.button("🔄 Clear All", type="secondary", use_container_width=True):
-            # Clear session state properly
-            if hasattr(st.session_state, 'structured_prompt'):
-                del st.session_state.structured_prompt
-            # Remove the widget key from session state
-            if "raw_prompt" in st.session_state:
-                del st.session_state["raw_prompt"]
-            st.rerun()
+        st.button("🔄 Clear All", type="secondary", use_container_width=True, on_click=clear_all)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
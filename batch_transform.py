@@ -0,0 +1,156 @@
+"""Transform a JSONL file of raw prompts without the Streamlit UI.
+
+Each input line is either a JSON string or an object with a "prompt" field
+(and an optional "id"). Results are appended to the output file as they
+complete, one JSON object per line, tagged with the input line index so an
+interrupted run can be resumed:
+
+    python batch_transform.py prompts.jsonl results.jsonl --concurrency 16
+    python batch_transform.py prompts.jsonl results.jsonl --resume
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+import gemini_client
+from transform_engine import TransformEngine
+
+
+def parse_record(line):
+    """Return (id, raw_prompt) for one input line"""
+    record = json.loads(line)
+    if isinstance(record, str):
+        return None, record
+    return record.get("id"), record["prompt"]
+
+
+def completed_indices(output_path):
+    """Indices already transformed in the output file, repairing a torn last line.
+
+    Lines that recorded an error are not counted, so --resume retries them.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    valid_bytes = 0
+    with open(output_path, "rb") as f:
+        for raw_line in f:
+            if not raw_line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(raw_line)
+                index = record["index"]
+            except (ValueError, KeyError, TypeError):
+                break
+            if "structured_prompt" in record:
+                done.add(index)
+            valid_bytes += len(raw_line)
+    # A crash mid-write leaves a partial line; drop it so appends stay valid JSONL
+    if valid_bytes < os.path.getsize(output_path):
+        with open(output_path, "r+b") as f:
+            f.truncate(valid_bytes)
+    return done
+
+
+async def read_input(input_path, queue, skip, start_offset, workers):
+    """Feed (index, line) pairs into the bounded queue without reading the whole file"""
+    with open(input_path, "r", encoding="utf-8") as f:
+        for index, line in enumerate(f):
+            if index < start_offset or index in skip or not line.strip():
+                continue
+            # Blocks when workers fall behind, which keeps memory flat
+            await queue.put((index, line))
+    for _ in range(workers):
+        await queue.put(None)
+
+
+async def transform_worker(engine, queue, results):
+    while True:
+        item = await queue.get()
+        if item is None:
+            await results.put(None)
+            return
+        index, line = item
+        result = {"index": index}
+        try:
+            record_id, raw_prompt = parse_record(line)
+            result["id"] = record_id
+            result["raw_prompt"] = raw_prompt
+            result["structured_prompt"] = await engine.transform_async(raw_prompt)
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+        await results.put(result)
+
+
+async def write_results(output_path, results, workers, progress_every):
+    finished_workers = 0
+    written = failed = 0
+    started = time.monotonic()
+    with open(output_path, "a", encoding="utf-8") as f:
+        while finished_workers < workers:
+            result = await results.get()
+            if result is None:
+                finished_workers += 1
+                continue
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+            f.flush()
+            written += 1
+            failed += "error" in result
+            if progress_every and written % progress_every == 0:
+                rate = written / max(time.monotonic() - started, 1e-9)
+                print(f"{written} written ({failed} failed), {rate:.1f} prompts/s", file=sys.stderr)
+    return written, failed
+
+
+async def run_batch(engine, input_path, output_path, concurrency=8, resume=False, start_offset=0, progress_every=100):
+    """Stream input_path through the engine with at most `concurrency` requests in flight"""
+    skip = completed_indices(output_path) if resume else set()
+    if not resume and os.path.exists(output_path):
+        open(output_path, "w").close()
+
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    results = asyncio.Queue(maxsize=concurrency * 2)
+    tasks = [asyncio.create_task(transform_worker(engine, queue, results)) for _ in range(concurrency)]
+    reader = asyncio.create_task(read_input(input_path, queue, skip, start_offset, concurrency))
+    written, failed = await write_results(output_path, results, concurrency, progress_every)
+    await reader
+    await asyncio.gather(*tasks)
+    return {"written": written, "failed": failed, "skipped": len(skip)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Transform a JSONL file of raw prompts with MetaPromptor")
+    parser.add_argument("input", help="JSONL file of raw prompts")
+    parser.add_argument("output", help="JSONL file to append results to")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum requests in flight (default 8)")
+    parser.add_argument("--resume", action="store_true", help="Skip input lines already transformed in the output file")
+    parser.add_argument("--start-offset", type=int, default=0, help="Skip the first N input lines")
+    parser.add_argument("--progress-every", type=int, default=100, help="Report progress every N results (0 to disable)")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    api_keys = gemini_client.api_keys_from_env()
+    if not api_keys:
+        parser.error("GEMINI_API_KEY is not set")
+    gemini_client.configure(api_keys[0])
+
+    summary = asyncio.run(run_batch(
+        TransformEngine.from_env(),
+        args.input,
+        args.output,
+        concurrency=args.concurrency,
+        resume=args.resume,
+        start_offset=args.start_offset,
+        progress_every=args.progress_every,
+    ))
+    print(json.dumps(summary), file=sys.stderr)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""Local stand-in for google.generativeai.GenerativeModel.
+
+It simulates the parts of the model the transform pipeline touches:
+request latency, time to first token and chunk spacing when streaming,
+occasional slow calls for tail latency, injected throttling errors, and
+response size. Select it for the app or the
+CLIs with GEMINI_MODEL_FACTORY=benchmarks.fake_gemini:FakeModel; it then
+reads its profile from the FAKE_GEMINI_* variables below, so the real code
+paths run unchanged and without an API key.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+
+
+def _env_float(name, default):
+    return float(os.getenv(name, str(default)))
+
+
+class FakeProfile:
+    """Timing, error and size settings for the fake model"""
+
+    def __init__(self, latency_ms=200.0, ttft_ms=80.0, chunks=8, error_rate=0.0, response_chars=1200, seed=None,
+                 slow_rate=0.0, slow_factor=10.0):
+        self.latency_ms = latency_ms
+        self.ttft_ms = ttft_ms
+        # A slow_rate fraction of calls take slow_factor times longer
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.chunks = max(1, int(chunks))
+        self.error_rate = error_rate
+        self.response_chars = int(response_chars)
+        self.seed = seed
+
+    @classmethod
+    def from_env(cls):
+        seed = os.getenv("FAKE_GEMINI_SEED")
+        return cls(
+            latency_ms=_env_float("FAKE_GEMINI_LATENCY_MS", 200),
+            ttft_ms=_env_float("FAKE_GEMINI_TTFT_MS", 80),
+            chunks=_env_float("FAKE_GEMINI_CHUNKS", 8),
+            error_rate=_env_float("FAKE_GEMINI_ERROR_RATE", 0),
+            response_chars=_env_float("FAKE_GEMINI_RESPONSE_CHARS", 1200),
+            seed=int(seed) if seed else None,
+            slow_rate=_env_float("FAKE_GEMINI_SLOW_RATE", 0),
+            slow_factor=_env_float("FAKE_GEMINI_SLOW_FACTOR", 10),
+        )
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class ResourceExhausted(Exception):
+    """Same name and code as the google.api_core 429 error, so the retry policy treats it alike"""
+
+    code = 429
+
+
+class FakeUsage:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class FakeTokenCount:
+    def __init__(self, total_tokens):
+        self.total_tokens = total_tokens
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeResponse:
+    """Blocking or streaming response; streaming ones sleep between chunks as they are iterated"""
+
+    def __init__(self, text, usage_metadata, chunk_delays=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+        self._chunk_delays = chunk_delays
+
+    def __iter__(self):
+        if self._chunk_delays is None:
+            yield FakeChunk(self.text)
+            return
+        size = -(-len(self.text) // len(self._chunk_delays))
+        for index, delay in enumerate(self._chunk_delays):
+            if delay:
+                time.sleep(delay)
+            yield FakeChunk(self.text[index * size:(index + 1) * size])
+
+
+def _token_count(text):
+    return (len(text) + 3) // 4
+
+
+class FakeModel:
+    """Drop-in for GenerativeModel(model_name, system_instruction=...)"""
+
+    def __init__(self, model_name, system_instruction=None, profile=None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction or ""
+        self.profile = profile or FakeProfile.from_env()
+        self.calls = 0
+        self._random = random.Random(self.profile.seed)
+        self._lock = threading.Lock()
+
+    def _next_call(self, contents):
+        """Count the call, maybe fail it, and build the response text"""
+        with self._lock:
+            self.calls += 1
+            fail = self._random.random() < self.profile.error_rate
+        if fail:
+            raise ResourceExhausted("429 Resource has been exhausted (fake)")
+        prompt = str(contents)
+        header = f"[fake {self.model_name}] {prompt[-80:]}\n"
+        filler = "Structured prompt body. " * (self.profile.response_chars // 24 + 1)
+        text = (header + filler)[:max(self.profile.response_chars, len(header))]
+        usage = FakeUsage(_token_count(self.system_instruction + prompt), _token_count(text))
+        return text, usage
+
+    def _slowdown(self):
+        with self._lock:
+            slow = self._random.random() < self.profile.slow_rate
+        return self.profile.slow_factor if slow else 1.0
+
+    def _stream_delays(self, slowdown):
+        # The first chunk arrives after the TTFT; the rest are spread over what is left of the latency
+        profile = self.profile
+        rest = max(profile.latency_ms - profile.ttft_ms, 0) * slowdown / 1000
+        interval = rest / (profile.chunks - 1) if profile.chunks > 1 else 0
+        return [0.0] + [interval] * (profile.chunks - 1)
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        slowdown = self._slowdown()
+        if stream:
+            # Like the SDK, the first chunk is fetched before generate_content returns
+            time.sleep(self.profile.ttft_ms * slowdown / 1000)
+            text, usage = self._next_call(contents)
+            return FakeResponse(text, usage, chunk_delays=self._stream_delays(slowdown))
+        time.sleep(self.profile.latency_ms * slowdown / 1000)
+        text, usage = self._next_call(contents)
+        return FakeResponse(text, usage)
+
+    async def generate_content_async(self, contents, **kwargs):
+        await asyncio.sleep(self.profile.latency_ms * self._slowdown() / 1000)
+        text, usage = self._next_call(contents)
+        return FakeResponse(text, usage)
+
+    def count_tokens(self, contents):
+        return FakeTokenCount(_token_count(self.system_instruction + str(contents)))
@@ -0,0 +1,398 @@
+"""Offline latency and throughput benchmarks for the transform pipeline.
+
+Every scenario runs the real engine (single-flight, response cache, retry
+guard) against benchmarks.fake_gemini instead of the Gemini API; the app
+scenarios drive app.py itself through streamlit.testing. Each scenario uses
+fresh prompts, so unless stated otherwise every request reaches the fake
+model. Results are written as JSON tagged with the current commit, and a
+previous file can be passed to --compare:
+
+    python -m benchmarks.run_benchmarks
+    python -m benchmarks.run_benchmarks --latency-ms 400 --error-rate 0.05
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/<earlier>.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.fake_gemini import FakeModel, FakeProfile  # noqa: E402
+from gemini_client import ModelProvider  # noqa: E402
+from hedging import Hedger, HedgePolicy  # noqa: E402
+from prompt_cache import LRUCache, TwoTierCache  # noqa: E402
+from resilience import CircuitBreaker, RetryPolicy, UpstreamGuard  # noqa: E402
+from transform_engine import MODEL_NAME, TransformEngine, get_system_prompt  # noqa: E402
+
+DEFAULT_RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+SCENARIOS = ["transform", "transform_threads", "stream", "transform_async", "cache_hit", "app_transform", "app_stream"]
+
+# Metrics compared by --compare, and whether a higher value is better
+COMPARED_METRICS = {"p50_ms": False, "p95_ms": False, "p99_ms": False, "ttft_p50_ms": False, "calls_per_second": True}
+
+# Matches app.JOB_POLL_SECONDS, the interval at which the page checks on a background transform
+APP_POLL_SECONDS = 0.3
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(fraction * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def summarize(latencies_ms, elapsed_s, errors, ttfts_ms=None, model_calls=None):
+    summary = {
+        "requests": len(latencies_ms) + errors,
+        "errors": errors,
+        "p50_ms": percentile(latencies_ms, 0.50),
+        "p95_ms": percentile(latencies_ms, 0.95),
+        "p99_ms": percentile(latencies_ms, 0.99),
+        "max_ms": max(latencies_ms) if latencies_ms else None,
+        "calls_per_second": (len(latencies_ms) + errors) / elapsed_s if elapsed_s else None,
+        "elapsed_s": elapsed_s,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if ttfts_ms is not None:
+        summary["ttft_p50_ms"] = percentile(ttfts_ms, 0.50)
+        summary["ttft_p95_ms"] = percentile(ttfts_ms, 0.95)
+        summary["ttft_p99_ms"] = percentile(ttfts_ms, 0.99)
+    if model_calls is not None:
+        summary["model_calls"] = model_calls
+    return summary
+
+
+def fresh_prompts(count, tag):
+    # A per-run token and distinct numbers keep prompts from matching each other or the near-duplicate index
+    run_id = uuid.uuid4().hex[:8]
+    return [f"Benchmark {tag} {run_id} request {i}: explain topic {i * 7919} to a new team member" for i in range(count)]
+
+
+def build_engine(profile, hedge_max_rate=0.0):
+    """The production engine wired to the fake model, without the rate limiter or the disk cache"""
+    models = []
+
+    def model_factory(model_name, **kwargs):
+        model = FakeModel(model_name, profile=profile, **kwargs)
+        models.append(model)
+        return model
+
+    provider = ModelProvider(MODEL_NAME, get_system_prompt(), model_factory=model_factory)
+    guard = UpstreamGuard(
+        limiter=None,
+        # Keep injected errors from tripping the breaker mid-run
+        breaker=CircuitBreaker(failure_threshold=10 ** 9),
+        retry_policy=RetryPolicy(max_attempts=3, base_delay=0.01, max_delay=0.05),
+    )
+    hedger = None
+    if hedge_max_rate > 0:
+        # The fake model is much faster than the production minimum delay allows for
+        hedger = Hedger(HedgePolicy(min_delay=0.0, max_rate=hedge_max_rate))
+    engine = TransformEngine(provider, cache=TwoTierCache(LRUCache(max_entries=100000)), guard=guard, hedger=hedger)
+    return engine, models
+
+
+def model_calls(models):
+    return sum(model.calls for model in models)
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    try:
+        function(*args)
+    except Exception:
+        return None
+    return (time.perf_counter() - started) * 1000
+
+
+def bench_transform(profile, requests, options):
+    engine, models = build_engine(profile, options.hedge_max_rate)
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    for raw_prompt in fresh_prompts(requests, "transform"):
+        latency = timed(engine.transform, raw_prompt)
+        if latency is None:
+            errors += 1
+        else:
+            latencies.append(latency)
+    return summarize(latencies, time.perf_counter() - started, errors, model_calls=model_calls(models))
+
+
+def bench_transform_threads(profile, requests, options):
+    engine, models = build_engine(profile, options.hedge_max_rate)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=options.concurrency) as pool:
+        results = list(pool.map(lambda raw_prompt: timed(engine.transform, raw_prompt), fresh_prompts(requests, "threads")))
+    latencies = [latency for latency in results if latency is not None]
+    summary = summarize(latencies, time.perf_counter() - started, len(results) - len(latencies), model_calls=model_calls(models))
+    summary["concurrency"] = options.concurrency
+    return summary
+
+
+def bench_stream(profile, requests, options):
+    engine, models = build_engine(profile, options.hedge_max_rate)
+    latencies, ttfts, errors = [], [], 0
+    started = time.perf_counter()
+    for raw_prompt in fresh_prompts(requests, "stream"):
+        request_started = time.perf_counter()
+        first_chunk = None
+        try:
+            for _ in engine.stream(raw_prompt):
+                if first_chunk is None:
+                    first_chunk = time.perf_counter()
+        except Exception:
+            errors += 1
+            continue
+        ttfts.append((first_chunk - request_started) * 1000)
+        latencies.append((time.perf_counter() - request_started) * 1000)
+    return summarize(latencies, time.perf_counter() - started, errors, ttfts_ms=ttfts, model_calls=model_calls(models))
+
+
+def bench_transform_async(profile, requests, options):
+    engine, models = build_engine(profile, options.hedge_max_rate)
+
+    async def run():
+        semaphore = asyncio.Semaphore(options.concurrency)
+
+        async def one(raw_prompt):
+            async with semaphore:
+                request_started = time.perf_counter()
+                try:
+                    await engine.transform_async(raw_prompt)
+                except Exception:
+                    return None
+                return (time.perf_counter() - request_started) * 1000
+
+        return await asyncio.gather(*(one(raw_prompt) for raw_prompt in fresh_prompts(requests, "async")))
+
+    started = time.perf_counter()
+    results = asyncio.run(run())
+    latencies = [latency for latency in results if latency is not None]
+    summary = summarize(latencies, time.perf_counter() - started, len(results) - len(latencies), model_calls=model_calls(models))
+    summary["concurrency"] = options.concurrency
+    return summary
+
+
+def bench_cache_hit(profile, requests, options):
+    # Warm with error injection off so every prompt is cached, then time repeat lookups
+    warm_profile = FakeProfile(**dict(profile.as_dict(), latency_ms=0, ttft_ms=0, error_rate=0))
+    engine, models = build_engine(warm_profile)
+    prompts = fresh_prompts(requests, "cache")
+    for raw_prompt in prompts:
+        engine.transform(raw_prompt)
+    warm_calls = model_calls(models)
+    latencies = []
+    started = time.perf_counter()
+    for raw_prompt in prompts:
+        latencies.append(timed(engine.transform, raw_prompt))
+    return summarize(latencies, time.perf_counter() - started, 0, model_calls=model_calls(models) - warm_calls)
+
+
+def configure_app_environment(profile, workdir):
+    """Point app.py at the fake model through the same variables an operator would set"""
+    os.environ.update({
+        "GEMINI_API_KEY": "benchmark-fake-key",
+        "GEMINI_MODEL_FACTORY": "benchmarks.fake_gemini:FakeModel",
+        "FAKE_GEMINI_LATENCY_MS": str(profile.latency_ms),
+        "FAKE_GEMINI_TTFT_MS": str(profile.ttft_ms),
+        "FAKE_GEMINI_CHUNKS": str(profile.chunks),
+        "FAKE_GEMINI_ERROR_RATE": str(profile.error_rate),
+        "FAKE_GEMINI_RESPONSE_CHARS": str(profile.response_chars),
+        "FAKE_GEMINI_SLOW_RATE": str(profile.slow_rate),
+        "FAKE_GEMINI_SLOW_FACTOR": str(profile.slow_factor),
+        "GEMINI_RPM": "0",
+        "PROMPT_CACHE_DB": "",
+        # Keep the fake outputs and benchmark prompts away from the real example outputs and history
+        "EXAMPLE_OUTPUTS_PATH": os.path.join(workdir, "example_outputs.json"),
+        "HISTORY_DB": os.path.join(workdir, "history.sqlite3"),
+        # A running app may already serve metrics, and replicas must not see benchmark traffic
+        "METRICS_PORT": "0",
+        "COORDINATION_URL": "",
+    })
+    if profile.seed is not None:
+        os.environ["FAKE_GEMINI_SEED"] = str(profile.seed)
+
+
+def bench_app(profile, requests, stream):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60).run()
+    if at.exception:
+        raise RuntimeError(f"app.py failed to load: {at.exception[0].message}")
+    at.toggle(key="stream_output").set_value(stream).run()
+
+    latencies, errors, previous = [], 0, None
+    started = time.perf_counter()
+    for raw_prompt in fresh_prompts(requests, "app-stream" if stream else "app"):
+        at.text_area(key="raw_prompt").input(raw_prompt).run()
+        request_started = time.perf_counter()
+        next(button for button in at.button if "Transform" in button.label).click().run()
+        # The transform runs on the app's worker pool; rerun at the polling fragment's interval until it lands
+        while "transform_job" in at.session_state and time.perf_counter() - request_started < 60:
+            time.sleep(APP_POLL_SECONDS)
+            at.run()
+        elapsed_ms = (time.perf_counter() - request_started) * 1000
+        result = at.session_state["structured_output"]
+        if at.exception or at.error or not result or result == previous:
+            errors += 1
+        else:
+            latencies.append(elapsed_ms)
+        previous = result
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+def bench_app_transform(profile, requests, options):
+    return bench_app(profile, requests, stream=False)
+
+
+def bench_app_stream(profile, requests, options):
+    return bench_app(profile, requests, stream=True)
+
+
+BENCHMARKS = {
+    "transform": bench_transform,
+    "transform_threads": bench_transform_threads,
+    "stream": bench_stream,
+    "transform_async": bench_transform_async,
+    "cache_hit": bench_cache_hit,
+    "app_transform": bench_app_transform,
+    "app_stream": bench_app_stream,
+}
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+
+def compare(current, baseline):
+    """Print the change in each compared metric against a previous results file"""
+    print(f"\nCompared with {baseline['commit']} ({baseline['timestamp']}):")
+    if baseline.get("profile") != current["profile"]:
+        print("  note: the fake model profiles differ, so the numbers are not directly comparable")
+    for name, scenario in current["scenarios"].items():
+        previous = baseline["scenarios"].get(name)
+        if previous is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            before, after = previous.get(metric), scenario.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            better = change > 0 if higher_is_better else change < 0
+            print(f"  {name:18} {metric:17} {before:10.1f} -> {after:10.1f}  ({change:+6.1f}%{' better' if better else ''})")
+
+
+def print_table(results):
+    print(f"{'scenario':18} {'reqs':>5} {'errs':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ttft p50':>9} {'calls/s':>9} {'rss MB':>8}")
+    for name, s in results["scenarios"].items():
+        if "error" in s:
+            print(f"{name:18} failed: {s['error']}")
+            continue
+        cells = [s.get("p50_ms"), s.get("p95_ms"), s.get("p99_ms"), s.get("ttft_p50_ms"), s.get("calls_per_second")]
+        formatted = " ".join(f"{value:9.1f}" if value is not None else f"{'-':>9}" for value in cells)
+        print(f"{name:18} {s['requests']:5d} {s['errors']:5d} {formatted} {s['peak_rss_mb']:8.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the transform pipeline against a fake Gemini model")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenarios to run")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per engine scenario (default 50)")
+    parser.add_argument("--app-requests", type=int, default=10, help="Requests per AppTest scenario (default 10)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Workers for the threaded and async scenarios")
+    parser.add_argument("--latency-ms", type=float, default=200, help="Fake time to the full response")
+    parser.add_argument("--ttft-ms", type=float, default=80, help="Fake time to the first streamed chunk")
+    parser.add_argument("--chunks", type=int, default=8, help="Chunks per streamed response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of model calls failing with a 429")
+    parser.add_argument("--response-chars", type=int, default=1200, help="Size of each fake response")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Fraction of model calls that are slow")
+    parser.add_argument("--slow-factor", type=float, default=10.0, help="How many times longer a slow call takes")
+    parser.add_argument("--hedge-max-rate", type=float, default=0.0,
+                        help="Hedge slow engine requests, duplicating at most this fraction (default 0, off)")
+    parser.add_argument("--seed", type=int, default=1234, help="Seed for error injection")
+    parser.add_argument("--output-dir", default=DEFAULT_RESULTS_DIR, help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    profile = FakeProfile(
+        latency_ms=args.latency_ms,
+        ttft_ms=args.ttft_ms,
+        chunks=args.chunks,
+        error_rate=args.error_rate,
+        response_chars=args.response_chars,
+        seed=args.seed,
+        slow_rate=args.slow_rate,
+        slow_factor=args.slow_factor,
+    )
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    commit, dirty = git_revision()
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "profile": profile.as_dict(),
+        "concurrency": args.concurrency,
+        "hedge_max_rate": args.hedge_max_rate,
+        "scenarios": {},
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_app_environment(profile, workdir)
+        for name in scenarios:
+            requests = args.app_requests if name.startswith("app_") else args.requests
+            print(f"Running {name} ({requests} requests)...", file=sys.stderr)
+            try:
+                results["scenarios"][name] = BENCHMARKS[name](profile, requests, args)
+            except Exception as e:
+                results["scenarios"][name] = {"error": f"{type(e).__name__}: {e}"}
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(args.output_dir, f"{stamp}-{commit}{'-dirty' if dirty else ''}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    print_table(results)
+    print(f"\nResults written to {path}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
+    return 1 if any("error" in s for s in results["scenarios"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""Local ranking of candidate structured prompts.
+
+Scores follow the structure get_system_prompt() asks for: the Context,
+Role, Task, Constraints and Meta-Instructions components count most, and an
+Output Format or Examples section adds a little. Commentary around the prompt
+and very short answers are penalised. Only regexes run, so ranking a handful
+of candidates takes well under a millisecond.
+"""
+import re
+from collections import namedtuple
+
+# Section name -> (weight, pattern for its heading or opening line)
+SECTIONS = {
+    "context": (1.0, r"context|background"),
+    "role": (1.0, r"role|persona|you are\b"),
+    "task": (1.0, r"task|objective|instructions?\b"),
+    "constraints": (1.0, r"constraints|requirements|rules|limitations"),
+    "meta_instructions": (1.0, r"meta[- ]?instructions|self[- ]reflection|verification|quality checks?"),
+    "output_format": (0.5, r"output(?: format)?|format|deliverables?"),
+    "examples": (0.25, r"examples?"),
+}
+
+# A heading at the start of a line, optionally numbered or wrapped in markdown
+_HEADING = r"^[ \t]*(?:#{{1,6}}[ \t]*|[*_]{{1,2}}|\d+[.)][ \t]*|[-•][ \t]*)*(?:{})"
+_SECTION_PATTERNS = {
+    name: (weight, re.compile(_HEADING.format(pattern), re.IGNORECASE | re.MULTILINE))
+    for name, (weight, pattern) in SECTIONS.items()
+}
+# The system prompt asks for the prompt only, without any framing
+_COMMENTARY = re.compile(r"^\s*(?:here(?:'s| is)|sure\b|certainly\b|of course\b|okay\b)", re.IGNORECASE)
+
+MAX_SCORE = sum(weight for weight, _ in SECTIONS.values())
+MIN_USEFUL_CHARS = 300
+
+Candidate = namedtuple("Candidate", "text score missing")
+
+
+def score_candidate(text):
+    """(score between 0 and 1, required sections that are missing)"""
+    score, missing = 0.0, []
+    for name, (weight, pattern) in _SECTION_PATTERNS.items():
+        if pattern.search(text):
+            score += weight
+        elif weight >= 1:
+            missing.append(name)
+    if _COMMENTARY.match(text):
+        score -= 0.5
+    if len(text.strip()) < MIN_USEFUL_CHARS:
+        score -= 0.5
+    return max(score, 0.0) / MAX_SCORE, missing
+
+
+def rank_candidates(texts):
+    """Candidates best first; ties keep the order the responses arrived in"""
+    candidates = [Candidate(text, *score_candidate(text)) for text in texts if text]
+    return sorted(candidates, key=lambda candidate: -candidate.score)
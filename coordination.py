@@ -0,0 +1,468 @@
+"""State shared by several app replicas: rate limits, in-flight requests and cached results.
+
+Every replica used to have its own rate limiter, request dedupe and response
+cache, so N replicas together sent up to N times the Gemini quota and each
+warmed its own cache. With COORDINATION_URL set, they share all three through
+one backend:
+
+* sqlite:///relative/path.sqlite3 (or sqlite:////absolute/path.sqlite3) for
+  replicas on one host;
+* redis://host:port/db for replicas on several hosts. Any Redis-protocol
+  server works; coordination_server.py is a small stand-in for local runs.
+
+Only a handful of commands are used (GET, SET with NX/PX, DEL, INCRBY and
+PEXPIRE), so no server-side scripting is needed. Rate limits are counted in
+short fixed windows that every replica increments. A request that does not
+fit in the current window is booked into the next one that has room, and
+the caller waits until that window starts.
+
+When the backend cannot be reached, each replica falls back to its own
+limiter and cache instead of failing requests. Backend commands block for up
+to the backend's timeout, so the async entry points run them on a worker
+thread, and usage corrections are sent in the background.
+"""
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from urllib.parse import urlparse
+
+from prompt_cache import hash_text
+from resilience import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# A request is booked at most this many windows ahead; past that it waits for the last one
+MAX_WINDOWS_AHEAD = 12
+
+# After a failed connection, commands fail at once for this long instead of each waiting for a timeout
+RECONNECT_DELAY_SECONDS = 5.0
+
+
+# Sends best-effort writes, such as usage corrections, without holding up the caller
+_background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="coordination")
+
+
+class CoordinationError(Exception):
+    """The coordination backend could not be reached or sent an unexpected reply"""
+
+
+class SQLiteBackend:
+    """Shared keys in one SQLite file, for replicas on the same host"""
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Transactions are explicit, so concurrent replicas serialise on BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS coordination (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL
+            )"""
+        )
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    yield self.clock()
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                raise CoordinationError(f"SQLite coordination failed: {e}") from e
+
+    def _expires_at(self, now, ttl_seconds):
+        return now + ttl_seconds if ttl_seconds else None
+
+    def _drop_expired(self, key, now):
+        self._conn.execute("DELETE FROM coordination WHERE key = ? AND expires_at <= ?", (key, now))
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            self._conn.execute("DELETE FROM coordination WHERE expires_at <= ?", (now,))
+
+    def get(self, key):
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT value FROM coordination WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                    (key, self.clock()),
+                ).fetchone()
+            except sqlite3.Error as e:
+                raise CoordinationError(f"SQLite coordination failed: {e}") from e
+        return row[0] if row else None
+
+    def set(self, key, value, ttl_seconds=None, only_if_absent=False):
+        """Store a value; with only_if_absent, False when the key already exists"""
+        with self._transaction() as now:
+            self._drop_expired(key, now)
+            verb = "INSERT OR IGNORE" if only_if_absent else "INSERT OR REPLACE"
+            cursor = self._conn.execute(
+                f"{verb} INTO coordination (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, self._expires_at(now, ttl_seconds)),
+            )
+            return cursor.rowcount == 1
+
+    def incr(self, key, amount, ttl_seconds=None):
+        """Add to an integer counter and return its new value; a new counter expires after ttl_seconds"""
+        with self._transaction() as now:
+            self._drop_expired(key, now)
+            (value,) = self._conn.execute(
+                """INSERT INTO coordination (key, value, expires_at) VALUES (?, ?, ?)
+                   ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + excluded.value
+                   RETURNING CAST(value AS INTEGER)""",
+                (key, int(amount), self._expires_at(now, ttl_seconds)),
+            ).fetchone()
+            return value
+
+    def delete(self, key):
+        with self._transaction():
+            self._conn.execute("DELETE FROM coordination WHERE key = ?", (key,))
+
+
+class RespBackend:
+    """Shared keys on a Redis-protocol server, for replicas on several hosts.
+
+    One connection is shared by all threads of the process; commands are
+    short, so they simply take turns.
+    """
+
+    def __init__(self, host="127.0.0.1", port=6379, db=0, password=None, timeout=2.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+        self._down_until = 0.0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile("rb")
+        if self.password:
+            self._roundtrip("AUTH", self.password)
+        if self.db:
+            self._roundtrip("SELECT", self.db)
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = self._reader = None
+
+    def _roundtrip(self, *args):
+        parts = [str(arg).encode("utf-8") for arg in args]
+        request = b"*%d\r\n" % len(parts) + b"".join(b"$%d\r\n%s\r\n" % (len(part), part) for part in parts)
+        self._sock.sendall(request)
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by the coordination server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            raise CoordinationError(payload.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        # The stream is out of step; command() starts over on a new connection
+        raise ConnectionError(f"Unexpected reply from the coordination server: {line!r}")
+
+    def command(self, *args):
+        with self._lock:
+            if self._sock is None and time.monotonic() < self._down_until:
+                raise CoordinationError(f"Coordination server {self.host}:{self.port} is unreachable")
+            # A dropped connection is retried once on a fresh one
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return self._roundtrip(*args)
+                except (OSError, ValueError) as e:
+                    reconnecting = self._sock is not None and not attempt
+                    self._close()
+                    if not reconnecting:
+                        self._down_until = time.monotonic() + RECONNECT_DELAY_SECONDS
+                        raise CoordinationError(f"Coordination server {self.host}:{self.port}: {e}") from e
+
+    def get(self, key):
+        return self.command("GET", key)
+
+    def set(self, key, value, ttl_seconds=None, only_if_absent=False):
+        args = ["SET", key, value]
+        if ttl_seconds:
+            args += ["PX", max(1, int(ttl_seconds * 1000))]
+        if only_if_absent:
+            args.append("NX")
+        return self.command(*args) is not None
+
+    def incr(self, key, amount, ttl_seconds=None):
+        value = self.command("INCRBY", key, int(amount))
+        if ttl_seconds and value == int(amount):
+            # First write to this counter
+            self.command("PEXPIRE", key, max(1, int(ttl_seconds * 1000)))
+        return value
+
+    def delete(self, key):
+        self.command("DEL", key)
+
+
+class SharedRateLimiter:
+    """RateLimiter with budgets counted by every replica in fixed windows.
+
+    A window of window_seconds admits rpm * window_seconds / 60 requests and
+    the matching share of tpm tokens. Bursts are at most two windows' worth.
+    """
+
+    def __init__(self, backend, name, rpm, tpm=None, window_seconds=10.0, clock=time.time):
+        self.backend = backend
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        # Every window admits at least one request
+        self.window_seconds = max(window_seconds, 60.0 / rpm)
+        self.clock = clock
+        # Used while the backend is unreachable
+        self.fallback = RateLimiter(rpm, tpm)
+        self._degraded = False
+
+    def _book(self, counter, cost, limit, now):
+        """The start of the first window, from now on, with room for `cost`"""
+        first = int(now // self.window_seconds)
+        for window in range(first, first + MAX_WINDOWS_AHEAD):
+            key = f"{self.name}:{counter}:{window}"
+            # Kept until its window is over, plus one more for late usage corrections
+            ttl = (window + 2) * self.window_seconds - now
+            used = self.backend.incr(key, cost, ttl)
+            # A single request larger than a whole window still goes, alone
+            if used <= limit or used == cost:
+                return window * self.window_seconds
+            self.backend.incr(key, -cost, ttl)
+        return (first + MAX_WINDOWS_AHEAD) * self.window_seconds
+
+    def reserve(self, estimated_tokens):
+        try:
+            now = self.clock()
+            starts = self._book("requests", 1, self.rpm * self.window_seconds / 60.0, now)
+            if self.tpm and estimated_tokens:
+                starts = max(starts, self._book(
+                    "tokens", estimated_tokens, self.tpm * self.window_seconds / 60.0, now
+                ))
+        except CoordinationError as e:
+            if not self._degraded:
+                logger.warning("Shared rate limit unavailable, limiting this replica only: %s", e)
+                self._degraded = True
+            return self.fallback.reserve(estimated_tokens)
+        self._degraded = False
+        return max(0.0, starts - now)
+
+    def acquire(self, estimated_tokens=0):
+        wait = self.reserve(estimated_tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, estimated_tokens=0):
+        # Booking takes up to two backend round-trips per window; keep them off the event loop
+        wait = await asyncio.to_thread(self.reserve, estimated_tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        if not self.tpm or actual_tokens is None or actual_tokens == estimated_tokens:
+            return
+        _background.submit(self._correct, estimated_tokens, actual_tokens, self.clock())
+
+    def _correct(self, estimated_tokens, actual_tokens, now):
+        window = int(now // self.window_seconds)
+        try:
+            self.backend.incr(
+                f"{self.name}:tokens:{window}", actual_tokens - estimated_tokens,
+                (window + 2) * self.window_seconds - now,
+            )
+        except CoordinationError:
+            self.fallback.record_usage(estimated_tokens, actual_tokens)
+
+
+class SharedCache:
+    """Cache tier on the backend, behind the memory and disk tiers of each replica"""
+
+    def __init__(self, backend, prefix, ttl_seconds=7 * 24 * 3600):
+        self.backend = backend
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key):
+        try:
+            return self.backend.get(f"{self.prefix}:{key}")
+        except CoordinationError as e:
+            logger.warning("Shared cache read failed: %s", e)
+            return None
+
+    def set(self, key, value):
+        try:
+            self.backend.set(f"{self.prefix}:{key}", value, self.ttl_seconds)
+        except CoordinationError as e:
+            logger.warning("Shared cache write failed: %s", e)
+
+
+class SharedFlights:
+    """Cross-replica counterpart of SingleFlight.
+
+    The replica that claims a prompt generates it; the others poll the
+    cache until the result shows up there. A claim expires after
+    lease_seconds, so a replica that died mid-request does not block the
+    prompt for long.
+    """
+
+    def __init__(self, backend, prefix, lease_seconds=90.0, poll_seconds=0.2):
+        self.backend = backend
+        self.prefix = prefix
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.replica_id = uuid.uuid4().hex[:12]
+        self.coalesced = 0
+
+    def _claim(self, key):
+        try:
+            return self.backend.set(f"{self.prefix}:{key}", self.replica_id, self.lease_seconds, only_if_absent=True)
+        except CoordinationError as e:
+            logger.warning("Shared request dedupe unavailable: %s", e)
+            return True
+
+    def _release(self, key):
+        try:
+            self.backend.delete(f"{self.prefix}:{key}")
+        except CoordinationError as e:
+            logger.warning("Could not release a shared request claim; it expires on its own: %s", e)
+
+    def _poll(self, key, lookup):
+        """(lead, result): claim the prompt, or another replica's finished result"""
+        if self._claim(key):
+            # The previous holder may have stored its result just before releasing
+            result = lookup()
+            if result is not None:
+                self._release(key)
+                return False, result
+            return True, None
+        result = lookup()
+        if result is not None:
+            self.coalesced += 1
+            return False, result
+        return False, None
+
+    @contextmanager
+    def lead_or_wait(self, key, lookup):
+        """Yields another replica's result for `key`, or None while this replica holds the claim.
+
+        `lookup` reads the result from the shared cache.
+        """
+        while True:
+            lead, result = self._poll(key, lookup)
+            if lead or result is not None:
+                break
+            time.sleep(self.poll_seconds)
+        if not lead:
+            yield result
+            return
+        try:
+            yield None
+        finally:
+            self._release(key)
+
+    @asynccontextmanager
+    async def lead_or_wait_async(self, key, lookup):
+        """lead_or_wait() for coroutines; backend calls and `lookup` run on a worker thread"""
+        while True:
+            lead, result = await asyncio.to_thread(self._poll, key, lookup)
+            if lead or result is not None:
+                break
+            await asyncio.sleep(self.poll_seconds)
+        if not lead:
+            yield result
+            return
+        try:
+            yield None
+        finally:
+            await asyncio.to_thread(self._release, key)
+
+
+class Coordination:
+    """The shared pieces built on one backend, namespaced by prefix"""
+
+    def __init__(self, backend, prefix="metapromptor", window_seconds=10.0, cache_ttl_seconds=7 * 24 * 3600):
+        self.backend = backend
+        self.prefix = prefix
+        self.window_seconds = window_seconds
+        self.cache = SharedCache(backend, f"{prefix}:cache", cache_ttl_seconds)
+        self.flights = SharedFlights(backend, f"{prefix}:flight")
+
+    def limiter(self, name, rpm, tpm=None):
+        """A shared limiter; replicas using the same name share one budget"""
+        return SharedRateLimiter(self.backend, f"{self.prefix}:rate:{name}", rpm, tpm, self.window_seconds)
+
+    def key_limiter(self, api_key, rpm, tpm=None):
+        """The shared limiter of one API key, named by a hash so the key never leaves the replica"""
+        return self.limiter(f"key:{hash_text(api_key)[:16]}", rpm, tpm)
+
+
+def connect(url):
+    """A backend for a sqlite:/// or redis:// URL"""
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        # As in SQLAlchemy URLs, a fourth slash makes the path absolute
+        return SQLiteBackend(parsed.path[1:])
+    if parsed.scheme == "redis":
+        return RespBackend(
+            host=parsed.hostname or "127.0.0.1",
+            port=parsed.port or 6379,
+            db=int(parsed.path.strip("/") or 0),
+            password=parsed.password,
+        )
+    raise ValueError(f"Unsupported COORDINATION_URL scheme: {parsed.scheme!r} (use sqlite:/// or redis://)")
+
+
+def build_coordination():
+    """Create the shared state from COORDINATION_* environment variables, or None for a single replica"""
+    url = os.getenv("COORDINATION_URL", "")
+    if not url:
+        return None
+    return Coordination(
+        connect(url),
+        prefix=os.getenv("COORDINATION_PREFIX", "metapromptor"),
+        window_seconds=float(os.getenv("COORDINATION_WINDOW_SECONDS", "10")),
+        cache_ttl_seconds=float(os.getenv("PROMPT_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+    )
@@ -0,0 +1,193 @@
+"""Minimal Redis-protocol server for running several replicas locally.
+
+It serves the commands coordination.py sends (plus PING, SELECT and
+DBSIZE) from memory, with key expiry. Use a real Redis, or any compatible
+store, when replicas run on more than one host.
+
+    python coordination_server.py --port 6379
+    COORDINATION_URL=redis://127.0.0.1:6379/0 streamlit run app.py --server.port 8501
+    COORDINATION_URL=redis://127.0.0.1:6379/0 streamlit run app.py --server.port 8502
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CommandError(Exception):
+    """Sent back to the client as a RESP error"""
+
+
+class KeyStore:
+    """String keys with optional expiry; one event loop runs all commands, so each is atomic"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        # key -> (value, expires_at or None)
+        self._data = {}
+        self._commands = 0
+
+    def _live(self, key):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= self.clock():
+            del self._data[key]
+            return None
+        return entry
+
+    def _sweep(self):
+        now = self.clock()
+        expired = [key for key, (_, expires_at) in self._data.items() if expires_at is not None and expires_at <= now]
+        for key in expired:
+            del self._data[key]
+
+    def execute(self, name, args):
+        self._commands += 1
+        if self._commands % 10000 == 0:
+            self._sweep()
+        handler = getattr(self, f"cmd_{name.lower()}", None)
+        if handler is None:
+            raise CommandError(f"ERR unknown command '{name}'")
+        return handler(*args)
+
+    def cmd_ping(self, *args):
+        return args[0] if args else "PONG"
+
+    def cmd_select(self, db):
+        return "OK"
+
+    def cmd_dbsize(self):
+        self._sweep()
+        return len(self._data)
+
+    def cmd_get(self, key):
+        entry = self._live(key)
+        return entry[0] if entry is not None else None
+
+    def cmd_set(self, key, value, *options):
+        expires_at, only_if_absent = None, False
+        options = [option.upper() for option in options]
+        index = 0
+        while index < len(options):
+            option = options[index]
+            if option in ("PX", "EX") and index + 1 < len(options):
+                scale = 1000.0 if option == "PX" else 1.0
+                expires_at = self.clock() + int(options[index + 1]) / scale
+                index += 2
+            elif option == "NX":
+                only_if_absent = True
+                index += 1
+            else:
+                raise CommandError("ERR syntax error")
+        if only_if_absent and self._live(key) is not None:
+            return None
+        self._data[key] = (value, expires_at)
+        return "OK"
+
+    def cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._live(key) is not None:
+                del self._data[key]
+                removed += 1
+        return removed
+
+    def cmd_incrby(self, key, amount):
+        entry = self._live(key)
+        try:
+            value = (int(entry[0]) if entry is not None else 0) + int(amount)
+        except ValueError:
+            raise CommandError("ERR value is not an integer or out of range") from None
+        self._data[key] = (str(value), entry[1] if entry is not None else None)
+        return value
+
+    def cmd_incr(self, key):
+        return self.cmd_incrby(key, 1)
+
+    def cmd_pexpire(self, key, milliseconds):
+        entry = self._live(key)
+        if entry is None:
+            return 0
+        self._data[key] = (entry[0], self.clock() + int(milliseconds) / 1000.0)
+        return 1
+
+    def cmd_expire(self, key, seconds):
+        return self.cmd_pexpire(key, int(seconds) * 1000)
+
+
+def encode(reply):
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, CommandError):
+        return b"-%s\r\n" % str(reply).encode("utf-8")
+    if reply in ("OK", "PONG"):
+        return b"+%s\r\n" % reply.encode("utf-8")
+    data = reply.encode("utf-8")
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+async def read_command(reader):
+    """One command as a list of strings, or None when the client has gone"""
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # Inline command, as typed into telnet or redis-cli --no-raw
+        return line.decode("utf-8").split()
+    args = []
+    for _ in range(int(line[1:])):
+        header = await reader.readline()
+        length = int(header[1:])
+        data = await reader.readexactly(length + 2)
+        args.append(data[:-2].decode("utf-8"))
+    return args
+
+
+async def serve_client(store, reader, writer):
+    try:
+        while True:
+            args = await read_command(reader)
+            if args is None:
+                break
+            if not args:
+                continue
+            try:
+                reply = store.execute(args[0], args[1:])
+            except CommandError as e:
+                reply = e
+            except TypeError:
+                reply = CommandError(f"ERR wrong number of arguments for '{args[0].lower()}' command")
+            writer.write(encode(reply))
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host, port):
+    store = KeyStore()
+    server = await asyncio.start_server(lambda reader, writer: serve_client(store, reader, writer), host, port)
+    logger.info("Coordination server listening on %s:%s", host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve shared replica state over the Redis protocol")
+    parser.add_argument("--host", default=os.getenv("COORDINATION_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("COORDINATION_PORT", "6379")))
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+import os
+
+import streamlit.components.v1 as components
+
+_COMPONENT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "components", "copy_button")
+
+# Declared once per process; the iframe is served as a static file, so its
+# identity is stable across reruns and it is never rebuilt
+_copy_button = components.declare_component("copy_button", path=_COMPONENT_PATH)
+
+
+def copy_button(source_label, key="copy_button"):
+    """Copy button that reads the text from the rendered text area labelled `source_label`.
+
+    Returns {"copies": int, "ok": bool} after the first click, else None.
+    """
+    return _copy_button(source_label=source_label, key=key, default=None)
@@ -0,0 +1,122 @@
+"""Warm-up for the Quick Examples buttons.
+
+Outputs for the built-in examples are kept in a JSON file tagged with the
+system prompt hash and model they were produced with. At startup they are
+loaded into the engine's cache. If the file is missing or was produced by a
+different system prompt, the outputs are regenerated on a background thread
+and written back. Run this module directly to regenerate the file ahead of
+a deploy:
+
+    python example_warmup.py
+"""
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+
+from prompt_cache import hash_text
+
+logger = logging.getLogger(__name__)
+
+# (button label, raw prompt) for the Quick Examples row in the UI
+EXAMPLE_PROMPTS = [
+    ("📚 Educational Content", "Explain photosynthesis to middle school students"),
+    ("📧 Marketing Copy", "Write a marketing email for a new fitness app"),
+    ("🎨 Creative Writing", "Write a short story about time travel"),
+]
+
+DEFAULT_OUTPUTS_PATH = os.getenv("EXAMPLE_OUTPUTS_PATH", os.path.join(".cache", "example_outputs.json"))
+
+
+def load_example_outputs(path, system_prompt_hash, model_name):
+    """Stored outputs for the current system prompt and model, or None"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("system_prompt_hash") != system_prompt_hash or data.get("model") != model_name:
+        return None
+    return data.get("outputs", {})
+
+
+def save_example_outputs(path, system_prompt_hash, model_name, outputs):
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    # Write to a uniquely named temp file and rename, so readers never see a partial
+    # file and replicas refreshing at the same time do not write over each other
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, suffix=".tmp", delete=False) as f:
+        json.dump(
+            {"system_prompt_hash": system_prompt_hash, "model": model_name, "outputs": outputs},
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+    os.replace(f.name, path)
+
+
+class ExampleWarmup:
+    """Loads or precomputes the Quick Examples outputs into the engine cache"""
+
+    def __init__(self, engine, path=DEFAULT_OUTPUTS_PATH, examples=EXAMPLE_PROMPTS):
+        self.engine = engine
+        self.path = path
+        self.prompts = [raw_prompt for _, raw_prompt in examples]
+        self.system_prompt_hash = hash_text(engine.model_provider.system_instruction)
+        self.status = "pending"
+        self._thread = None
+
+    def start(self, background=True):
+        """Seed the cache from disk and refresh stale or missing outputs"""
+        outputs = load_example_outputs(self.path, self.system_prompt_hash, self.engine.model_name) or {}
+        for raw_prompt, structured_prompt in outputs.items():
+            self.engine.store(raw_prompt, structured_prompt)
+        if all(raw_prompt in outputs for raw_prompt in self.prompts):
+            self.status = "loaded"
+            return self
+        self.status = "refreshing"
+        if background:
+            self._thread = threading.Thread(target=self.refresh, args=(outputs,), name="example-warmup", daemon=True)
+            self._thread.start()
+        else:
+            self.refresh(outputs)
+        return self
+
+    def refresh(self, outputs=None):
+        outputs = dict(outputs or {})
+        try:
+            for raw_prompt in self.prompts:
+                if raw_prompt not in outputs:
+                    # The file holds Gemini outputs, so skip the local fast path
+                    structured_prompt = self.engine.transform(raw_prompt, fast_path=False)
+                    # The engine does not cache truncated outputs; keep them out of the file too
+                    if self.engine.cached(raw_prompt) == structured_prompt:
+                        outputs[raw_prompt] = structured_prompt
+            save_example_outputs(self.path, self.system_prompt_hash, self.engine.model_name, outputs)
+            self.status = "ready"
+        except Exception as e:
+            logger.warning("Example warm-up failed: %s", e)
+            self.status = "failed"
+
+
+def main():
+    from dotenv import load_dotenv
+
+    import gemini_client
+    from transform_engine import TransformEngine
+
+    load_dotenv()
+    api_keys = gemini_client.api_keys_from_env()
+    if not api_keys:
+        print("GEMINI_API_KEY is not set", file=sys.stderr)
+        return 1
+    gemini_client.configure(api_keys[0])
+    warmup = ExampleWarmup(TransformEngine.from_env()).start(background=False)
+    print(f"Example outputs {warmup.status}: {warmup.path}", file=sys.stderr)
+    return 0 if warmup.status in ("loaded", "ready") else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
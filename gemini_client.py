@@ -0,0 +1,264 @@
+import copy
+import datetime
+import hashlib
+import importlib
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# The SDK pulls in grpc and protobuf, so it is imported on first use rather
+# than at startup; configure() only records the key until then
+_sdk = None
+_api_key = None
+_configured_key = None
+_sdk_lock = threading.Lock()
+
+# Per-key routing uses private SDK internals; requirements.txt pins the versions they were checked against
+SDK_REQUIREMENT = "google-generativeai>=0.8,<0.9"
+
+
+def configure(api_key):
+    """Set the API key; applied to the SDK once, when it is first needed"""
+    global _api_key
+    with _sdk_lock:
+        _api_key = api_key
+
+
+def get_genai():
+    """The google.generativeai module, imported and configured once per process"""
+    global _sdk, _configured_key
+    with _sdk_lock:
+        if _sdk is None:
+            import google.generativeai as genai
+            _sdk = genai
+        if _api_key and _api_key != _configured_key:
+            _sdk.configure(api_key=_api_key)
+            _configured_key = _api_key
+        return _sdk
+
+
+def sdk_loaded():
+    """True once the SDK has been imported"""
+    return _sdk is not None
+
+
+def _missing_sdk_internal(name):
+    return RuntimeError(
+        f"GEMINI_API_KEYS routing needs the private {name} of the google-generativeai SDK, "
+        f"which the installed version does not have; install {SDK_REQUIREMENT} or use a single GEMINI_API_KEY"
+    )
+
+
+def api_keys_from_env():
+    """GEMINI_API_KEYS (comma-separated) or the single GEMINI_API_KEY"""
+    keys = [key.strip() for key in os.getenv("GEMINI_API_KEYS", "").split(",") if key.strip()]
+    if not keys and os.getenv("GEMINI_API_KEY"):
+        keys = [os.getenv("GEMINI_API_KEY")]
+    return keys
+
+
+class KeyClients:
+    """Generative service clients bound to one API key.
+
+    genai.configure() sets one key for the whole process, so concurrent
+    sessions cannot switch keys with it. Models used with a key pool get these
+    clients instead of the process-wide default ones.
+    """
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self._manager = None
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            if self._manager is None:
+                get_genai()
+                from google.generativeai import client as genai_client
+                manager_class = getattr(genai_client, "_ClientManager", None)
+                if manager_class is None:
+                    raise _missing_sdk_internal("client._ClientManager")
+                self._manager = manager_class()
+                self._manager.configure(api_key=self.api_key)
+            return self._manager.get_default_client(name)
+
+
+_key_clients = {}
+_key_clients_lock = threading.Lock()
+
+
+def key_clients(api_key):
+    with _key_clients_lock:
+        if api_key not in _key_clients:
+            _key_clients[api_key] = KeyClients(api_key)
+        return _key_clients[api_key]
+
+
+def build_user_prompt(raw_prompt, hints=""):
+    """Per-request user turn; the MetaPromptor instructions travel as system_instruction"""
+    user_prompt = f"Now transform this raw prompt:\n\n{raw_prompt}"
+    if hints:
+        user_prompt += f"\n\n{hints}"
+    return user_prompt
+
+
+class ContextCache:
+    """Server-side cache for the fixed system prompt prefix.
+
+    Implementations return a ready model bound to the cached prefix, or None
+    when caching is unavailable so the caller can fall back to a plain model.
+    """
+
+    def build_model(self, model_name, system_instruction):
+        raise NotImplementedError
+
+
+class GeminiContextCache(ContextCache):
+    """Context caching through the Gemini CachedContent API"""
+
+    def __init__(self, ttl_seconds=3600, refresh_margin_seconds=300):
+        self.ttl = datetime.timedelta(seconds=ttl_seconds)
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin_seconds)
+        self._cached = {}
+        self._failed_at = {}
+        self._lock = threading.Lock()
+
+    def _display_name(self, model_name, system_instruction):
+        digest = hashlib.sha256(system_instruction.encode("utf-8")).hexdigest()[:16]
+        return f"metapromptor-{model_name}-{digest}"[:128]
+
+    def _is_fresh(self, cached_content):
+        expire_time = cached_content.expire_time
+        if expire_time.tzinfo is None:
+            expire_time = expire_time.replace(tzinfo=datetime.timezone.utc)
+        return expire_time - datetime.datetime.now(datetime.timezone.utc) > self.refresh_margin
+
+    def _find_existing(self, display_name):
+        # Other replicas may already have created the same prefix
+        for cached_content in get_genai().caching.CachedContent.list(page_size=100):
+            if cached_content.display_name == display_name and self._is_fresh(cached_content):
+                return cached_content
+        return None
+
+    def build_model(self, model_name, system_instruction):
+        display_name = self._display_name(model_name, system_instruction)
+        with self._lock:
+            entry = self._cached.get(display_name)
+            if entry is not None and self._is_fresh(entry[0]):
+                return entry[1]
+            failed_at = self._failed_at.get(display_name)
+            if failed_at is not None and datetime.datetime.now(datetime.timezone.utc) - failed_at < self.ttl:
+                return None
+            try:
+                cached_content = self._find_existing(display_name)
+                if cached_content is None:
+                    cached_content = get_genai().caching.CachedContent.create(
+                        model=f"models/{model_name}",
+                        display_name=display_name,
+                        system_instruction=system_instruction,
+                        ttl=self.ttl,
+                    )
+            except Exception as e:
+                # Prefixes below the API's minimum cacheable size are rejected
+                logger.warning("Context caching unavailable for %s: %s", model_name, e)
+                self._failed_at[display_name] = datetime.datetime.now(datetime.timezone.utc)
+                return None
+            model = get_genai().GenerativeModel.from_cached_content(cached_content)
+            self._cached[display_name] = (cached_content, model)
+            return model
+
+
+class LocalContextCache(ContextCache):
+    """In-process stand-in for GeminiContextCache, used offline and in benchmarks"""
+
+    def __init__(self, model_factory):
+        self.model_factory = model_factory
+        self.created = 0
+        self.reused = 0
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def build_model(self, model_name, system_instruction):
+        key = (model_name, system_instruction)
+        with self._lock:
+            if key in self._models:
+                self.reused += 1
+            else:
+                self._models[key] = self.model_factory(model_name, system_instruction=system_instruction)
+                self.created += 1
+            return self._models[key]
+
+
+class ModelProvider:
+    """Hands out one shared model per process instead of one per request"""
+
+    def __init__(self, model_name, system_instruction, context_cache=None, model_factory=None):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.context_cache = context_cache
+        self.model_factory = model_factory
+        self._model = None
+        # api_key -> (plain model, copy of it bound to that key's clients)
+        self._bound = {}
+        self._lock = threading.Lock()
+
+    def get(self, api_key=None, asynchronous=False):
+        """The shared model, or a copy of it that sends with `api_key`.
+
+        Copies for a key skip context caching: a cached prefix belongs to the
+        default key's project, so other keys cannot use it.
+        """
+        if api_key is None:
+            return self._shared()
+        model = self._plain()
+        # Local fakes have no SDK clients to rebind
+        if _sdk is None or not isinstance(model, _sdk.GenerativeModel):
+            return model
+        if not (hasattr(model, "_client") and hasattr(model, "_async_client")):
+            raise _missing_sdk_internal("GenerativeModel._client")
+        with self._lock:
+            entry = self._bound.get(api_key)
+            if entry is None or entry[0] is not model:
+                bound = copy.copy(model)
+                bound._client = key_clients(api_key).get("generative")
+                bound._async_client = None
+                entry = self._bound[api_key] = (model, bound)
+        bound = entry[1]
+        if asynchronous and bound._async_client is None:
+            # Async clients attach to the running event loop, so they are made on first async use
+            bound._async_client = key_clients(api_key).get("generative_async")
+        return bound
+
+    def _shared(self):
+        # A cached prefix expires, so ask the context cache every time; it
+        # returns the same model object until a refresh is due
+        if self.context_cache is not None:
+            model = self.context_cache.build_model(self.model_name, self.system_instruction)
+            if model is not None:
+                return model
+        return self._plain()
+
+    def _plain(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    model_factory = self.model_factory or get_genai().GenerativeModel
+                    self._model = model_factory(self.model_name, system_instruction=self.system_instruction)
+        return self._model
+
+
+def load_model_factory(spec):
+    """Resolve a "module:attribute" model factory, e.g. a local fake for benchmarks"""
+    if not spec:
+        return None
+    module_name, _, attribute = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def build_context_cache(enabled, ttl_seconds=3600):
+    """Server-side prefix cache when enabled, otherwise None"""
+    if not enabled:
+        return None
+    return GeminiContextCache(ttl_seconds=ttl_seconds)
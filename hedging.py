@@ -0,0 +1,205 @@
+"""Hedged upstream calls to cut tail latency.
+
+If the primary call has not produced its first token by the hedge deadline,
+a backup call goes to the same or a fallback model. Whichever finishes first
+is used, and the other is cancelled: asyncio tasks are really cancelled,
+while a blocking call that has already started is left to finish and its
+result is dropped. The deadline is a percentile of recent first-token
+latencies. Hedges are paid for from a token bucket that every primary call
+tops up by `max_rate`, so at most that fraction of requests is duplicated.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class LatencyWindow:
+    """Recent first-token latencies, in seconds"""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction):
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return None
+        return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._samples)
+
+
+class HedgePolicy:
+    """When to hedge, and how many hedges the budget allows"""
+
+    def __init__(self, percentile=0.95, default_delay=3.0, min_delay=0.5, max_delay=20.0, min_samples=20,
+                 max_rate=0.05, burst=2.0):
+        self.percentile = percentile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.max_rate = max_rate
+        self.burst = burst
+        self._windows = {}
+        self._tokens = burst
+        self._lock = threading.Lock()
+
+    def window(self, kind):
+        with self._lock:
+            return self._windows.setdefault(kind, LatencyWindow())
+
+    def delay(self, kind):
+        """Seconds to wait for the primary before hedging"""
+        window = self.window(kind)
+        if len(window) < self.min_samples:
+            return self.default_delay
+        return min(max(window.percentile(self.percentile), self.min_delay), self.max_delay)
+
+    def record_request(self):
+        with self._lock:
+            self._tokens = min(self._tokens + self.max_rate, self.burst)
+
+    def try_hedge(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class Hedger:
+    """Races a backup call against a slow primary call"""
+
+    def __init__(self, policy, max_workers=64):
+        self.policy = policy
+        self.requests = 0
+        self.hedged = 0
+        self.backup_wins = 0
+        self.denied = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _timed(self, call, kind):
+        started = time.monotonic()
+        result = call()
+        # Abandoned primaries still report, so slow calls stay in the window
+        self.policy.window(kind).add(time.monotonic() - started)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedged": self.hedged,
+                "backup_wins": self.backup_wins,
+                "denied": self.denied,
+                "hedge_rate": self.hedged / self.requests if self.requests else 0.0,
+            }
+
+    def _start(self, kind):
+        self._count("requests")
+        self.policy.record_request()
+        return self.policy.delay(kind)
+
+    def _hedge_allowed(self, trace):
+        if self.policy.try_hedge():
+            self._count("hedged")
+            return True
+        self._count("denied")
+        if trace is not None:
+            trace.hedge = "denied"
+        return False
+
+    def _won(self, backup_won, trace):
+        if backup_won:
+            self._count("backup_wins")
+        if trace is not None:
+            trace.hedge = "backup" if backup_won else "primary"
+
+    def call(self, primary, backup, kind="blocking", trace=None):
+        """Run primary(), hedging with backup() once the deadline passes"""
+        delay = self._start(kind)
+        primary_future = self._executor.submit(self._timed, primary, kind)
+        done, _ = wait([primary_future], timeout=delay)
+        if done or not self._hedge_allowed(trace):
+            return primary_future.result()
+
+        backup_future = self._executor.submit(backup)
+        pending = {primary_future, backup_future}
+        errors = {}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    self._won(future is backup_future, trace)
+                    return future.result()
+                errors[future] = future.exception()
+        # Both failed; the primary's error is the one the caller expects
+        raise errors[primary_future]
+
+    async def call_async(self, primary, backup, kind="async", trace=None):
+        """Asyncio version of call(); primary and backup return awaitables"""
+        delay = self._start(kind)
+
+        async def timed_primary():
+            started = time.monotonic()
+            result = await primary()
+            self.policy.window(kind).add(time.monotonic() - started)
+            return result
+
+        primary_task = asyncio.ensure_future(timed_primary())
+        try:
+            done, _ = await asyncio.wait({primary_task}, timeout=delay)
+        except asyncio.CancelledError:
+            primary_task.cancel()
+            raise
+        if done or not self._hedge_allowed(trace):
+            return await primary_task
+
+        backup_task = asyncio.ensure_future(backup())
+        pending = {primary_task, backup_task}
+        errors = {}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self._won(task is backup_task, trace)
+                        return task.result()
+                    errors[task] = task.exception()
+            raise errors[primary_task]
+        finally:
+            # Also runs when the caller itself is cancelled
+            for task in pending:
+                task.cancel()
+
+
+def build_hedger():
+    """Create the hedger from GEMINI_HEDGE_* environment variables, or None when disabled"""
+    # Off unless asked for: both calls of a hedge are billed, and a losing blocking call runs to the end
+    max_rate = float(os.getenv("GEMINI_HEDGE_MAX_RATE", "0"))
+    if max_rate <= 0:
+        return None
+    return Hedger(HedgePolicy(
+        percentile=float(os.getenv("GEMINI_HEDGE_PERCENTILE", "0.95")),
+        default_delay=float(os.getenv("GEMINI_HEDGE_DEFAULT_DELAY_SECONDS", "3")),
+        min_delay=float(os.getenv("GEMINI_HEDGE_MIN_DELAY_SECONDS", "0.5")),
+        max_rate=max_rate,
+    ))
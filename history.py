@@ -0,0 +1,163 @@
+"""Persistent transform history with full-text search.
+
+Every completed transform is stored in a local SQLite file with an FTS5
+index over the raw and structured prompts. Pages are read with a keyset
+cursor (the id of the last row shown) and carry only short previews, so the
+UI never loads the whole history; the full structured prompt is read only
+when an entry is reused.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_CHARS = 160
+
+# One row of a history page; the full structured prompt is fetched with get()
+HistoryEntry = namedtuple("HistoryEntry", "id created_at raw_preview structured_preview model mode")
+
+
+def match_query(text):
+    """FTS5 query matching every word of `text` as a prefix, with the user's syntax quoted away"""
+    words = text.split()
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+
+class TransformHistory:
+    """Append-only transform log, newest first, capped at max_entries rows"""
+
+    def __init__(self, path, max_entries=5000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at REAL NOT NULL,
+                raw_prompt TEXT NOT NULL,
+                structured_prompt TEXT NOT NULL,
+                model TEXT NOT NULL,
+                mode TEXT NOT NULL
+            )"""
+        )
+        self.full_text = self._create_index()
+        self._conn.commit()
+
+    def _create_index(self):
+        """External-content FTS5 table kept in sync by triggers; False if SQLite lacks FTS5"""
+        try:
+            self._conn.execute(
+                """CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+                    raw_prompt, structured_prompt, content='history', content_rowid='id'
+                )"""
+            )
+        except sqlite3.OperationalError as e:
+            logger.warning("SQLite has no FTS5, history search falls back to LIKE: %s", e)
+            return False
+        self._conn.executescript(
+            """
+            CREATE TRIGGER IF NOT EXISTS history_ai AFTER INSERT ON history BEGIN
+                INSERT INTO history_fts (rowid, raw_prompt, structured_prompt)
+                VALUES (new.id, new.raw_prompt, new.structured_prompt);
+            END;
+            CREATE TRIGGER IF NOT EXISTS history_ad AFTER DELETE ON history BEGIN
+                INSERT INTO history_fts (history_fts, rowid, raw_prompt, structured_prompt)
+                VALUES ('delete', old.id, old.raw_prompt, old.structured_prompt);
+            END;
+            """
+        )
+        return True
+
+    def record(self, raw_prompt, structured_prompt, model, mode):
+        """Store one transform and return its id; repeating the latest entry only refreshes its time"""
+        now = time.time()
+        with self._lock:
+            latest = self._conn.execute(
+                "SELECT id, raw_prompt, structured_prompt FROM history ORDER BY id DESC LIMIT 1"
+            ).fetchone()
+            if latest is not None and latest[1:] == (raw_prompt, structured_prompt):
+                self._conn.execute("UPDATE history SET created_at = ? WHERE id = ?", (now, latest[0]))
+                self._conn.commit()
+                return latest[0]
+            cursor = self._conn.execute(
+                "INSERT INTO history (created_at, raw_prompt, structured_prompt, model, mode) VALUES (?, ?, ?, ?, ?)",
+                (now, raw_prompt, structured_prompt, model, mode),
+            )
+            self._evict()
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def _evict(self):
+        if self.max_entries:
+            self._conn.execute(
+                "DELETE FROM history WHERE id <= (SELECT id FROM history ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def page(self, query="", before_id=None, limit=10):
+        """Up to `limit` entries older than before_id, newest first, optionally matching `query`.
+
+        Returns (entries, has_more); pass the last entry's id as before_id for the next page.
+        """
+        columns = (
+            f"h.id, h.created_at, substr(h.raw_prompt, 1, {PREVIEW_CHARS}), "
+            f"substr(h.structured_prompt, 1, {PREVIEW_CHARS}), h.model, h.mode"
+        )
+        where, params = [], []
+        if before_id is not None:
+            where.append("h.id < ?")
+            params.append(before_id)
+        words = query.split()
+        if words and self.full_text:
+            source = "history_fts JOIN history h ON h.id = history_fts.rowid"
+            where.append("history_fts MATCH ?")
+            params.append(match_query(query))
+        else:
+            source = "history h"
+            for word in words:
+                where.append("(h.raw_prompt LIKE ? OR h.structured_prompt LIKE ?)")
+                params.extend([f"%{word}%"] * 2)
+        sql = f"SELECT {columns} FROM {source}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY h.id DESC LIMIT ?"
+        # One extra row tells whether there is another page
+        params.append(limit + 1)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [HistoryEntry(*row) for row in rows[:limit]], len(rows) > limit
+
+    def get(self, entry_id):
+        """(raw prompt, structured prompt) of one entry, or None"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT raw_prompt, structured_prompt FROM history WHERE id = ?", (entry_id,)
+            ).fetchone()
+
+    def delete(self, entry_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM history WHERE id = ?", (entry_id,))
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM history").fetchone()
+            return count
+
+
+def build_history():
+    """Create the history from HISTORY_* environment variables, or None when disabled"""
+    db_path = os.getenv("HISTORY_DB", os.path.join(".cache", "history.sqlite3"))
+    if not db_path:
+        return None
+    return TransformHistory(db_path, max_entries=int(os.getenv("HISTORY_MAX_ENTRIES", "5000")))
@@ -0,0 +1,189 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+from resilience import CircuitOpenError, RateLimiter
+
+# Errors that mean this key is over its quota, not that Gemini is unhealthy
+THROTTLE_NAMES = {"ResourceExhausted", "TooManyRequests"}
+
+
+def is_throttled(exc):
+    return getattr(exc, "code", None) == 429 or type(exc).__name__ in THROTTLE_NAMES
+
+
+def key_label(api_key):
+    """Short, log-safe name for a key"""
+    return f"…{api_key[-4:]}" if len(api_key) > 8 else "…"
+
+
+class KeyState:
+    """Usage and health of one API key"""
+
+    def __init__(self, api_key, limiter):
+        self.api_key = api_key
+        self.label = key_label(api_key)
+        self.limiter = limiter
+        self.in_flight = 0
+        self.requests = 0
+        self.tokens = 0
+        self.throttled = 0
+        self.consecutive_throttles = 0
+        self.cooldown_until = 0.0
+        self.last_used = 0.0
+        # [timestamp, tokens] per request in the last minute
+        self.recent = deque()
+
+
+class KeyLease:
+    """One request's hold on a key; release() exactly once when the call returns or fails"""
+
+    def __init__(self, pool, state, entry):
+        self.pool = pool
+        self.state = state
+        self.api_key = state.api_key
+        # This request's [timestamp, tokens] in the key's usage window
+        self.entry = entry
+        self.estimated_tokens = entry[1]
+
+    def release(self, actual_tokens=None, error=None):
+        self.pool._release(self, actual_tokens, error)
+
+
+class KeyPool:
+    """Routes each request to the least-loaded API key that is not cooling down.
+
+    Load is the share of a key's per-minute request and token quota used in
+    the last minute, counting requests still in flight. A key that gets a 429
+    leaves the rotation for a cooldown that doubles with each consecutive 429.
+    Every key has its own rate limiter, so total throughput grows with the
+    number of keys. `limiter_factory(api_key, rpm, tpm)` replaces the
+    per-process limiters, for example with ones shared by all replicas.
+    """
+
+    def __init__(self, api_keys, rpm=60, tpm=1000000, base_cooldown=15.0, max_cooldown=300.0, max_wait=1.0,
+                 clock=time.monotonic, limiter_factory=None):
+        if not api_keys:
+            raise ValueError("KeyPool needs at least one API key")
+        self.rpm = rpm
+        self.tpm = tpm
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        # When every key is cooling down, wait this long for one to return before failing fast
+        self.max_wait = max_wait
+        self.clock = clock
+        limiter_factory = limiter_factory or (lambda api_key, rpm, tpm: RateLimiter(rpm, tpm))
+        self._keys = [
+            KeyState(api_key, limiter_factory(api_key, rpm, tpm) if rpm > 0 else None)
+            for api_key in dict.fromkeys(api_keys)
+        ]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _prune(self, state, now):
+        while state.recent and now - state.recent[0][0] > 60:
+            state.recent.popleft()
+
+    def _load(self, state):
+        # In-flight requests are already in the window
+        load = len(state.recent) / self.rpm if self.rpm > 0 else 0.0
+        if self.tpm:
+            load = max(load, sum(tokens for _, tokens in state.recent) / self.tpm)
+        return load
+
+    def _select(self, estimated_tokens):
+        """A lease on the best key, or the seconds until one leaves its cooldown"""
+        now = self.clock()
+        with self._lock:
+            for state in self._keys:
+                self._prune(state, now)
+            healthy = [state for state in self._keys if state.cooldown_until <= now]
+            if not healthy:
+                return min(state.cooldown_until for state in self._keys) - now
+            # Least loaded first; among equals, the fewest in flight, then the one idle the longest
+            state = min(healthy, key=lambda state: (self._load(state), state.in_flight, state.last_used))
+            state.in_flight += 1
+            state.last_used = now
+            entry = [now, estimated_tokens]
+            state.recent.append(entry)
+            return KeyLease(self, state, entry)
+
+    def acquire(self, estimated_tokens=0):
+        """Pick a key and wait for its rate limiter"""
+        lease = self._select(estimated_tokens)
+        while not isinstance(lease, KeyLease):
+            if lease > self.max_wait:
+                raise CircuitOpenError(lease)
+            time.sleep(lease)
+            lease = self._select(estimated_tokens)
+        if lease.state.limiter is not None:
+            lease.state.limiter.acquire(estimated_tokens)
+        return lease
+
+    async def acquire_async(self, estimated_tokens=0):
+        lease = self._select(estimated_tokens)
+        while not isinstance(lease, KeyLease):
+            if lease > self.max_wait:
+                raise CircuitOpenError(lease)
+            await asyncio.sleep(lease)
+            lease = self._select(estimated_tokens)
+        if lease.state.limiter is not None:
+            await lease.state.limiter.acquire_async(estimated_tokens)
+        return lease
+
+    def _release(self, lease, actual_tokens, error):
+        state = lease.state
+        now = self.clock()
+        with self._lock:
+            state.in_flight -= 1
+            state.requests += 1
+            if actual_tokens is not None:
+                state.tokens += actual_tokens
+                # The window now counts what the request really cost
+                lease.entry[1] = actual_tokens
+            if error is not None and is_throttled(error):
+                state.throttled += 1
+                state.consecutive_throttles += 1
+                cooldown = min(self.base_cooldown * 2 ** (state.consecutive_throttles - 1), self.max_cooldown)
+                state.cooldown_until = now + cooldown
+            elif error is None:
+                state.consecutive_throttles = 0
+        if state.limiter is not None and actual_tokens is not None:
+            state.limiter.record_usage(lease.estimated_tokens, actual_tokens)
+
+    def stats(self):
+        """Per-key usage for the last minute, without the keys themselves"""
+        now = self.clock()
+        with self._lock:
+            rows = []
+            for state in self._keys:
+                self._prune(state, now)
+                rows.append({
+                    "key": state.label,
+                    "healthy": state.cooldown_until <= now,
+                    "cooldown": max(0.0, state.cooldown_until - now),
+                    "in_flight": state.in_flight,
+                    "requests_last_minute": len(state.recent),
+                    "tokens_last_minute": sum(tokens for _, tokens in state.recent),
+                    "requests": state.requests,
+                    "throttled": state.throttled,
+                })
+            return rows
+
+
+def build_key_pool(api_keys, coordination=None):
+    """A pool for two or more keys; a single key keeps the plain process-wide limiter"""
+    if len(api_keys) < 2:
+        return None
+    # With a pool, GEMINI_RPM and GEMINI_TPM are the limits of each key
+    return KeyPool(
+        api_keys,
+        rpm=float(os.getenv("GEMINI_RPM", "60")),
+        tpm=float(os.getenv("GEMINI_TPM", "1000000")),
+        base_cooldown=float(os.getenv("GEMINI_KEY_COOLDOWN_SECONDS", "15")),
+        limiter_factory=coordination.key_limiter if coordination is not None else None,
+    )
@@ -0,0 +1,105 @@
+"""Transform-as-you-type preview of the raw prompt.
+
+The browser side (components/prompt_watcher) debounces keystrokes and sends
+only the text of each pause. On the server, a preview is skipped when the
+text is too short or unchanged apart from whitespace; otherwise it streams
+through the engine, so cached and locally assembled results cost no API
+call. When newer text arrives mid-preview, Streamlit stops the running
+script, and closing the stream abandons the stale upstream call.
+"""
+import os
+import threading
+
+import streamlit.components.v1 as components
+
+from prompt_cache import hash_text, normalize_prompt
+
+_COMPONENT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "components", "prompt_watcher")
+
+# Declared once per process, like the copy button
+_prompt_watcher = components.declare_component("prompt_watcher", path=_COMPONENT_PATH)
+
+
+def prompt_watcher(source_label, debounce_ms=800, key="prompt_watcher"):
+    """Watch the text area labelled `source_label` as the user types.
+
+    Returns {"text": str, "seq": int, "edits": int} for the latest pause in
+    typing, or None before the first one. `edits` counts input events so far.
+    """
+    return _prompt_watcher(source_label=source_label, debounce_ms=debounce_ms, key=key, default=None)
+
+
+def preview_digest(text):
+    return hash_text(normalize_prompt(text))
+
+
+class LivePreview:
+    """Decides which typing pauses get a preview, and counts what they cost"""
+
+    def __init__(self, debounce_ms=800, min_chars=12):
+        self.debounce_ms = debounce_ms
+        self.min_chars = min_chars
+        self.edits = 0
+        self.updates = 0
+        self.previews = 0
+        self.upstream = 0
+        self.cancelled = 0
+        self._lock = threading.Lock()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def accept(self, update, state):
+        """The text to preview for a watcher update, or None.
+
+        `state` is the session's dict-like state; it remembers the last update
+        handled and a digest of the last text previewed.
+        """
+        if not update or update.get("seq") == state.get("live_preview_seq"):
+            return None
+        self._count("edits", max(update.get("edits", 0) - state.get("live_preview_edits", 0), 0))
+        self._count("updates")
+        state["live_preview_seq"] = update.get("seq")
+        state["live_preview_edits"] = update.get("edits", 0)
+        text = (update.get("text") or "").strip()
+        if len(text) < self.min_chars:
+            return None
+        if preview_digest(text) == state.get("live_preview_digest"):
+            return None
+        return text
+
+    def previewed(self, state, text):
+        """Remember that `text` has been previewed; only its digest is kept"""
+        state["live_preview_digest"] = preview_digest(text)
+
+    def stream(self, engine, raw_prompt, trace):
+        """Yield preview chunks; a preview closed before the end counts as cancelled"""
+        self._count("previews")
+        finished = False
+        try:
+            yield from engine.stream(raw_prompt, trace)
+            finished = True
+        finally:
+            if trace.cache in ("miss", "disabled") and trace.analysis != "local":
+                self._count("upstream")
+            if not finished:
+                self._count("cancelled")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "edits": self.edits,
+                "updates": self.updates,
+                "previews": self.previews,
+                "upstream": self.upstream,
+                "cancelled": self.cancelled,
+            }
+
+
+def build_live_preview():
+    """Create the preview settings from LIVE_PREVIEW_* environment variables"""
+    return LivePreview(
+        debounce_ms=int(os.getenv("LIVE_PREVIEW_DEBOUNCE_MS", "800")),
+        min_chars=int(os.getenv("LIVE_PREVIEW_MIN_CHARS", "12")),
+    )
@@ -0,0 +1,191 @@
+import array
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+
+# Words that rarely change what a prompt asks for
+FILLER_WORDS = frozenset({"a", "an", "the", "please", "just", "kindly", "really", "very", "some", "me"})
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+_MAX_HASH = (1 << 32) - 1
+_ROTATION = 0x9E3779B1
+
+
+def canonicalize(raw_prompt):
+    """Lowercase, strip punctuation and filler words, collapse whitespace"""
+    words = _NON_WORD.sub(" ", raw_prompt.lower()).split()
+    return " ".join(word for word in words if word not in FILLER_WORDS)
+
+
+def shingles(text, size=4):
+    """Character n-grams of the canonical text"""
+    encoded = text.encode("utf-8")
+    if len(encoded) <= size:
+        return {encoded}
+    return {encoded[i:i + size] for i in range(len(encoded) - size + 1)}
+
+
+class MinHasher:
+    """One-permutation MinHash with rotation densification.
+
+    Each shingle is hashed once and lands in one of `num_perm` bins, keeping
+    the bin minimum; empty bins borrow from the next filled bin. This costs one
+    hash per shingle instead of one per shingle per permutation.
+    """
+
+    def __init__(self, num_perm=64):
+        self.num_perm = num_perm
+
+    def signature(self, shingle_set):
+        size = self.num_perm
+        bins = [None] * size
+        for shingle in shingle_set:
+            h = int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), "little")
+            slot = h % size
+            value = h >> 32
+            if bins[slot] is None or value < bins[slot]:
+                bins[slot] = value
+        if None in bins:
+            densified = list(bins)
+            for i in range(size):
+                if bins[i] is not None:
+                    continue
+                # Nearest filled bin to the right, wrapping around
+                distance = 1
+                while bins[(i + distance) % size] is None:
+                    distance += 1
+                densified[i] = (bins[(i + distance) % size] + distance * _ROTATION) & _MAX_HASH
+            bins = densified
+        return array.array("I", bins)
+
+
+def estimate_similarity(left, right):
+    """Fraction of agreeing MinHash slots (signatures as bytes), an estimate of Jaccard similarity"""
+    left, right = memoryview(left).cast("I"), memoryview(right).cast("I")
+    return sum(1 for x, y in zip(left, right) if x == y) / len(left)
+
+
+class NearDuplicateIndex:
+    """MinHash/LSH index from previously transformed prompts to their cache keys.
+
+    Signatures are split into bands; prompts sharing any band are candidates
+    and are confirmed against `threshold` using the full signature. A match
+    must also use exactly the same words once filler words are dropped, so
+    prompts that differ in one word ("formal" vs "informal", "AWS" vs "GCP",
+    "150 words" vs "300 words", "do not use rhymes") never match. The index
+    holds at most `max_entries` prompts and drops the least recently used, and
+    each band bucket keeps only its newest `max_bucket` prompts so popular
+    phrasings cannot turn a lookup into a scan.
+    """
+
+    def __init__(self, threshold=0.9, max_entries=100000, num_perm=64, bands=16, max_bucket=32):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_bucket = max_bucket
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._by_text = {}
+        self._buckets = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _band_keys(self, signature):
+        width = self.rows * 4
+        return [hash((band, signature[band * width:(band + 1) * width])) for band in range(self.bands)]
+
+    def _prepare(self, raw_prompt):
+        text = canonicalize(raw_prompt)
+        # Entries are kept small: the signature as raw bytes, and the canonical
+        # text and its words (in any order) only as hashes
+        words = hash(tuple(sorted(text.split())))
+        signature = self.hasher.signature(shingles(text)).tobytes()
+        return hash(text), words, signature
+
+    def add(self, raw_prompt, cache_key):
+        """Remember that `raw_prompt` was transformed and stored under a hex `cache_key`"""
+        text, words, signature = self._prepare(raw_prompt)
+        with self._lock:
+            existing = self._by_text.get(text)
+            if existing is not None:
+                self._remove(existing)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (signature, words, bytes.fromhex(cache_key), text)
+            self._by_text[text] = entry_id
+            for band_key in self._band_keys(signature):
+                bucket = self._buckets.get(band_key)
+                if bucket is None:
+                    # Most buckets hold a single prompt; avoid a list per bucket
+                    self._buckets[band_key] = entry_id
+                elif isinstance(bucket, list):
+                    bucket.append(entry_id)
+                    if len(bucket) > self.max_bucket:
+                        del bucket[0]
+                else:
+                    self._buckets[band_key] = [bucket, entry_id]
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id):
+        signature, _, _, text = self._entries.pop(entry_id)
+        if self._by_text.get(text) == entry_id:
+            del self._by_text[text]
+        for band_key in self._band_keys(signature):
+            bucket = self._buckets.get(band_key)
+            if isinstance(bucket, list):
+                if entry_id in bucket:
+                    bucket.remove(entry_id)
+                    if len(bucket) == 1:
+                        self._buckets[band_key] = bucket[0]
+            elif bucket == entry_id:
+                del self._buckets[band_key]
+
+    def lookup(self, raw_prompt):
+        """Cache key of the most similar stored prompt above the threshold, or None"""
+        text, words, signature = self._prepare(raw_prompt)
+        with self._lock:
+            candidates = set()
+            for band_key in self._band_keys(signature):
+                bucket = self._buckets.get(band_key)
+                if isinstance(bucket, list):
+                    candidates.update(bucket)
+                elif bucket is not None:
+                    candidates.add(bucket)
+            best_id, best_key, best_score = None, None, self.threshold
+            for entry_id in candidates:
+                other_signature, other_words, cache_key, _ = self._entries[entry_id]
+                if other_words != words:
+                    continue
+                score = estimate_similarity(signature, other_signature)
+                if score >= best_score:
+                    best_id, best_key, best_score = entry_id, cache_key.hex(), score
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return best_key
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+def build_near_duplicate_index():
+    """Create the index from NEAR_DUPLICATE_* environment variables, or None unless enabled"""
+    threshold = float(os.getenv("NEAR_DUPLICATE_THRESHOLD") or "0")
+    if threshold <= 0:
+        return None
+    return NearDuplicateIndex(
+        threshold=threshold,
+        max_entries=int(os.getenv("NEAR_DUPLICATE_MAX_ENTRIES", "100000")),
+    )
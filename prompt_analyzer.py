@@ -0,0 +1,346 @@
+"""Rule-based pre-analysis of raw prompts.
+
+Before a transform goes to Gemini, precompiled patterns pull out the action,
+deliverable, subject, audience, length, tone and format cues of the raw
+prompt. With the fast path enabled, short, templated requests such as
+"Explain photosynthesis to middle school students" are then assembled
+locally into the same Context / Role / Task / Constraints /
+Meta-Instructions layout the system prompt asks for, without an API call.
+Anything else goes to Gemini with the extracted fields attached as hints.
+Every request is counted under the path it took.
+"""
+import os
+import re
+import threading
+
+# Action verb -> kind of task
+ACTIONS = {
+    "explain": "explain", "describe": "explain", "teach": "explain", "introduce": "explain",
+    "write": "write", "draft": "write", "compose": "write", "create": "write", "craft": "write",
+    "summarize": "summarize", "summarise": "summarize",
+    "list": "list", "brainstorm": "list", "suggest": "list",
+}
+
+# Deliverable -> (role, output format, default length)
+DELIVERABLES = {
+    "email": ("a skilled copywriter who writes clear, persuasive emails",
+              "An email with a subject line, a greeting, a short body and a clear call to action", "150-250 words"),
+    "newsletter": ("a skilled copywriter who writes engaging newsletters",
+                   "A newsletter with a headline and short, scannable sections", "300-500 words"),
+    "story": ("a creative writer with a talent for vivid, well-paced storytelling",
+              "A story with a clear beginning, middle and end", "around 500 words"),
+    "poem": ("a poet with a strong ear for rhythm and imagery", "A poem, laid out line by line", "12-20 lines"),
+    "haiku": ("a poet skilled in the haiku form", "A haiku of three lines (5-7-5 syllables)", "three lines"),
+    "essay": ("a professional writer who builds clear, well-supported arguments",
+              "An essay with an introduction, body paragraphs and a conclusion", "around 600 words"),
+    "article": ("a professional writer who produces engaging, well-researched articles",
+                "An article with a headline and short sections under subheadings", "around 600 words"),
+    "blog post": ("a professional blogger who writes engaging, practical posts",
+                  "A blog post with a headline, an introduction and short sections under subheadings",
+                  "around 600 words"),
+    "tweet": ("a social media copywriter", "A single post under 280 characters", "under 280 characters"),
+    "letter": ("a skilled writer of clear, well-judged letters",
+               "A letter with a greeting, body and sign-off", "200-300 words"),
+    "speech": ("an experienced speechwriter", "A speech with an opening hook, main points and a closing line",
+               "around 500 words"),
+    "slogan": ("a brand copywriter", "A short list of slogan options", "five options"),
+    "lesson plan": ("an experienced teacher and curriculum designer",
+                    "A lesson plan with objectives, materials, activities and an assessment", "one page"),
+    "summary": ("an expert editor who writes precise summaries", "A concise summary", "around 150 words"),
+}
+
+TONES = (
+    "formal", "informal", "casual", "friendly", "professional", "humorous", "funny", "playful", "persuasive",
+    "serious", "inspirational", "inspiring", "enthusiastic", "empathetic", "academic", "conversational", "witty",
+    "upbeat", "warm", "concise",
+)
+
+FORMATS = {
+    "bullet points": "Bullet points", "bulleted list": "Bullet points", "numbered list": "A numbered list",
+    "table": "A table", "markdown": "Markdown", "json": "JSON", "step-by-step": "Numbered steps",
+    "outline": "An outline", "paragraph": "Paragraphs",
+}
+
+_AUDIENCE_NOUNS = (
+    r"students?|child(?:ren)?|kids?|beginners?|novices?|newcomers?|experts?|professionals?|developers?|engineers?|"
+    r"managers?|executives?|teenagers?|teens?|adults?|readers?|audiences?|customers?|clients?|users?|parents?|"
+    r"teachers?|\d+[- ]year[- ]olds?|non[- ]experts?|laypeople|layperson|investors?|employees?|seniors?"
+)
+_ACTION = re.compile(r"^\s*(?:please\s+)?(" + "|".join(ACTIONS) + r")\b\s*", re.IGNORECASE)
+_DELIVERABLE = re.compile(
+    r"^(?:(?:a|an|the|some|\d+|one|two|three|four|five)\s+)?((?:[\w-]+\s+){0,2}?)"
+    r"(" + "|".join(sorted(DELIVERABLES, key=len, reverse=True)) + r")s?\b\s*",
+    re.IGNORECASE,
+)
+_AUDIENCE = re.compile(
+    r"\b(?:to|for)\s+((?:(?:a|an|the|my|our)\s+)?(?:[\w-]+\s+){0,3}?(?:" + _AUDIENCE_NOUNS + r"))\b",
+    re.IGNORECASE,
+)
+_LENGTH = re.compile(
+    r"\b((?:(?:in|under|at most|no more than|less than|about|around|roughly|at least|within)\s+)?"
+    r"\d+(?:\s*-\s*\d+)?\s*(?:words?|sentences?|paragraphs?|pages?|characters?|lines?|bullet points?|items?|"
+    r"tips|ideas|steps|points))\b",
+    re.IGNORECASE,
+)
+# "in a formal tone", "in simple terms": style cues that are not part of the subject
+_STYLE_PHRASE = re.compile(
+    r"\b(?:in|with|using)\s+(?:(?:a|an)\s+)?((?:[\w-]+,?\s+){0,3}?)(?:tone|style|voice|terms|language|words)\b",
+    re.IGNORECASE,
+)
+_BRIEF = re.compile(r"\b(short|brief|concise|quick|one[- ]page)\b", re.IGNORECASE)
+_TONE = re.compile(r"\b(" + "|".join(TONES) + r")\b", re.IGNORECASE)
+_FORMAT = re.compile(r"\b(" + "|".join(re.escape(name) for name in FORMATS) + r")\b", re.IGNORECASE)
+# "to my landlord about the heating", "to my boss asking for a raise"
+_RECIPIENT = re.compile(
+    r"^to\s+((?:(?:my|our|your|the|a|an)\s+)?(?:[\w'-]+\s+){0,2}?[\w'-]+)\s+"
+    r"(?:(?:about|on|regarding)\s+(.+)|(\w+ing\b.*))$",
+    re.IGNORECASE,
+)
+# Vowel letters that are read with a consonant sound ("a user guide", "a one-page summary")
+_CONSONANT_SOUND = re.compile(r"^(?:uni|use|usu|uti|eu|one)", re.IGNORECASE)
+_SUBJECT_PREFIX = re.compile(r"^(?:about|on|of|explaining|describing|for|to)\s+", re.IGNORECASE)
+_FILLER = re.compile(r"\s+(?:in|with|using)\s*$|[\s,.;:!]+$", re.IGNORECASE)
+# Signs that a request needs real interpretation: questions, several sentences, code, lists
+_COMPLEX = re.compile(r"[?\n`{}<>]|\b(?:and then|also|but|however|unless|if|because)\b|[.;!].*\w", re.IGNORECASE)
+# Exclusions a template would drop or turn around ("a story that does not mention dragons")
+_NEGATION = re.compile(r"\b(?:not|no|never|nor|none|without|cannot|\w+n['’]t)\b", re.IGNORECASE)
+# Output language requests, which would otherwise end up in the subject ("recursion in French")
+_LANGUAGE = re.compile(
+    r"\b(?:in|into)\s+(?:English|French|Spanish|German|Italian|Portuguese|Dutch|Russian|Chinese|Mandarin|"
+    r"Japanese|Korean|Arabic|Hindi|Turkish|Polish|Swedish|Greek|Hebrew)\b",
+    re.IGNORECASE,
+)
+# Subjects that point at something the prompt does not contain ("this", "it", "the image"),
+# or that are really a relative clause about the deliverable ("that rhymes")
+_UNRESOLVED_SUBJECT = re.compile(
+    r"^(?:(?:this|that|these|those|it|its|them|they|he|she|him|her|me|us|here|there|which|who|whom|whose)\b"
+    r"|(?:the|my|our|your|attached)\s+(?:[\w-]+\s+)?(?:image|picture|photo|screenshot|text|passage|document|"
+    r"file|code|attachment|chart|graph|video|above|below|following)s?\b)",
+    re.IGNORECASE,
+)
+
+MAX_TEMPLATED_WORDS = 20
+
+
+class PromptAnalysis:
+    """Fields extracted from one raw prompt; any of them may be None"""
+
+    FIELDS = ("action", "deliverable", "subject", "audience", "length", "tone", "format")
+
+    def __init__(self, raw_prompt, action=None, deliverable=None, subject=None, audience=None, length=None,
+                 tone=None, format=None, templated=False):
+        self.raw_prompt = raw_prompt
+        self.action = action
+        self.deliverable = deliverable
+        self.subject = subject
+        self.audience = audience
+        self.length = length
+        self.tone = tone
+        self.format = format
+        # Simple enough to be assembled without the model
+        self.templated = templated
+        # Who a written piece is addressed to ("my landlord"); also used as the audience
+        self.recipient = None
+
+    def fields(self):
+        return {name: getattr(self, name) for name in self.FIELDS if getattr(self, name)}
+
+    def as_hints(self):
+        """The extracted fields as a note for the model, or "" when nothing was found"""
+        fields = self.fields()
+        if not fields:
+            return ""
+        lines = [f"- {name.capitalize()}: {value}" for name, value in fields.items()]
+        return (
+            "Fields extracted from the raw prompt by a rule-based pre-analysis "
+            "(use them, but correct anything that does not fit the prompt):\n" + "\n".join(lines)
+        )
+
+
+def _strip(text, match):
+    return (text[:match.start()] + " " + text[match.end():]).strip()
+
+
+def analyze(raw_prompt):
+    """Extract the fields of raw_prompt with the precompiled patterns"""
+    text = " ".join(raw_prompt.split())
+    analysis = PromptAnalysis(raw_prompt)
+    rest = text
+    recipient_unparsed = False
+
+    match = _LENGTH.search(rest)
+    if match:
+        analysis.length = re.sub(r"^in\s+", "", match.group(1), flags=re.IGNORECASE)
+        rest = _strip(rest, match)
+    style = None
+    match = _STYLE_PHRASE.search(rest)
+    if match:
+        style = match.group(1).strip(" ,").lower() or None
+        rest = _strip(rest, match)
+    match = _AUDIENCE.search(rest)
+    if match:
+        analysis.audience = match.group(1)
+        rest = _strip(rest, match)
+    match = _FORMAT.search(text)
+    if match:
+        analysis.format = FORMATS[match.group(1).lower()]
+    tones = list(dict.fromkeys(tone.lower() for tone in _TONE.findall(text)))
+    if style and not all(word in TONES for word in re.split(r"[,\s]+", style) if word):
+        # "simple terms", "plain language"
+        tones.append(f"{style} language")
+    if tones:
+        analysis.tone = ", ".join(tones)
+    elif _BRIEF.search(text) and not analysis.length:
+        analysis.length = "brief"
+
+    match = _ACTION.match(rest)
+    if match:
+        analysis.action = ACTIONS[match.group(1).lower()]
+        rest = rest[match.end():]
+        match = _DELIVERABLE.match(rest)
+        if match:
+            modifier = match.group(1).strip().lower()
+            analysis.deliverable = match.group(2).lower()
+            if modifier and modifier not in TONES and modifier not in ("short", "brief"):
+                # "marketing email", "persuasive essay": the modifier says what it is for
+                analysis.deliverable = f"{modifier} {analysis.deliverable}"
+            rest = rest[match.end():]
+        if analysis.action == "write" and re.match(r"to\s", rest.strip(), re.IGNORECASE):
+            # "a letter to my landlord about the heating"; anything else addressed to someone goes to the model
+            match = _RECIPIENT.match(rest.strip())
+            if match is None or analysis.audience:
+                recipient_unparsed = True
+            else:
+                analysis.recipient = analysis.audience = match.group(1)
+                rest = match.group(2) or match.group(3)
+        subject = _FILLER.sub("", _SUBJECT_PREFIX.sub("", rest.strip()))
+        analysis.subject = " ".join(subject.split()) or None
+
+    analysis.templated = bool(
+        analysis.action
+        and analysis.subject
+        and (analysis.action != "write" or analysis.deliverable)
+        and len(text.split()) <= MAX_TEMPLATED_WORDS
+        and not _COMPLEX.search(text)
+        and not _NEGATION.search(text)
+        and not _LANGUAGE.search(text)
+        and not _UNRESOLVED_SUBJECT.match(analysis.subject)
+        and not recipient_unparsed
+    )
+    return analysis
+
+
+def with_article(noun):
+    """The noun with "a" or "an" in front: an essay, a user guide"""
+    vowel = noun[:1].lower() in "aeiou" and not _CONSONANT_SOUND.match(noun)
+    return f"{'an' if vowel else 'a'} {noun}"
+
+
+def _deliverable_profile(analysis):
+    if analysis.deliverable:
+        base = analysis.deliverable.split()[-1]
+        for name in (analysis.deliverable, " ".join(analysis.deliverable.split()[-2:]), base):
+            if name in DELIVERABLES:
+                return DELIVERABLES[name]
+    if analysis.action == "summarize":
+        return DELIVERABLES["summary"]
+    return None
+
+
+def assemble(analysis):
+    """Structured prompt for a templated request, in the layout of the system prompt's example"""
+    audience = analysis.audience or "a general audience with no specialist background"
+    subject = analysis.subject
+    profile = _deliverable_profile(analysis)
+
+    if analysis.action == "explain":
+        role = "an experienced educator who makes complex ideas clear and engaging"
+        if re.search(r"student|child|kid|teen|year[- ]old", audience, re.IGNORECASE):
+            role = "an experienced teacher who makes complex ideas simple and engaging for young learners"
+        task = [f"Explain {subject} clearly and accurately.", "Use everyday analogies and one concrete example."]
+        output_format = analysis.format or "A short, well-organised explanation in plain paragraphs"
+        length = analysis.length or "around 200 words"
+        tone = analysis.tone or "clear, friendly and encouraging"
+        outline = "first introduce the core idea, then build up the details one step at a time"
+    elif analysis.action == "list":
+        role = "a creative strategist who produces practical, well-organised ideas"
+        task = [f"Produce a list about {subject}.", "Give each item a one-line explanation."]
+        output_format = analysis.format or "A numbered list"
+        length = analysis.length or "7-10 items"
+        tone = analysis.tone or "practical and concise"
+        outline = "first collect candidate items, then keep the most useful and order them by importance"
+    else:
+        deliverable = analysis.deliverable or "summary"
+        role, output_format, length = profile or (
+            "a professional writer", with_article(deliverable).capitalize(), "an appropriate length for the format"
+        )
+        if analysis.action != "write":
+            first_line = f"Summarize {subject}."
+        else:
+            addressed = f" to {analysis.recipient}" if analysis.recipient else ""
+            # "an email to my boss asking for a raise"
+            about = "" if re.match(r"\w+ing\b", subject) else "about "
+            first_line = f"Write {with_article(deliverable)}{addressed} {about}{subject}."
+        task = [first_line, "Make the main point obvious from the first lines."]
+        output_format = analysis.format or output_format
+        length = analysis.length or length
+        tone = analysis.tone or "engaging and appropriate for the audience"
+        outline = "first outline the key points, then write the full piece"
+
+    sections = [
+        f"You are {role}.",
+        "Context:\n"
+        f"- Audience: {audience[0].upper() + audience[1:]}.\n"
+        f"- Topic: {subject}.",
+        "Task:\n" + "\n".join(f"- {line}" for line in task),
+        "Constraints:\n"
+        f"- Length: {length}.\n"
+        f"- Tone: {tone}.\n"
+        f"- Use language and examples suited to {audience}.\n"
+        "- Avoid jargon; if you must use a technical term, define it immediately.",
+        "Meta-Instructions:\n"
+        f"- Think step by step: {outline}.\n"
+        "- After drafting, check that every point in the Task and Constraints is addressed.\n"
+        "- Ensure tone and formatting are consistent throughout.",
+        f"Output Format:\n- {output_format}.",
+    ]
+    return "\n\n".join(sections)
+
+
+class PromptAnalyzer:
+    """Routes each transform to the local template, or to Gemini with or without hints"""
+
+    PATHS = ("local", "assisted", "plain")
+
+    def __init__(self, fast_path=False):
+        self.fast_path = fast_path
+        self._counts = dict.fromkeys(self.PATHS, 0)
+        self._lock = threading.Lock()
+
+    def route(self, raw_prompt):
+        """(path, analysis, locally assembled prompt or None)"""
+        analysis = analyze(raw_prompt)
+        if self.fast_path and analysis.templated:
+            path, local = "local", assemble(analysis)
+        else:
+            path, local = ("assisted" if analysis.fields() else "plain"), None
+        with self._lock:
+            self._counts[path] += 1
+        return path, analysis, local
+
+    def hints(self, raw_prompt):
+        return analyze(raw_prompt).as_hints()
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        total = sum(counts.values())
+        counts["local_rate"] = counts["local"] / total if total else 0.0
+        return counts
+
+
+def build_analyzer():
+    """Create the analyzer from PROMPT_ANALYZER* environment variables, or None when disabled"""
+    if os.getenv("PROMPT_ANALYZER", "1").lower() in ("0", "false", "no"):
+        return None
+    return PromptAnalyzer(fast_path=os.getenv("PROMPT_ANALYZER_FAST_PATH", "0").lower() in ("1", "true", "yes"))
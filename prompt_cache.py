@@ -0,0 +1,207 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_prompt(raw_prompt):
+    """Collapse surrounding and repeated whitespace in a raw prompt"""
+    return " ".join(raw_prompt.split())
+
+
+def hash_text(text):
+    """Stable hex digest used for cache keys and system prompt versions"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_cache_key(raw_prompt, model_name, system_prompt):
+    """Build the cache key for one transform request"""
+    # \x1f (unit separator) cannot appear in a model name or a hex digest
+    payload = "\x1f".join([model_name, hash_text(system_prompt), normalize_prompt(raw_prompt)])
+    return hash_text(payload)
+
+
+class LRUCache:
+    """Bounded in-process LRU tier, safe to share across Streamlit sessions"""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class SQLiteCache:
+    """Persistent tier with a TTL and a cap on the number of stored rows"""
+
+    def __init__(self, path, ttl_seconds=7 * 24 * 3600, max_entries=10000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return value
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        # Expired rows go first, then the least recently read ones over the cap
+        if self.ttl_seconds:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY accessed_at ASC LIMIT ?)",
+                (overflow,),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+            return count
+
+
+class TwoTierCache:
+    """Memory tier in front of a disk tier, with hit/miss counters.
+
+    An optional shared tier (see coordination.SharedCache) comes last, so
+    results generated by other replicas are found too.
+    """
+
+    def __init__(self, memory, disk=None, shared=None):
+        self.memory = memory
+        self.disk = disk
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "shared_hits": 0, "misses": 0, "writes": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, key, record=True):
+        """Look up a key; record=False leaves the hit/miss counters alone"""
+        value = self.memory.get(key)
+        if value is not None:
+            if record:
+                self._count("memory_hits")
+            return value
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                # Promote so the next session asking for it skips SQLite
+                self.memory.set(key, value)
+                if record:
+                    self._count("disk_hits")
+                return value
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+                if self.disk is not None:
+                    self.disk.set(key, value)
+                if record:
+                    self._count("shared_hits")
+                return value
+        if record:
+            self._count("misses")
+        return None
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+        self._count("writes")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["shared_hits"] + stats["misses"]
+        stats["hit_rate"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        stats["memory_entries"] = len(self.memory)
+        return stats
+
+
+def build_prompt_cache(shared=None):
+    """Create the cache from PROMPT_CACHE_* environment variables, with an optional shared tier"""
+    memory = LRUCache(max_entries=int(os.getenv("PROMPT_CACHE_MEMORY_ENTRIES", "512")))
+    disk = None
+    db_path = os.getenv("PROMPT_CACHE_DB", os.path.join(".cache", "prompt_cache.sqlite3"))
+    if db_path:
+        disk = SQLiteCache(
+            db_path,
+            ttl_seconds=float(os.getenv("PROMPT_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+            max_entries=int(os.getenv("PROMPT_CACHE_DISK_ENTRIES", "10000")),
+        )
+    return TwoTierCache(memory, disk, shared)
@@ -0,0 +1,87 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Session state keys used to tie script runs to the user action behind them
+PENDING_ACTION_KEY = "_rerun_pending_action"
+CURRENT_ACTION_KEY = "_rerun_current_action"
+PROGRAMMATIC_KEY = "_rerun_programmatic"
+CURRENT_RUN_KEY = "_rerun_current_run"
+
+
+class RerunTracker:
+    """Counts script executions and their duration per user action.
+
+    Widget callbacks call mark_action() to name the action they start.
+    Programmatic st.rerun() calls go through mark_programmatic_rerun(), so the
+    extra execution is charged to the action that caused it. Any other run is
+    an unnamed widget interaction (or the first page load of a session).
+    record_payload() adds up the bytes of large values sent to the browser
+    during a run.
+    """
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def mark_action(self, session, action):
+        session[PENDING_ACTION_KEY] = action
+
+    def mark_programmatic_rerun(self, session):
+        session[PROGRAMMATIC_KEY] = True
+
+    def begin_run(self, session):
+        """Classify the current script run; returns a token for end_run()"""
+        pending = session.pop(PENDING_ACTION_KEY, None)
+        programmatic = session.pop(PROGRAMMATIC_KEY, False)
+        if pending is not None:
+            action, new_action = pending, True
+        elif programmatic and CURRENT_ACTION_KEY in session:
+            action, new_action = session[CURRENT_ACTION_KEY], False
+        else:
+            action = "interaction" if CURRENT_ACTION_KEY in session else "page_load"
+            new_action = True
+        session[CURRENT_ACTION_KEY] = action
+        token = {"action": action, "new_action": new_action, "started": time.perf_counter(), "payload_bytes": 0}
+        session[CURRENT_RUN_KEY] = token
+        return token
+
+    def record_payload(self, session, text):
+        """Count `text` as sent to the browser during the current run"""
+        token = session.get(CURRENT_RUN_KEY)
+        if token is not None and text:
+            token["payload_bytes"] += len(text.encode("utf-8"))
+
+    def end_run(self, token):
+        action = token["action"]
+        elapsed_ms = (time.perf_counter() - token["started"]) * 1000
+        with self._lock:
+            stats = self._stats.setdefault(
+                action, {"actions": 0, "runs": 0, "total_ms": 0.0, "max_ms": 0.0, "payload_bytes": 0}
+            )
+            stats["actions"] += token["new_action"]
+            stats["runs"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            stats["payload_bytes"] += token["payload_bytes"]
+        logger.info(
+            "script run action=%s new_action=%s elapsed_ms=%.1f payload_bytes=%d",
+            action, token["new_action"], elapsed_ms, token["payload_bytes"],
+        )
+        return elapsed_ms
+
+    def summary(self):
+        """Per action: how many actions, script runs per action and mean run time"""
+        with self._lock:
+            return {
+                action: {
+                    "actions": stats["actions"],
+                    "runs_per_action": stats["runs"] / stats["actions"] if stats["actions"] else float(stats["runs"]),
+                    "mean_ms": stats["total_ms"] / stats["runs"],
+                    "max_ms": stats["max_ms"],
+                    "mean_payload_bytes": stats["payload_bytes"] / stats["runs"],
+                }
+                for action, stats in self._stats.items()
+            }
@@ -0,0 +1,251 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+# HTTP-equivalent status codes that are worth another attempt
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_NAMES = {
+    "ResourceExhausted",
+    "TooManyRequests",
+    "ServiceUnavailable",
+    "InternalServerError",
+    "DeadlineExceeded",
+    "GatewayTimeout",
+    "BadGateway",
+}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Gemini while the circuit breaker is open"""
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"Gemini is temporarily unavailable; retry in {retry_after:.0f}s")
+
+
+def is_retryable(exc):
+    """True for throttling and transient server errors"""
+    # google.api_core exceptions carry the HTTP status as an int `code`
+    code = getattr(exc, "code", None)
+    if isinstance(code, int) and code in RETRYABLE_CODES:
+        return True
+    return type(exc).__name__ in RETRYABLE_NAMES or isinstance(exc, (TimeoutError, ConnectionError))
+
+
+class TokenBucket:
+    """Reservation-style token bucket; callers wait off the returned delay"""
+
+    def __init__(self, capacity, refill_per_second, clock=time.monotonic):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.refill_per_second)
+        self._updated = now
+
+    def reserve(self, cost):
+        """Take `cost` tokens now and return how long to wait before using them"""
+        with self._lock:
+            self._refill(self.clock())
+            self._tokens -= cost
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.refill_per_second
+
+    def adjust(self, delta):
+        """Correct an earlier reservation once the real cost is known"""
+        with self._lock:
+            self._refill(self.clock())
+            self._tokens = min(self.capacity, self._tokens - delta)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute budgets shared by all callers"""
+
+    def __init__(self, rpm, tpm=None):
+        self.requests = TokenBucket(rpm, rpm / 60.0)
+        self.tokens = TokenBucket(tpm, tpm / 60.0) if tpm else None
+
+    def reserve(self, estimated_tokens):
+        wait = self.requests.reserve(1)
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(estimated_tokens))
+        return wait
+
+    def acquire(self, estimated_tokens=0):
+        wait = self.reserve(estimated_tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, estimated_tokens=0):
+        wait = self.reserve(estimated_tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        if self.tokens is not None and actual_tokens is not None:
+            self.tokens.adjust(actual_tokens - estimated_tokens)
+
+
+class CircuitBreaker:
+    """Opens after consecutive upstream failures and fails fast until the cooldown ends"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, cooldown_seconds=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.clock = clock
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def remaining_cooldown(self):
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self.cooldown_seconds - self.clock())
+
+    def before_call(self):
+        """Raise CircuitOpenError unless this call may go upstream"""
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self._opened_at + self.cooldown_seconds - self.clock()
+                if remaining > 0:
+                    raise CircuitOpenError(remaining)
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN:
+                # Let exactly one probe through; everyone else keeps failing fast
+                if self._trial_in_flight:
+                    raise CircuitOpenError(self.cooldown_seconds)
+                self._trial_in_flight = True
+
+    def release_trial(self):
+        """Let another call probe after one that ended without a verdict on upstream health"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = self.clock()
+                self._trial_in_flight = False
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter"""
+
+    def __init__(self, max_attempts=4, base_delay=1.0, max_delay=20.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class UpstreamGuard:
+    """Rate limiting, retries and circuit breaking around one upstream call"""
+
+    def __init__(self, limiter=None, breaker=None, retry_policy=None):
+        self.limiter = limiter
+        self.breaker = breaker or CircuitBreaker()
+        self.retry_policy = retry_policy or RetryPolicy()
+
+    def _failed(self, exc, attempt):
+        """Record a failed attempt; True when the caller should try again"""
+        if not is_retryable(exc):
+            # Bad requests say nothing about upstream health
+            self.breaker.record_success()
+            return False
+        self.breaker.record_failure()
+        return attempt + 1 < self.retry_policy.max_attempts
+
+    def call(self, send, estimated_tokens=0):
+        for attempt in range(self.retry_policy.max_attempts):
+            self.breaker.before_call()
+            settled = False
+            try:
+                if self.limiter is not None:
+                    self.limiter.acquire(estimated_tokens)
+                try:
+                    result = send()
+                except Exception as e:
+                    settled = True
+                    if not self._failed(e, attempt):
+                        raise
+                    time.sleep(self.retry_policy.delay(attempt))
+                    continue
+                settled = True
+            finally:
+                if not settled:
+                    # Cancelled or interrupted with no verdict; a half-open breaker must not wait on this probe
+                    self.breaker.release_trial()
+            self.breaker.record_success()
+            return result
+
+    async def call_async(self, send, estimated_tokens=0):
+        for attempt in range(self.retry_policy.max_attempts):
+            self.breaker.before_call()
+            settled = False
+            try:
+                if self.limiter is not None:
+                    await self.limiter.acquire_async(estimated_tokens)
+                try:
+                    result = await send()
+                except Exception as e:
+                    settled = True
+                    if not self._failed(e, attempt):
+                        raise
+                    await asyncio.sleep(self.retry_policy.delay(attempt))
+                    continue
+                settled = True
+            finally:
+                if not settled:
+                    self.breaker.release_trial()
+            self.breaker.record_success()
+            return result
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        if self.limiter is not None:
+            self.limiter.record_usage(estimated_tokens, actual_tokens)
+
+
+def build_upstream_guard(coordination=None):
+    """Create the guard from GEMINI_* rate limit and retry environment variables.
+
+    With a coordination backend the rate limit is shared by every replica.
+    """
+    rpm = float(os.getenv("GEMINI_RPM", "60"))
+    tpm = float(os.getenv("GEMINI_TPM", "1000000"))
+    limiter = None
+    if rpm > 0:
+        limiter = coordination.limiter("gemini", rpm, tpm) if coordination is not None else RateLimiter(rpm, tpm)
+    return UpstreamGuard(
+        limiter=limiter,
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5")),
+            cooldown_seconds=float(os.getenv("GEMINI_BREAKER_COOLDOWN_SECONDS", "30")),
+        ),
+        retry_policy=RetryPolicy(max_attempts=int(os.getenv("GEMINI_MAX_ATTEMPTS", "4"))),
+    )
@@ -0,0 +1,236 @@
+"""Bounded, shared storage for the prompt text that browser sessions hold.
+
+Each open tab used to keep its own copies of the structured prompt and the
+generated variants in st.session_state for as long as it stayed open. Now a
+session keeps only digests. The text is stored once in a content-addressed
+store shared by every session, so a hundred tabs showing the same Quick
+Example hold a single copy, and a text is dropped as soon as no session
+refers to it.
+
+Widget values (the raw prompt, the output text area) have to stay in the
+session itself. Their size is reported with touch() and counts towards
+both budgets, so the limits cover everything a session holds.
+
+Three limits keep the memory bounded:
+
+* a session over its own budget drops its oldest payloads, never the one
+  being stored or shown;
+* when the store and the widget copies are over the total budget, the
+  least recently active sessions are evicted;
+* sessions not seen for idle_seconds are evicted.
+
+An evicted session finds its payloads gone on its next run and drops its
+copy of the output then. The transforms themselves are still in the
+response cache and the history.
+"""
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+# Session state key holding the id this registry knows the session by
+SESSION_ID_KEY = "_memory_session_id"
+
+# Idle sessions are looked for at most this often
+SWEEP_INTERVAL_SECONDS = 10.0
+
+
+def text_bytes(text):
+    return len(text.encode("utf-8")) if text else 0
+
+
+class PayloadStore:
+    """Texts keyed by their SHA-256, reference counted"""
+
+    def __init__(self):
+        # digest -> [text, size in bytes, references]
+        self._texts = {}
+        self.bytes = 0
+
+    def add(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        entry = self._texts.get(digest)
+        if entry is None:
+            entry = self._texts[digest] = [text, text_bytes(text), 0]
+            self.bytes += entry[1]
+        entry[2] += 1
+        return digest
+
+    def get(self, digest):
+        entry = self._texts.get(digest)
+        return entry[0] if entry is not None else None
+
+    def size(self, digest):
+        return self._texts[digest][1]
+
+    def release(self, digest):
+        entry = self._texts[digest]
+        entry[2] -= 1
+        if entry[2] == 0:
+            del self._texts[digest]
+            self.bytes -= entry[1]
+
+    def __len__(self):
+        return len(self._texts)
+
+
+class _Session:
+    def __init__(self, now):
+        self.last_seen = now
+        # Payload name -> (digests, whether the value was a single text); oldest first
+        self.payloads = {}
+        self.bytes = 0
+        # Widget values (the raw prompt, the output text area) that stay in the session itself
+        self.local_bytes = 0
+
+
+class SessionMemory:
+    """Per-session references into one PayloadStore, with per-session, total and idle limits.
+
+    `session` arguments are the session's dict-like state; only a short id is
+    written to it.
+    """
+
+    def __init__(self, session_budget_bytes=256 * 1024, total_budget_bytes=64 * 1024 * 1024,
+                 idle_seconds=1800.0, clock=time.monotonic):
+        self.session_budget_bytes = session_budget_bytes
+        self.total_budget_bytes = total_budget_bytes
+        self.idle_seconds = idle_seconds
+        self.clock = clock
+        self.store = PayloadStore()
+        self.evictions = {"idle": 0, "total_budget": 0, "session_budget": 0}
+        self._sessions = {}
+        # Widget bytes of all tracked sessions
+        self._local_bytes = 0
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def _entry(self, session, now):
+        """(the session's entry, whether its payloads were evicted since it was last seen)"""
+        session_id = session.get(SESSION_ID_KEY)
+        entry = self._sessions.get(session_id)
+        if entry is not None:
+            entry.last_seen = now
+            return entry, False
+        evicted = session_id is not None
+        if session_id is None:
+            session_id = session[SESSION_ID_KEY] = uuid.uuid4().hex
+        entry = self._sessions[session_id] = _Session(now)
+        return entry, evicted
+
+    def touch(self, session, local_bytes=0):
+        """Mark the session active; True when its payloads were evicted while it was away.
+
+        `local_bytes` is the size of the widget values the session keeps itself;
+        it counts towards the budgets, and the session's older payloads are
+        dropped when it leaves no room for them.
+        """
+        with self._lock:
+            now = self.clock()
+            if now >= self._next_sweep:
+                self._next_sweep = now + SWEEP_INTERVAL_SECONDS
+                self._evict_idle(now)
+            entry, evicted = self._entry(session, now)
+            self._local_bytes += local_bytes - entry.local_bytes
+            entry.local_bytes = local_bytes
+            # The newest payload is the one on screen
+            self._enforce_session_budget(entry, next(reversed(entry.payloads), None))
+            self._enforce_total_budget(entry)
+            return evicted
+
+    def put(self, session, name, value):
+        """Store a text, or a list of texts, under `name` for this session"""
+        single = isinstance(value, str)
+        texts = [value] if single else list(value)
+        with self._lock:
+            entry, _ = self._entry(session, self.clock())
+            self._drop(entry, name)
+            digests = [self.store.add(text) for text in texts]
+            entry.payloads[name] = (digests, single)
+            entry.bytes += sum(self.store.size(digest) for digest in digests)
+            self._enforce_session_budget(entry, name)
+            self._enforce_total_budget(entry)
+
+    def get(self, session, name):
+        """The text (or list of texts) stored under `name`, or None"""
+        with self._lock:
+            entry = self._sessions.get(session.get(SESSION_ID_KEY))
+            payload = entry.payloads.get(name) if entry is not None else None
+            if payload is None:
+                return None
+            digests, single = payload
+            texts = [self.store.get(digest) for digest in digests]
+            return texts[0] if single else texts
+
+    def discard(self, session, name):
+        with self._lock:
+            entry = self._sessions.get(session.get(SESSION_ID_KEY))
+            if entry is not None:
+                self._drop(entry, name)
+
+    def _drop(self, entry, name):
+        payload = entry.payloads.pop(name, None)
+        if payload is not None:
+            for digest in payload[0]:
+                entry.bytes -= self.store.size(digest)
+                self.store.release(digest)
+
+    def _evict(self, session_id, reason):
+        entry = self._sessions.pop(session_id)
+        self._local_bytes -= entry.local_bytes
+        for name in list(entry.payloads):
+            self._drop(entry, name)
+        self.evictions[reason] += 1
+
+    def _enforce_session_budget(self, entry, keep):
+        for name in list(entry.payloads):
+            if entry.bytes + entry.local_bytes <= self.session_budget_bytes:
+                return
+            if name != keep:
+                self._drop(entry, name)
+                self.evictions["session_budget"] += 1
+
+    def _total_bytes(self):
+        return self.store.bytes + self._local_bytes
+
+    def _enforce_total_budget(self, current):
+        if self._total_bytes() <= self.total_budget_bytes:
+            return
+        by_age = sorted(self._sessions.items(), key=lambda item: item[1].last_seen)
+        for session_id, entry in by_age:
+            if self._total_bytes() <= self.total_budget_bytes:
+                return
+            if entry is not current:
+                self._evict(session_id, "total_budget")
+
+    def _evict_idle(self, now):
+        idle = [
+            session_id for session_id, entry in self._sessions.items()
+            if now - entry.last_seen > self.idle_seconds
+        ]
+        for session_id in idle:
+            self._evict(session_id, "idle")
+
+    def stats(self):
+        with self._lock:
+            referenced = sum(entry.bytes for entry in self._sessions.values())
+            return {
+                "sessions": len(self._sessions),
+                "payloads": len(self.store),
+                "shared_bytes": self.store.bytes,
+                # What the sessions would hold if each kept its own copies
+                "referenced_bytes": referenced,
+                "session_bytes": self._local_bytes,
+                "total_bytes": self._total_bytes(),
+                "evictions": dict(self.evictions),
+            }
+
+
+def build_session_memory():
+    """Create the session memory limits from SESSION_* environment variables"""
+    return SessionMemory(
+        session_budget_bytes=int(os.getenv("SESSION_MEMORY_BUDGET_BYTES", str(256 * 1024))),
+        total_budget_bytes=int(os.getenv("SESSION_MEMORY_TOTAL_BYTES", str(64 * 1024 * 1024))),
+        idle_seconds=float(os.getenv("SESSION_IDLE_SECONDS", "1800")),
+    )
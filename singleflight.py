@@ -0,0 +1,91 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class LeaderInterrupted(Exception):
+    """The leader stopped without a result (an abandoned stream, a cancelled task).
+
+    Nothing went wrong upstream, so a waiter claims the key again and runs the
+    request itself instead of failing.
+    """
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one upstream call.
+
+    The first caller for a key becomes the leader and does the work; callers
+    arriving while it runs wait on the same future and get its result or its
+    exception. Futures are thread-safe, so blocking and asyncio callers can
+    join the same flight. If the leader is interrupted rather than failing,
+    waiters get LeaderInterrupted and do() / do_async() start a new flight.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key):
+        """Return (future, is_leader); the leader must call resolve()"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self.leaders += 1
+            return future, True
+
+    def resolve(self, key, future, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+        if error is not None:
+            if not isinstance(error, Exception):
+                # The leader was cancelled or its stream abandoned, for example
+                # a stale live preview; that is no reason for waiters to fail
+                error = LeaderInterrupted()
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def do(self, key, fn):
+        while True:
+            future, leader = self.claim(key)
+            if leader:
+                break
+            try:
+                return future.result()
+            except LeaderInterrupted:
+                continue
+        try:
+            result = fn()
+        except BaseException as e:
+            self.resolve(key, future, error=e)
+            raise
+        self.resolve(key, future, result=result)
+        return result
+
+    async def do_async(self, key, fn):
+        while True:
+            future, leader = self.claim(key)
+            if leader:
+                break
+            try:
+                return await asyncio.wrap_future(future)
+            except LeaderInterrupted:
+                continue
+        try:
+            result = await fn()
+        except BaseException as e:
+            self.resolve(key, future, error=e)
+            raise
+        self.resolve(key, future, result=result)
+        return result
@@ -0,0 +1,87 @@
+"""Cold-start import report and budget check for the Streamlit app.
+
+Imports app.py in a fresh interpreter under `-X importtime`, the way
+`streamlit run` loads it, and prints its slowest direct imports. It
+exits non-zero when the import exceeds the budget or pulls in a module that
+must stay lazy, so it can gate CI:
+
+    python startup_report.py
+    python startup_report.py --budget-ms 1000 --top 15
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+# Modules that only the transform path needs; importing them at startup is a regression
+LAZY_MODULES = ["google.generativeai", "grpc"]
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure_imports(module="app", cwd=None):
+    """Run a cold import of `module` and return [(name, self_us, cumulative_us, depth)]"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd or os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            # importtime indents nested imports by two spaces per level
+            rows.append((name, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return rows
+
+
+def summarize(rows, module, top=10):
+    """Total import time of `module` and its most expensive direct imports"""
+    total_us, direct, children = 0, [], []
+    # importtime lists a module after everything it imported, so the depth-1
+    # rows just before the module's own top-level row are its direct imports
+    for row in rows:
+        if row[3] == 1:
+            children.append(row)
+        elif row[3] == 0:
+            if row[0] == module:
+                total_us += row[2]
+                direct.extend(children)
+            children = []
+    slowest = sorted(direct, key=lambda row: row[2], reverse=True)[:top]
+    imported = {row[0] for row in rows}
+    return total_us, slowest, imported
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report and check the app's cold-start import time")
+    parser.add_argument("--module", default="app", help="Module to import (default: app)")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", "1500")),
+                        help="Fail if the cold import takes longer (default 1500, or STARTUP_BUDGET_MS)")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to list")
+    args = parser.parse_args(argv)
+
+    total_us, slowest, imported = summarize(measure_imports(args.module), args.module, args.top)
+    print(f"Cold import of {args.module}: {total_us / 1000:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    print(f"{'cumulative ms':>14}  module")
+    for name, _, cumulative_us, _ in slowest:
+        print(f"{cumulative_us / 1000:>14.1f}  {name}")
+
+    failures = []
+    if total_us / 1000 > args.budget_ms:
+        failures.append(f"cold import took {total_us / 1000:.0f} ms, over the {args.budget_ms:.0f} ms budget")
+    for module in LAZY_MODULES:
+        if module in imported:
+            failures.append(f"{module} is imported at startup; it should load on the first transform")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
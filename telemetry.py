@@ -0,0 +1,346 @@
+"""Per-request timing spans, token usage and a Prometheus metrics endpoint.
+
+A RequestTrace follows one transform from the button click to the rendered
+output. The engine fills in the model-side spans, cache outcome, token usage
+and error class, and the UI adds the render span. Telemetry.finish() turns
+the trace into Prometheus counters and histograms, served as text on
+http://127.0.0.1:9464/metrics by default, and logs it as one JSON line.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+request_logger = logging.getLogger("telemetry.requests")
+
+# Seconds; spans range from sub-millisecond cache hits to long generations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+
+class RequestTrace:
+    """Spans and attributes of one transform request.
+
+    Spans, in the order they happen: analysis, token_count, queue_wait (rate
+    limiter, retry backoff or waiting on an identical in-flight request),
+    model_construction, request_send, first_chunk, completion and render.
+    """
+
+    def __init__(self, mode, clock=time.perf_counter):
+        self.request_id = uuid.uuid4().hex[:16]
+        self.mode = mode
+        self.clock = clock
+        self.started = clock()
+        # Span name -> seconds; first_chunk and completion are measured from the start
+        self.spans = {}
+        self.cache = None
+        self.tokens = {}
+        self.error = None
+        # Request input tokens as counted before sending, after any compaction
+        self.budgeted_tokens = None
+        self.compacted = False
+        # None, or whether a hedged request was won by the "primary" or "backup" call, or "denied" by the cap
+        self.hedge = None
+        # Pre-analysis path: "local" (assembled without Gemini), "assisted" (sent with hints) or "plain"
+        self.analysis = None
+        self._completed_at = None
+
+    def elapsed(self):
+        return self.clock() - self.started
+
+    def add_span(self, name, seconds):
+        # Retries can run a phase more than once; the span is the total
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    @contextmanager
+    def span(self, name):
+        started = self.clock()
+        try:
+            yield
+        finally:
+            self.add_span(name, self.clock() - started)
+
+    def first_chunk(self):
+        if "first_chunk" not in self.spans:
+            self.spans["first_chunk"] = self.elapsed()
+
+    def complete(self):
+        self._completed_at = self.clock()
+        self.spans["completion"] = self._completed_at - self.started
+
+    def rendered(self):
+        """Close the render span, from completion to the output being on the page"""
+        if self._completed_at is not None:
+            self.spans["render"] = self.clock() - self._completed_at
+
+    def record_usage(self, response):
+        usage = getattr(response, "usage_metadata", None)
+        if not usage:
+            return
+        for kind, field in (("prompt", "prompt_token_count"), ("output", "candidates_token_count"),
+                            ("total", "total_token_count")):
+            count = getattr(usage, field, None)
+            if count:
+                self.tokens[kind] = count
+
+    def record_error(self, exc):
+        self.error = type(exc).__name__
+
+    def as_dict(self):
+        return {
+            "request_id": self.request_id,
+            "mode": self.mode,
+            "cache": self.cache,
+            "error": self.error,
+            "budgeted_tokens": self.budgeted_tokens,
+            "compacted": self.compacted,
+            "hedge": self.hedge,
+            "analysis": self.analysis,
+            "tokens": self.tokens,
+            "spans_ms": {name: round(seconds * 1000, 2) for name, seconds in self.spans.items()},
+            "total_ms": round(self.elapsed() * 1000, 2),
+        }
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """A value that goes up and down, set from the latest reading"""
+
+    def set(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Label values -> [per-bucket counts..., +Inf count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    labels = _format_labels(self.labelnames, key, [("le", le)])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {series[-1]!r}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named counters, gauges and histograms rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, labelnames=()):
+        metric = Gauge(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class Telemetry:
+    """Request metrics shared by every session in the process"""
+
+    def __init__(self, registry=None, log_requests=True):
+        self.registry = registry or MetricsRegistry()
+        self.log_requests = log_requests
+        self.requests = self.registry.counter(
+            "metapromptor_requests_total", "Transform requests by mode, cache outcome and result",
+            ["mode", "cache", "outcome"],
+        )
+        self.errors = self.registry.counter(
+            "metapromptor_request_errors_total", "Failed transform requests by error class", ["error"]
+        )
+        self.span_seconds = self.registry.histogram(
+            "metapromptor_span_seconds", "Time spent in each phase of a transform request", ["span"]
+        )
+        self.request_seconds = self.registry.histogram(
+            "metapromptor_request_seconds", "End-to-end transform request time", ["mode"]
+        )
+        self.tokens = self.registry.counter(
+            "metapromptor_tokens_total", "Tokens reported in the response usage_metadata", ["kind"]
+        )
+        self.compacted = self.registry.counter(
+            "metapromptor_compacted_requests_total", "Requests whose raw prompt was cut to fit the input token budget"
+        )
+        self.hedges = self.registry.counter(
+            "metapromptor_hedges_total", "Hedge decisions for slow requests by result (primary, backup, denied)",
+            ["result"],
+        )
+        self.analysis = self.registry.counter(
+            "metapromptor_analysis_path_total",
+            "Transforms by pre-analysis path (local template, Gemini with hints, plain Gemini)", ["path"],
+        )
+        self.session_memory = self.registry.gauge(
+            "metapromptor_session_memory_bytes",
+            "Prompt text held for browser sessions: the shared store and widget values kept per session", ["kind"],
+        )
+        self.sessions = self.registry.gauge("metapromptor_sessions", "Browser sessions holding prompt text")
+        self.server = None
+
+    def start_request(self, mode):
+        return RequestTrace(mode)
+
+    def finish(self, trace):
+        total = trace.elapsed()
+        outcome = "error" if trace.error else "ok"
+        self.requests.inc(mode=trace.mode, cache=trace.cache or "none", outcome=outcome)
+        if trace.error:
+            self.errors.inc(error=trace.error)
+        for name, seconds in trace.spans.items():
+            self.span_seconds.observe(seconds, span=name)
+        self.request_seconds.observe(total, mode=trace.mode)
+        if trace.compacted:
+            self.compacted.inc()
+        if trace.hedge:
+            self.hedges.inc(result=trace.hedge)
+        if trace.analysis:
+            self.analysis.inc(path=trace.analysis)
+        for kind, count in trace.tokens.items():
+            self.tokens.inc(count, kind=kind)
+        if self.log_requests:
+            request_logger.info(json.dumps(dict(trace.as_dict(), event="transform", ts=time.time())))
+
+    def record_session_memory(self, stats):
+        """Update the session memory gauges from SessionMemory.stats()"""
+        self.session_memory.set(stats["shared_bytes"], kind="shared")
+        self.session_memory.set(stats["session_bytes"], kind="session")
+        self.sessions.set(stats["sessions"])
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serve /metrics on a daemon thread; a port already in use only logs a warning"""
+        registry = self.registry
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as e:
+            logger.warning("Metrics endpoint not started on %s:%s: %s", host, port, e)
+            return None
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="metrics-endpoint", daemon=True).start()
+        return self.server
+
+
+def build_telemetry(serve_metrics=True):
+    """Create the telemetry from METRICS_* and REQUEST_LOG_JSON environment variables.
+
+    Pass serve_metrics=False when the caller exposes the registry itself.
+    """
+    log_requests = os.getenv("REQUEST_LOG_JSON", "1").lower() not in ("0", "false", "no")
+    if log_requests and not request_logger.handlers:
+        # One bare JSON object per line, ready for a log shipper
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        request_logger.addHandler(handler)
+        request_logger.setLevel(logging.INFO)
+        request_logger.propagate = False
+    telemetry = Telemetry(log_requests=log_requests)
+    port = int(os.getenv("METRICS_PORT", "9464"))
+    if port and serve_metrics:
+        telemetry.serve(port, host=os.getenv("METRICS_HOST", "127.0.0.1"))
+    return telemetry
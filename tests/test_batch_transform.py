@@ -0,0 +1,22 @@
+import json
+
+from batch_transform import completed_indices
+
+
+def test_resume_skips_only_transformed_lines(tmp_path):
+    output = tmp_path / "results.jsonl"
+    lines = [
+        {"index": 0, "id": None, "raw_prompt": "a", "structured_prompt": "A"},
+        {"index": 1, "id": None, "raw_prompt": "b", "error": "ServiceUnavailable: try again"},
+        {"index": 2, "id": None, "raw_prompt": "c", "structured_prompt": "C"},
+    ]
+    output.write_text("".join(json.dumps(line) + "\n" for line in lines), encoding="utf-8")
+    assert completed_indices(str(output)) == {0, 2}
+
+
+def test_torn_last_line_is_dropped(tmp_path):
+    output = tmp_path / "results.jsonl"
+    complete = json.dumps({"index": 0, "structured_prompt": "A"}) + "\n"
+    output.write_text(complete + '{"index": 1, "struct', encoding="utf-8")
+    assert completed_indices(str(output)) == {0}
+    assert output.read_text(encoding="utf-8") == complete
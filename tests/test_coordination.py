@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+from benchmarks.fake_gemini import FakeModel, FakeProfile
+from coordination import Coordination, SQLiteBackend
+from gemini_client import ModelProvider
+from prompt_cache import LRUCache, TwoTierCache
+from resilience import UpstreamGuard
+from transform_engine import TransformEngine
+
+BACKEND_DELAY = 0.2
+
+
+class SlowBackend:
+    """A backend whose every command takes BACKEND_DELAY, like a Redis behind a congested link"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.commands = 0
+
+    def _slow(self, name, *args, **kwargs):
+        self.commands += 1
+        time.sleep(BACKEND_DELAY)
+        return getattr(self.backend, name)(*args, **kwargs)
+
+    def get(self, *args, **kwargs):
+        return self._slow("get", *args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        return self._slow("set", *args, **kwargs)
+
+    def incr(self, *args, **kwargs):
+        return self._slow("incr", *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._slow("delete", *args, **kwargs)
+
+
+def make_engine(tmp_path):
+    backend = SlowBackend(SQLiteBackend(str(tmp_path / "coordination.sqlite3")))
+    coordination = Coordination(backend)
+    profile = FakeProfile(latency_ms=20.0, ttft_ms=5.0, chunks=2, response_chars=80)
+    provider = ModelProvider(
+        "fake-model", "system", model_factory=lambda name, **kwargs: FakeModel(name, profile=profile, **kwargs)
+    )
+    engine = TransformEngine(
+        provider,
+        cache=TwoTierCache(LRUCache(), shared=coordination.cache),
+        guard=UpstreamGuard(limiter=coordination.limiter("gemini", rpm=600, tpm=1000000)),
+        replica_flights=coordination.flights,
+    )
+    return engine, backend
+
+
+def test_slow_backend_does_not_stall_the_event_loop(tmp_path):
+    engine, backend = make_engine(tmp_path)
+
+    async def main():
+        gaps = []
+
+        async def heartbeat(done):
+            last = time.monotonic()
+            while not done.is_set():
+                await asyncio.sleep(0.01)
+                now = time.monotonic()
+                gaps.append(now - last)
+                last = now
+
+        done = asyncio.Event()
+        beat = asyncio.create_task(heartbeat(done))
+        results = await asyncio.gather(*(engine.transform_async(f"Write a poem about tide {i}") for i in range(3)))
+        done.set()
+        await beat
+        return results, gaps
+
+    results, gaps = asyncio.run(main())
+    assert all(results)
+    assert backend.commands > 0
+    # Every backend command takes 200 ms; none of them may run on the loop itself
+    assert max(gaps) < BACKEND_DELAY / 2
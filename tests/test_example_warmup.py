@@ -0,0 +1,11 @@
+import os
+
+from example_warmup import load_example_outputs, save_example_outputs
+
+
+def test_outputs_are_written_into_a_new_directory_without_leftovers(tmp_path):
+    path = str(tmp_path / "cache" / "example_outputs.json")
+    save_example_outputs(path, "hash", "model", {"prompt": "output"})
+    save_example_outputs(path, "hash", "model", {"prompt": "newer output"})
+    assert load_example_outputs(path, "hash", "model") == {"prompt": "newer output"}
+    assert os.listdir(tmp_path / "cache") == ["example_outputs.json"]
@@ -0,0 +1,41 @@
+import pytest
+
+import gemini_client
+from gemini_client import ContextCache, ModelProvider
+
+genai = pytest.importorskip("google.generativeai")
+
+
+class CachedPrefix(ContextCache):
+    """Stands in for GeminiContextCache: a model bound to a cached prefix"""
+
+    def __init__(self):
+        self.model = genai.GenerativeModel("gemini-test")
+        self.model._cached_content = "cachedContents/default-key"
+
+    def build_model(self, model_name, system_instruction):
+        return self.model
+
+
+def make_provider():
+    gemini_client.get_genai()
+    return ModelProvider("gemini-test", "system", context_cache=CachedPrefix())
+
+
+def test_keyed_copies_do_not_use_the_default_keys_cached_prefix():
+    provider = make_provider()
+    assert provider.get()._cached_content == "cachedContents/default-key"
+    keyed = provider.get("key-b")
+    assert getattr(keyed, "_cached_content", None) is None
+    assert keyed._client is gemini_client.key_clients("key-b").get("generative")
+    assert provider.get("key-b") is keyed
+
+
+def test_missing_sdk_internals_fail_loudly(monkeypatch):
+    provider = make_provider()
+    from google.generativeai import client as genai_client
+
+    monkeypatch.delattr(genai_client, "_ClientManager")
+    monkeypatch.setitem(gemini_client._key_clients, "key-c", gemini_client.KeyClients("key-c"))
+    with pytest.raises(RuntimeError, match="google-generativeai"):
+        provider.get("key-c")
@@ -0,0 +1,47 @@
+import hashlib
+
+import pytest
+
+from near_duplicates import NearDuplicateIndex, build_near_duplicate_index
+
+
+def key(prompt):
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+def index_with(prompt):
+    index = NearDuplicateIndex()
+    index.add(prompt, key(prompt))
+    return index
+
+
+def test_rephrasing_with_filler_words_matches():
+    prompt = "Write a poem about the sea and use rhymes"
+    assert index_with(prompt).lookup("Please write a poem about the sea, and use rhymes!") == key(prompt)
+
+
+@pytest.mark.parametrize("stored, asked", [
+    ("Write a poem about the sea and do use rhymes", "Write a poem about the sea and do not use rhymes"),
+    ("Write a poem about the sea and do use rhymes", "Write a poem about the sea and don't use rhymes"),
+    ("Write a story with dragons in it", "Write a story without dragons in it"),
+    ("Summarize the report in 150 words", "Summarize the report in 300 words"),
+    ("Write an informal cover letter for a junior data analyst role",
+     "Write a formal cover letter for a junior data analyst role"),
+    ("Write a sad story about a cat", "Write a funny story about a cat"),
+    ("Explain how to deploy a web app with Kubernetes on GCP",
+     "Explain how to deploy a web app with Kubernetes on AWS"),
+])
+def test_prompts_that_differ_in_a_content_word_never_match(stored, asked):
+    assert index_with(stored).lookup(asked) is None
+
+
+def test_negated_prompts_still_match_their_rephrasings():
+    prompt = "Write a poem about the sea and do not use rhymes"
+    assert index_with(prompt).lookup("Write a poem about the sea, and do not use rhymes.") == key(prompt)
+
+
+def test_index_is_opt_in(monkeypatch):
+    monkeypatch.delenv("NEAR_DUPLICATE_THRESHOLD", raising=False)
+    assert build_near_duplicate_index() is None
+    monkeypatch.setenv("NEAR_DUPLICATE_THRESHOLD", "0.9")
+    assert build_near_duplicate_index().threshold == 0.9
@@ -0,0 +1,83 @@
+import pytest
+
+from benchmarks.fake_gemini import FakeModel, FakeProfile
+from example_warmup import ExampleWarmup
+from gemini_client import ModelProvider
+from prompt_analyzer import PromptAnalyzer, analyze, assemble, build_analyzer
+from prompt_cache import LRUCache, TwoTierCache
+from transform_engine import TransformEngine
+
+
+@pytest.mark.parametrize("prompt, subject", [
+    ("Explain photosynthesis to middle school students", "photosynthesis"),
+    ("Write a short story about time travel", "time travel"),
+    ("Summarize the French Revolution", "the French Revolution"),
+])
+def test_simple_requests_are_templated(prompt, subject):
+    analysis = analyze(prompt)
+    assert analysis.templated
+    assert analysis.subject == subject
+
+
+@pytest.mark.parametrize("prompt", [
+    "Summarize this",
+    "Explain it",
+    "Describe the image",
+    "Explain the following code",
+    "Write a poem that rhymes",
+    "Write a story that does not mention dragons",
+    "List ideas that don't cost money",
+    "Write a haiku about autumn without using the letter e",
+    "Explain recursion to a 5-year-old in French",
+])
+def test_prompts_a_template_would_break_go_to_the_model(prompt):
+    assert not analyze(prompt).templated
+
+
+def test_fast_path_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("PROMPT_ANALYZER_FAST_PATH", raising=False)
+    analyzer = build_analyzer()
+    path, _, local = analyzer.route("Explain photosynthesis to middle school students")
+    assert (path, local) == ("assisted", None)
+    monkeypatch.setenv("PROMPT_ANALYZER_FAST_PATH", "1")
+    assert build_analyzer().route("Explain photosynthesis to middle school students")[0] == "local"
+
+
+def test_warmup_stores_model_outputs_not_local_templates(tmp_path):
+    profile = FakeProfile(latency_ms=5.0, ttft_ms=1.0, chunks=2, response_chars=80)
+    provider = ModelProvider(
+        "fake-model", "system", model_factory=lambda name, **kwargs: FakeModel(name, profile=profile, **kwargs)
+    )
+    engine = TransformEngine(provider, cache=TwoTierCache(LRUCache()), analyzer=PromptAnalyzer(fast_path=True))
+    prompt = "Explain photosynthesis to middle school students"
+    local = engine.transform(prompt)
+    assert local.startswith("You are ")
+
+    warmup = ExampleWarmup(engine, path=str(tmp_path / "examples.json"), examples=[("Example", prompt)])
+    warmup.start(background=False)
+    assert warmup.status == "ready"
+    assert engine.transform(prompt) != local
+
+
+def task_line(prompt):
+    analysis = analyze(prompt)
+    assert analysis.templated
+    return next(line for line in assemble(analysis).splitlines() if line.startswith("- Write"))
+
+
+def test_article_follows_the_deliverable():
+    assert task_line("Write an essay about climate change") == "- Write an essay about climate change."
+
+
+def test_recipient_clause_without_about_is_kept():
+    analysis = analyze("Write an email to my boss asking for a raise")
+    assert analysis.audience == "my boss"
+    assert task_line("Write an email to my boss asking for a raise") == (
+        "- Write an email to my boss asking for a raise."
+    )
+
+
+@pytest.mark.parametrize("prompt", ["Write a letter to Santa", "Write an email to my boss"])
+def test_unparsed_recipient_goes_to_the_model(prompt):
+    path, _, local = PromptAnalyzer(fast_path=True).route(prompt)
+    assert (path, local) == ("assisted", None)
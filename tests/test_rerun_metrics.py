@@ -0,0 +1,25 @@
+from rerun_metrics import RerunTracker
+
+
+def run(tracker, session):
+    tracker.end_run(tracker.begin_run(session))
+
+
+def test_programmatic_rerun_is_charged_to_the_action_that_caused_it():
+    tracker, session = RerunTracker(), {}
+    run(tracker, session)
+    tracker.mark_action(session, "transform")
+    run(tracker, session)
+    tracker.mark_programmatic_rerun(session)
+    run(tracker, session)
+    summary = tracker.summary()
+    assert summary["transform"]["actions"] == 1
+    assert summary["transform"]["runs_per_action"] == 2
+
+
+def test_unmarked_rerun_counts_as_an_interaction():
+    tracker, session = RerunTracker(), {}
+    tracker.mark_action(session, "transform")
+    run(tracker, session)
+    run(tracker, session)
+    assert tracker.summary()["interaction"]["actions"] == 1
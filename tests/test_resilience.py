@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+
+from resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RateLimiter,
+    RetryPolicy,
+    TokenBucket,
+    UpstreamGuard,
+    is_retryable,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Unavailable(Exception):
+    code = 503
+
+
+def no_retry_guard(clock, threshold=1):
+    return UpstreamGuard(
+        breaker=CircuitBreaker(failure_threshold=threshold, cooldown_seconds=30.0, clock=clock),
+        retry_policy=RetryPolicy(max_attempts=1),
+    )
+
+
+def fail():
+    raise Unavailable("down")
+
+
+def test_token_bucket_reserves_ahead_and_refills():
+    clock = FakeClock()
+    bucket = TokenBucket(2, 1.0, clock=clock)
+    assert bucket.reserve(1) == 0.0
+    assert bucket.reserve(1) == 0.0
+    assert bucket.reserve(1) == pytest.approx(1.0)
+    clock.now = 3.0
+    assert bucket.reserve(1) == 0.0
+
+
+def test_token_bucket_adjust_returns_unused_tokens():
+    clock = FakeClock()
+    bucket = TokenBucket(100, 1.0, clock=clock)
+    assert bucket.reserve(100) == 0.0
+    bucket.adjust(-40)
+    assert bucket.reserve(40) == 0.0
+    assert bucket.reserve(1) > 0
+
+
+def test_rate_limiter_waits_for_the_tighter_budget():
+    limiter = RateLimiter(rpm=600, tpm=60)
+    assert limiter.reserve(60) == 0.0
+    # The request budget has room; the token budget needs a minute for 60 more
+    assert limiter.reserve(60) == pytest.approx(60.0, rel=0.01)
+
+
+def test_is_retryable():
+    assert is_retryable(Unavailable())
+    assert is_retryable(TimeoutError())
+    assert not is_retryable(ValueError("bad request"))
+
+
+def test_retry_delay_is_capped():
+    policy = RetryPolicy(base_delay=1.0, max_delay=5.0)
+    assert all(0 <= policy.delay(attempt) <= 5.0 for attempt in range(10))
+
+
+def test_breaker_opens_and_probes_after_the_cooldown():
+    clock = FakeClock()
+    guard = no_retry_guard(clock, threshold=2)
+    for _ in range(2):
+        with pytest.raises(Unavailable):
+            guard.call(fail)
+    assert guard.breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        guard.call(lambda: 1)
+    clock.now = 31.0
+    assert guard.call(lambda: 1) == 1
+    assert guard.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_lets_one_probe_through():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=30.0, clock=clock)
+    breaker.record_failure()
+    clock.now = 31.0
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_non_retryable_errors_do_not_open_the_breaker():
+    guard = no_retry_guard(FakeClock())
+    with pytest.raises(ValueError):
+        guard.call(lambda: (_ for _ in ()).throw(ValueError("bad request")))
+    assert guard.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_guard_retries_transient_errors():
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise Unavailable("busy")
+        return "ok"
+
+    guard = UpstreamGuard(retry_policy=RetryPolicy(max_attempts=4, base_delay=0.0))
+    assert guard.call(flaky) == "ok"
+    assert len(attempts) == 3
+
+
+def test_cancelled_probe_does_not_leave_the_breaker_half_open():
+    clock = FakeClock()
+    guard = no_retry_guard(clock)
+    with pytest.raises(Unavailable):
+        guard.call(fail)
+    clock.now = 31.0
+
+    async def cancelled_probe():
+        async def hang():
+            await asyncio.sleep(10)
+
+        task = asyncio.ensure_future(guard.call_async(hang))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancelled_probe())
+    assert guard.call(lambda: 1) == 1
+    assert guard.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_interrupted_probe_does_not_leave_the_breaker_half_open():
+    clock = FakeClock()
+    guard = no_retry_guard(clock)
+    with pytest.raises(Unavailable):
+        guard.call(fail)
+    clock.now = 31.0
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        guard.call(interrupted)
+    assert guard.call(lambda: 1) == 1
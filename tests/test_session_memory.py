@@ -0,0 +1,39 @@
+from session_memory import SessionMemory
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_widget_copies_count_towards_the_session_budget():
+    memory = SessionMemory(session_budget_bytes=100, total_budget_bytes=10000)
+    session = {}
+    memory.put(session, "candidates", ["a" * 30, "b" * 30])
+    memory.put(session, "structured_prompt", "c" * 30)
+    # The input and output boxes hold 50 bytes themselves; the unused variants have to go
+    memory.touch(session, local_bytes=50)
+    assert memory.get(session, "candidates") is None
+    assert memory.get(session, "structured_prompt") == "c" * 30
+    assert memory.stats()["evictions"]["session_budget"] == 1
+
+
+def test_widget_copies_count_towards_the_total_budget():
+    clock = FakeClock()
+    memory = SessionMemory(session_budget_bytes=1000, total_budget_bytes=400, clock=clock)
+    idle, active = {}, {}
+    memory.put(idle, "structured_prompt", "a" * 100)
+    memory.touch(idle, local_bytes=150)
+    clock.now = 1.0
+    memory.put(active, "structured_prompt", "b" * 100)
+    assert memory.get(idle, "structured_prompt") == "a" * 100
+    memory.touch(active, local_bytes=100)
+    stats = memory.stats()
+    assert stats["sessions"] == 1
+    assert stats["total_bytes"] == 200
+    assert memory.get(active, "structured_prompt") == "b" * 100
+    # The evicted session is told on its next run, so it can drop its own copy
+    assert memory.touch(idle, local_bytes=150)
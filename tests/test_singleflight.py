@@ -0,0 +1,66 @@
+import threading
+import time
+
+from benchmarks.fake_gemini import FakeModel, FakeProfile
+from gemini_client import ModelProvider
+from prompt_cache import LRUCache, TwoTierCache
+from singleflight import SingleFlight
+from transform_engine import TransformEngine
+
+
+def make_engine(latency_ms=300.0):
+    profile = FakeProfile(latency_ms=latency_ms, ttft_ms=20.0, chunks=8, response_chars=400)
+    provider = ModelProvider(
+        "fake-model", "system", model_factory=lambda name, **kwargs: FakeModel(name, profile=profile, **kwargs)
+    )
+    return TransformEngine(provider, cache=TwoTierCache(LRUCache()))
+
+
+def test_waiter_fails_with_the_leader_error():
+    flights = SingleFlight()
+    future, leader = flights.claim("key")
+    assert leader
+    waiter, waiter_leads = flights.claim("key")
+    assert not waiter_leads
+    flights.resolve("key", future, error=ValueError("upstream said no"))
+    try:
+        waiter.result()
+    except ValueError as e:
+        assert str(e) == "upstream said no"
+    else:
+        raise AssertionError("the waiter should see the leader's error")
+
+
+def test_interrupted_leader_hands_over_to_a_waiter():
+    flights = SingleFlight()
+    future, _ = flights.claim("key")
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(flights.do("key", lambda: "generated by the waiter")))
+    waiter.start()
+    time.sleep(0.05)
+    flights.resolve("key", future, error=GeneratorExit())
+    waiter.join(timeout=5)
+    assert results == ["generated by the waiter"]
+
+
+def test_closing_a_stream_does_not_fail_a_transform_of_the_same_prompt():
+    engine = make_engine()
+    prompt = "Write a long essay about the history of tea"
+    chunks = engine.stream(prompt)
+    next(chunks)
+    results, errors = [], []
+
+    def transform():
+        try:
+            results.append(engine.transform(prompt))
+        except Exception as e:
+            errors.append(e)
+
+    follower = threading.Thread(target=transform)
+    follower.start()
+    time.sleep(0.05)
+    # A stale live preview is closed like this
+    chunks.close()
+    follower.join(timeout=10)
+    assert errors == []
+    assert results and results[0]
@@ -0,0 +1,30 @@
+from startup_report import LAZY_MODULES, measure_imports, summarize
+
+BUDGET_MS = 1500
+
+
+def test_app_imports_within_budget_and_keeps_the_sdk_lazy():
+    total_us, slowest, imported = summarize(measure_imports("app"), "app", top=50)
+    assert 0 < total_us / 1000 <= BUDGET_MS
+    assert not [module for module in LAZY_MODULES if module in imported]
+    names = {row[0] for row in slowest}
+    assert "streamlit" in names
+    # Only app's own imports are listed, not what the interpreter loaded before it
+    assert names.isdisjoint({"encodings", "site", "certifi", "importlib.readers"})
+
+
+def test_summarize_counts_only_rows_nested_under_the_module():
+    rows = [
+        ("encodings.aliases", 50, 50, 1),
+        ("encodings", 100, 150, 0),
+        ("json.decoder", 30, 30, 2),
+        ("json", 20, 50, 1),
+        ("helper", 10, 10, 1),
+        ("app", 5, 65, 0),
+        ("certifi", 40, 40, 1),
+        ("requests", 60, 100, 0),
+    ]
+    total_us, slowest, imported = summarize(rows, "app")
+    assert total_us == 65
+    assert [row[0] for row in slowest] == ["json", "helper"]
+    assert "certifi" in imported
@@ -0,0 +1,19 @@
+import os
+
+from theme_assets import THEME_PATH, build_theme, load_theme, theme_style_block
+
+
+def test_theme_is_built_once_into_a_content_hashed_file(tmp_path):
+    url = build_theme(THEME_PATH, str(tmp_path))
+    css, digest = load_theme(THEME_PATH)
+    assert url == f"app/static/build/theme.{digest}.min.css"
+    with open(tmp_path / "build" / f"theme.{digest}.min.css", encoding="utf-8") as f:
+        assert f.read() == css
+    assert os.listdir(tmp_path / "build") == [f"theme.{digest}.min.css"]
+
+
+def test_unwritable_static_dir_falls_back_to_none(tmp_path):
+    blocker = tmp_path / "static"
+    blocker.write_text("not a directory")
+    assert build_theme(THEME_PATH, str(blocker)) is None
+    assert theme_style_block().startswith("<style id=\"theme-")
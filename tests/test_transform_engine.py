@@ -0,0 +1,47 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks.fake_gemini import FakeModel, FakeProfile
+from gemini_client import ModelProvider
+from prompt_cache import LRUCache, TwoTierCache
+from transform_engine import TransformEngine
+
+
+class TruncatingModel(FakeModel):
+    """Every response ends with the finish reason Gemini reports at max_output_tokens"""
+
+    def _finished(self, response, reason):
+        response.candidates = [SimpleNamespace(finish_reason=SimpleNamespace(name=reason))]
+        return response
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        return self._finished(super().generate_content(contents, stream=stream, **kwargs), "MAX_TOKENS")
+
+    async def generate_content_async(self, contents, **kwargs):
+        return self._finished(await super().generate_content_async(contents, **kwargs), "MAX_TOKENS")
+
+
+def make_engine(model_class):
+    profile = FakeProfile(latency_ms=5.0, ttft_ms=1.0, chunks=2, response_chars=80)
+    provider = ModelProvider(
+        "fake-model", "system", model_factory=lambda name, **kwargs: model_class(name, profile=profile, **kwargs)
+    )
+    return TransformEngine(provider, cache=TwoTierCache(LRUCache()))
+
+
+@pytest.mark.parametrize("run", [
+    lambda engine, prompt: engine.transform(prompt),
+    lambda engine, prompt: "".join(engine.stream(prompt)),
+    lambda engine, prompt: asyncio.run(engine.transform_async(prompt)),
+    lambda engine, prompt: engine.transform_candidates(prompt, 2)[0].text,
+])
+def test_truncated_responses_are_returned_but_not_cached(run):
+    prompt = "Write a poem about the tide"
+    engine = make_engine(TruncatingModel)
+    assert run(engine, prompt)
+    assert engine.cached(prompt) is None
+    engine = make_engine(FakeModel)
+    run(engine, prompt)
+    assert engine.cached(prompt) is not None
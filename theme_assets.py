@@ -0,0 +1,76 @@
+import functools
+import glob
+import hashlib
+import logging
+import os
+import re
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+THEME_PATH = os.path.join(STATIC_DIR, "theme.css")
+# Served by Streamlit at app/static/ (server.enableStaticServing in .streamlit/config.toml)
+STATIC_URL = "app/static"
+
+_COMMENTS = re.compile(r"/\*.*?\*/", re.S)
+_WHITESPACE = re.compile(r"\s+")
+# Spaces around these are never significant; ':' is left alone because
+# "a :hover" and "a:hover" are different selectors
+_PUNCTUATION = re.compile(r"\s*([{};,>])\s*")
+
+
+def minify_css(css):
+    """Strip comments and insignificant whitespace"""
+    css = _COMMENTS.sub("", css)
+    css = _WHITESPACE.sub(" ", css)
+    css = _PUNCTUATION.sub(r"\1", css)
+    css = css.replace(": ", ":").replace(";}", "}")
+    return css.strip()
+
+
+@functools.lru_cache(maxsize=None)
+def load_theme(path=THEME_PATH):
+    """Minified theme CSS and its content hash, built once per process"""
+    with open(path, "r", encoding="utf-8") as f:
+        css = minify_css(f.read())
+    return css, hashlib.sha256(css.encode("utf-8")).hexdigest()[:12]
+
+
+def theme_style_block(path=THEME_PATH):
+    """The <style> element to inject, tagged with the theme's content hash"""
+    css, digest = load_theme(path)
+    return f'<style id="theme-{digest}">{css}</style>'
+
+
+@functools.lru_cache(maxsize=None)
+def build_theme(path=THEME_PATH, static_dir=STATIC_DIR):
+    """URL of the minified theme written under static/build/, or None when it cannot be written.
+
+    The file name carries the content hash, so browsers can cache it for good.
+    """
+    css, digest = load_theme(path)
+    build_dir = os.path.join(static_dir, "build")
+    name = f"theme.{digest}.min.css"
+    target = os.path.join(build_dir, name)
+    if not os.path.exists(target):
+        try:
+            os.makedirs(build_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=build_dir, suffix=".tmp", delete=False) as f:
+                f.write(css)
+            os.replace(f.name, target)
+            for stale in glob.glob(os.path.join(build_dir, "theme.*.min.css")):
+                if stale != target:
+                    os.remove(stale)
+        except OSError as e:
+            logger.warning("Could not write the built theme, inlining it instead: %s", e)
+            return None
+    return f"{STATIC_URL}/build/{name}"
+
+
+def theme_tags(path=THEME_PATH):
+    """What each rerun injects: a <link> to the built theme, or the inline <style> block as a fallback"""
+    url = build_theme(path)
+    if url is None:
+        return theme_style_block(path)
+    return f'<link rel="stylesheet" href="{url}">'
@@ -0,0 +1,138 @@
+import logging
+import os
+import re
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+_BLANK_LINES = re.compile(r"\n[ \t]*(?:\n[ \t]*){2,}")
+_TRAILING_SPACE = re.compile(r"[ \t]+\n")
+
+COMPACTION_MARKER = "\n\n[... {omitted} characters omitted to fit the token budget ...]\n\n"
+
+# What is sent for one raw prompt, and what it was budgeted at
+PreparedPrompt = namedtuple("PreparedPrompt", "text tokens original_tokens exact compacted")
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token)"""
+    return (len(text) + 3) // 4
+
+
+def squeeze_whitespace(text):
+    """Drop trailing spaces and runs of blank lines, which cost tokens but carry nothing"""
+    return _BLANK_LINES.sub("\n\n", _TRAILING_SPACE.sub("\n", text)).strip()
+
+
+def compact_text(text, max_chars):
+    """Keep the start and end of `text` within max_chars, marking what was cut from the middle"""
+    if len(text) <= max_chars:
+        return text
+    marker_size = len(COMPACTION_MARKER.format(omitted=len(text)))
+    keep = max(max_chars - marker_size, 0)
+    # Requests usually state the task up front and the question at the end
+    head_size = keep * 2 // 3
+    tail_size = keep - head_size
+    head = text[:head_size]
+    tail = text[len(text) - tail_size:] if tail_size else ""
+    # Cut on whitespace so no word is split in half
+    if " " in head[-80:] or "\n" in head[-80:]:
+        head = head[:max(head.rfind(" "), head.rfind("\n"))]
+    if tail and (" " in tail[:80] or "\n" in tail[:80]):
+        tail = tail[min(i for i in (tail.find(" "), tail.find("\n")) if i >= 0) + 1:]
+    omitted = len(text) - len(head) - len(tail)
+    return head + COMPACTION_MARKER.format(omitted=omitted) + tail
+
+
+class TokenBudget:
+    """Caps the input and output tokens of a single transform request.
+
+    Input is counted with the local estimate first. Only when the estimate is
+    within `exact_margin` of the limit is the model's count_tokens() called,
+    since that is a round trip to the API. Prompts over the limit have the
+    middle cut out until they fit.
+    """
+
+    def __init__(self, max_input_tokens=8000, max_output_tokens=2048, stop_sequences=(), exact_counts=True,
+                 exact_margin=0.8):
+        self.max_input_tokens = max_input_tokens
+        self.max_output_tokens = max_output_tokens
+        self.stop_sequences = list(stop_sequences)
+        self.exact_counts = exact_counts
+        self.exact_margin = exact_margin
+        self.compacted = 0
+
+    def request_tokens(self, system_instruction, user_prompt):
+        return estimate_tokens(system_instruction + user_prompt)
+
+    def over_budget(self, estimated_tokens):
+        return bool(self.max_input_tokens) and estimated_tokens > self.max_input_tokens
+
+    def needs_exact_count(self, estimated_tokens):
+        return (
+            self.exact_counts
+            and bool(self.max_input_tokens)
+            and estimated_tokens >= self.max_input_tokens * self.exact_margin
+        )
+
+    def generation_config(self):
+        config = {}
+        if self.max_output_tokens:
+            config["max_output_tokens"] = self.max_output_tokens
+        if self.stop_sequences:
+            config["stop_sequences"] = self.stop_sequences
+        return config
+
+    def prepare(self, raw_prompt, system_instruction, build_prompt, count_tokens=None):
+        """Fit the user turn built from raw_prompt into the input budget.
+
+        `count_tokens(user_prompt)` returns the exact count for the whole
+        request (system instruction included), or None when unavailable.
+        """
+        text = raw_prompt
+        estimated = self.request_tokens(system_instruction, build_prompt(text))
+        original, exact = estimated, False
+        tokens = estimated
+        if self.needs_exact_count(estimated) and count_tokens is not None:
+            counted = self._count(count_tokens, build_prompt(text))
+            if counted is not None:
+                original, tokens, exact = counted, counted, True
+        if not self.over_budget(tokens):
+            return PreparedPrompt(build_prompt(text), tokens, original, exact, False)
+
+        text = squeeze_whitespace(text)
+        # Dense text (code, non-Latin scripts) runs over four characters per
+        # token, so shrink again in proportion if the exact count is still over
+        for _ in range(3):
+            overhead = self.request_tokens(system_instruction, build_prompt(""))
+            ratio = (len(text) / max(tokens - overhead, 1)) if exact else 4
+            max_chars = int((self.max_input_tokens - overhead) * ratio * 0.95)
+            text = compact_text(text, max(max_chars, 0))
+            tokens = self.request_tokens(system_instruction, build_prompt(text))
+            if exact:
+                counted = self._count(count_tokens, build_prompt(text))
+                tokens = counted if counted is not None else tokens
+            if not self.over_budget(tokens):
+                break
+        self.compacted += 1
+        logger.info("Compacted a %d-token request to %d tokens", original, tokens)
+        return PreparedPrompt(build_prompt(text), tokens, original, exact, True)
+
+    def _count(self, count_tokens, user_prompt):
+        try:
+            return count_tokens(user_prompt)
+        except Exception as e:
+            logger.warning("Exact token count failed, using the estimate: %s", e)
+            return None
+
+
+def build_token_budget():
+    """Create the budget from GEMINI_MAX_*_TOKENS and related environment variables"""
+    stop_sequences = os.getenv("GEMINI_STOP_SEQUENCES", "")
+    return TokenBudget(
+        max_input_tokens=int(os.getenv("GEMINI_MAX_INPUT_TOKENS", "8000")),
+        max_output_tokens=int(os.getenv("GEMINI_MAX_OUTPUT_TOKENS", "2048")),
+        # The API accepts up to five stop sequences
+        stop_sequences=[s for s in stop_sequences.split("|") if s][:5],
+        exact_counts=os.getenv("GEMINI_EXACT_TOKEN_COUNTS", "1").lower() not in ("0", "false", "no"),
+    )
@@ -0,0 +1,591 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import asynccontextmanager, contextmanager
+
+from candidate_ranker import rank_candidates
+from coordination import build_coordination
+from prompt_cache import build_prompt_cache, make_cache_key
+from near_duplicates import build_near_duplicate_index
+from gemini_client import ModelProvider, api_keys_from_env, build_context_cache, build_user_prompt, load_model_factory
+from key_pool import build_key_pool
+from resilience import build_upstream_guard
+from singleflight import LeaderInterrupted, SingleFlight
+from hedging import build_hedger
+from prompt_analyzer import build_analyzer
+from telemetry import RequestTrace
+from token_budget import build_token_budget, estimate_tokens
+
+MODEL_NAME = "gemini-2.0-flash"
+
+# Output allowance used when reserving tokens-per-minute budget up front,
+# unless a token budget caps the output
+EXPECTED_OUTPUT_TOKENS = 1024
+
+
+def usage_tokens(response):
+    """Total tokens billed for a response, when the SDK reports it"""
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "total_token_count", None) if usage else None
+
+
+def finish_reason(response):
+    """Why Gemini stopped the first candidate ("STOP", "MAX_TOKENS", "SAFETY", ...), when the SDK reports it"""
+    candidates = getattr(response, "candidates", None)
+    if not candidates:
+        return None
+    return getattr(getattr(candidates[0], "finish_reason", None), "name", None)
+
+
+def is_complete(response):
+    """False for a response Gemini cut short, such as one that hit max_output_tokens"""
+    return finish_reason(response) in (None, "STOP")
+
+
+def get_system_prompt():
+    return """You are MetaPromptor, an expert AI prompt engineer built on Google's Gemini framework. Your goal is to take any user-provided "raw" prompt and transform it into a clear, detailed, and highly structured prompt that elicits the best possible response from downstream language models.
+
+When you receive a raw prompt, follow these steps exactly:
+
+**Analyze the User's Intent**
+- Identify the primary objective: what the user ultimately wants to achieve.
+- Note any secondary objectives such as tone, style, format, or special requirements.
+
+**Spot Ambiguities and Insert Clarifications**
+- If any part of the user's request is unclear, add a placeholder for a clarifying question in square brackets.
+- Example: [Clarifying Question: "Should the summary be under 100 words or under 200 words?"]
+
+**Break the Task into Core Components**
+- Context: Describe any background information the model needs to know.
+- Role: Specify the persona or expertise the model should adopt (e.g., "an experienced science teacher").
+- Task: State exactly what the model must do (e.g., "Explain the concept using analogies").
+- Constraints: List any limitations (word count, vocabulary level, formatting rules, prohibited topics).
+- Examples: If helpful, provide a brief input/output example to illustrate the desired style or structure.
+
+**Add Meta-Instructions for Self-Reflection**
+- Prompt the model to think step by step ("List your sub-tasks before generating").
+- Instruct it to verify completeness ("After drafting, check that every objective is addressed").
+- Encourage consistency checks ("Ensure tone and formatting are uniform throughout").
+
+**Organize the Final Prompt in Plain English**
+- Use clear headings or bullet lists to delineate each component.
+- Write as a cohesive system message that can be pasted directly into any LLM setup.
+
+**Output Only the Ready-to-Use Prompt**
+- Do not include any commentary, analysis, or explanation—only the polished prompt itself.
+
+Example Transformation:
+
+Raw Prompt from User:
+"Explain quantum computing in simple terms for a 10-year-old."
+
+Your Transformed System Prompt:
+
+You are an experienced STEM educator who excels at making complex ideas simple and engaging for young children.
+
+Context:
+- Audience: A curious 10-year-old with no background in physics or computing.
+
+Task:
+- Explain what quantum computing is, using everyday analogies.
+- Keep sentences short and lively.
+
+Constraints:
+- Use language appropriate for a 10-year-old.
+- Limit the explanation to around 150 words.
+- Avoid technical jargon; if you must use a new term, define it immediately.
+
+Meta-Instructions:
+- Think step by step: first introduce the idea of bits, then describe how quantum bits differ.
+- After writing, review each sentence to ensure clarity and simplicity.
+
+Output Format:
+- A single, engaging paragraph that reads like a story a child would understand."""
+
+
+class TransformEngine:
+    """Raw prompt in, structured prompt out; shared by the UI and headless tools"""
+
+    def __init__(self, model_provider, cache=None, guard=None, near_index=None, budget=None, hedger=None,
+                 fallback_provider=None, request_timeout=None, key_pool=None, analyzer=None, replica_flights=None):
+        self.model_provider = model_provider
+        self.cache = cache
+        self.guard = guard
+        self.near_index = near_index
+        self.budget = budget
+        # Hedged calls go to the fallback model when there is one, otherwise to the primary again
+        self.hedger = hedger
+        self.fallback_provider = fallback_provider
+        self.request_timeout = request_timeout
+        # With several API keys each call is routed to one; the pool then does the rate limiting
+        self.key_pool = key_pool
+        # Rule-based pre-analysis: templated prompts are assembled locally, the rest get hints
+        self.analyzer = analyzer
+        self.flights = SingleFlight()
+        # With several replicas, one of them generates a prompt and the others wait for its result
+        self.replica_flights = replica_flights
+
+    @classmethod
+    def from_env(cls, model_name=MODEL_NAME):
+        """Build the engine from the same environment variables the app reads"""
+        context_cache = build_context_cache(
+            os.getenv("GEMINI_CONTEXT_CACHE", "").lower() in ("1", "true", "yes"),
+            ttl_seconds=int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_SECONDS", "3600")),
+        )
+        # GEMINI_MODEL_FACTORY swaps in another backend, such as benchmarks.fake_gemini:FakeModel
+        model_factory = load_model_factory(os.getenv("GEMINI_MODEL_FACTORY"))
+        if model_factory is not None:
+            context_cache = None
+        model_provider = ModelProvider(
+            model_name, get_system_prompt(), context_cache=context_cache, model_factory=model_factory
+        )
+        fallback_provider = None
+        fallback_model = os.getenv("GEMINI_FALLBACK_MODEL")
+        if fallback_model and fallback_model != model_name:
+            fallback_provider = ModelProvider(
+                fallback_model, get_system_prompt(), context_cache=context_cache, model_factory=model_factory
+            )
+        request_timeout = float(os.getenv("GEMINI_REQUEST_TIMEOUT_SECONDS", "60"))
+        # Shared with other replicas when COORDINATION_URL is set
+        coordination = build_coordination()
+        key_pool = build_key_pool(api_keys_from_env(), coordination)
+        guard = build_upstream_guard(coordination)
+        if key_pool is not None:
+            # Each key has its own limiter in the pool; a shared one would cap everything at one key's quota
+            guard.limiter = None
+        return cls(
+            model_provider,
+            cache=build_prompt_cache(shared=coordination.cache if coordination is not None else None),
+            guard=guard,
+            near_index=build_near_duplicate_index(),
+            budget=build_token_budget(),
+            hedger=build_hedger(),
+            fallback_provider=fallback_provider,
+            request_timeout=request_timeout or None,
+            key_pool=key_pool,
+            analyzer=build_analyzer(),
+            replica_flights=coordination.flights if coordination is not None else None,
+        )
+
+    @property
+    def model_name(self):
+        return self.model_provider.model_name
+
+    def cache_key(self, raw_prompt):
+        return make_cache_key(raw_prompt, self.model_name, self.model_provider.system_instruction)
+
+    def cached(self, raw_prompt):
+        """Stored result for this prompt or a near-duplicate of it, or None"""
+        return self._lookup(raw_prompt)[0]
+
+    def _lookup(self, raw_prompt):
+        """(structured prompt or None, cache outcome)"""
+        if self.cache is None:
+            return None, "disabled"
+        structured_prompt = self.cache.get(self.cache_key(raw_prompt))
+        if structured_prompt is not None:
+            return structured_prompt, "hit"
+        if self.near_index is not None:
+            similar_key = self.near_index.lookup(raw_prompt)
+            if similar_key is not None:
+                structured_prompt = self.cache.get(similar_key, record=False)
+                if structured_prompt is not None:
+                    return structured_prompt, "near_hit"
+        return None, "miss"
+
+    def _cache_blocks(self):
+        # The shared tier is a network or SQLite round-trip that can take up to the backend's timeout
+        return getattr(self.cache, "shared", None) is not None
+
+    async def _lookup_async(self, raw_prompt):
+        if self._cache_blocks():
+            return await asyncio.to_thread(self._lookup, raw_prompt)
+        return self._lookup(raw_prompt)
+
+    async def _store_async(self, raw_prompt, structured_prompt):
+        if self._cache_blocks():
+            await asyncio.to_thread(self.store, raw_prompt, structured_prompt)
+        else:
+            self.store(raw_prompt, structured_prompt)
+
+    @contextmanager
+    def _replica_flight(self, raw_prompt, trace):
+        """Yields another replica's result for raw_prompt, or None while this replica generates it"""
+        if self.replica_flights is None or self.cache is None:
+            yield None
+            return
+        cache_key = self.cache_key(raw_prompt)
+        waiting_since = trace.clock()
+        with self.replica_flights.lead_or_wait(cache_key, lambda: self.cache.get(cache_key, record=False)) as result:
+            if result is not None:
+                trace.cache = "coalesced"
+                trace.add_span("queue_wait", trace.clock() - waiting_since)
+            yield result
+
+    @asynccontextmanager
+    async def _replica_flight_async(self, raw_prompt, trace):
+        if self.replica_flights is None or self.cache is None:
+            yield None
+            return
+        cache_key = self.cache_key(raw_prompt)
+        waiting_since = trace.clock()
+        async with self.replica_flights.lead_or_wait_async(
+            cache_key, lambda: self.cache.get(cache_key, record=False)
+        ) as result:
+            if result is not None:
+                trace.cache = "coalesced"
+                trace.add_span("queue_wait", trace.clock() - waiting_since)
+            yield result
+
+    def store(self, raw_prompt, structured_prompt):
+        if self.cache is not None and structured_prompt:
+            cache_key = self.cache_key(raw_prompt)
+            self.cache.set(cache_key, structured_prompt)
+            if self.near_index is not None:
+                self.near_index.add(raw_prompt, cache_key)
+
+    def estimated_cost(self, prompt):
+        output_tokens = EXPECTED_OUTPUT_TOKENS
+        if self.budget is not None and self.budget.max_output_tokens:
+            output_tokens = self.budget.max_output_tokens
+        return estimate_tokens(self.model_provider.system_instruction + prompt) + output_tokens
+
+    def assemble_locally(self, raw_prompt, trace=None):
+        """The structured prompt built by the local analyzer, or None when Gemini is needed"""
+        if self.analyzer is None:
+            return None
+        trace = trace or RequestTrace("analysis")
+        with trace.span("analysis"):
+            trace.analysis, _, structured_prompt = self.analyzer.route(raw_prompt)
+        return structured_prompt
+
+    def prepare(self, raw_prompt, trace=None):
+        """The user turn sent for raw_prompt, compacted to fit the input token budget"""
+        hints = self.analyzer.hints(raw_prompt) if self.analyzer is not None else ""
+
+        def build_prompt(text):
+            return build_user_prompt(text, hints)
+
+        if self.budget is None:
+            return build_prompt(raw_prompt)
+        trace = trace or RequestTrace("prepare")
+        with trace.span("token_count"):
+            prepared = self.budget.prepare(
+                raw_prompt, self.model_provider.system_instruction, build_prompt, self._count_tokens
+            )
+        trace.budgeted_tokens = prepared.tokens
+        trace.compacted = prepared.compacted
+        return prepared.text
+
+    def _count_tokens(self, user_prompt):
+        return self.model_provider.get().count_tokens(user_prompt).total_tokens
+
+    def estimated_input_tokens(self, raw_prompt):
+        """Local estimate of the request input tokens for raw_prompt, before any compaction"""
+        return estimate_tokens(self.model_provider.system_instruction + build_user_prompt(raw_prompt))
+
+    def _needs_exact_count(self, raw_prompt):
+        return self.budget is not None and self.budget.needs_exact_count(self.estimated_input_tokens(raw_prompt))
+
+    def _generation_kwargs(self, kwargs):
+        if self.budget is not None and "generation_config" not in kwargs:
+            generation_config = self.budget.generation_config()
+            if generation_config:
+                kwargs["generation_config"] = generation_config
+        if self.request_timeout and "request_options" not in kwargs:
+            kwargs["request_options"] = {"timeout": self.request_timeout}
+        return kwargs
+
+    def _send(self, user_prompt, trace, **kwargs):
+        """One generate_content call, hedged against a slow first token when enabled"""
+        kwargs = self._generation_kwargs(kwargs)
+        if self.hedger is None:
+            return self._guarded_send(self.model_provider, user_prompt, trace, kwargs)
+        # The backup keeps its spans out of the request's trace
+        return self.hedger.call(
+            lambda: self._guarded_send(self.model_provider, user_prompt, trace, kwargs),
+            lambda: self._guarded_send(
+                self.fallback_provider or self.model_provider, user_prompt, RequestTrace(trace.mode), kwargs
+            ),
+            kind="stream" if kwargs.get("stream") else "blocking",
+            trace=trace,
+        )
+
+    def _guarded_send(self, model_provider, user_prompt, trace, kwargs):
+        # Time between attempts (rate limiter, retry backoff) counts as queue wait
+        waiting_since = [trace.clock()]
+
+        def send():
+            trace.add_span("queue_wait", trace.clock() - waiting_since[0])
+            lease = None
+            try:
+                if self.key_pool is not None:
+                    with trace.span("queue_wait"):
+                        lease = self.key_pool.acquire(self.estimated_cost(user_prompt))
+                with trace.span("model_construction"):
+                    model = model_provider.get(lease.api_key if lease else None)
+                with trace.span("request_send"):
+                    response = model.generate_content(user_prompt, **kwargs)
+            except BaseException as e:
+                if lease is not None:
+                    # A 429 takes the key out of rotation, so the retry goes to another one
+                    lease.release(error=e)
+                raise
+            finally:
+                waiting_since[0] = trace.clock()
+            if lease is not None:
+                # A stream's usage is only complete once it has been read
+                lease.release(actual_tokens=None if kwargs.get("stream") else usage_tokens(response))
+            return response
+
+        if self.guard is None:
+            return send()
+        return self.guard.call(send, self.estimated_cost(user_prompt))
+
+    async def _send_async(self, user_prompt, trace):
+        kwargs = self._generation_kwargs({})
+        if self.hedger is None:
+            return await self._guarded_send_async(self.model_provider, user_prompt, trace, kwargs)
+        return await self.hedger.call_async(
+            lambda: self._guarded_send_async(self.model_provider, user_prompt, trace, kwargs),
+            lambda: self._guarded_send_async(
+                self.fallback_provider or self.model_provider, user_prompt, RequestTrace(trace.mode), kwargs
+            ),
+            trace=trace,
+        )
+
+    async def _guarded_send_async(self, model_provider, user_prompt, trace, kwargs):
+        waiting_since = [trace.clock()]
+
+        async def send():
+            trace.add_span("queue_wait", trace.clock() - waiting_since[0])
+            lease = None
+            try:
+                if self.key_pool is not None:
+                    with trace.span("queue_wait"):
+                        lease = await self.key_pool.acquire_async(self.estimated_cost(user_prompt))
+                with trace.span("model_construction"):
+                    model = model_provider.get(lease.api_key if lease else None, asynchronous=True)
+                with trace.span("request_send"):
+                    response = await model.generate_content_async(user_prompt, **kwargs)
+            except BaseException as e:
+                if lease is not None:
+                    lease.release(error=e)
+                raise
+            finally:
+                waiting_since[0] = trace.clock()
+            if lease is not None:
+                lease.release(actual_tokens=usage_tokens(response))
+            return response
+
+        if self.guard is None:
+            return await send()
+        return await self.guard.call_async(send, self.estimated_cost(user_prompt))
+
+    def _record_usage(self, user_prompt, response, trace):
+        trace.record_usage(response)
+        if self.guard is not None:
+            self.guard.record_usage(self.estimated_cost(user_prompt), usage_tokens(response))
+
+    def transform(self, raw_prompt, trace=None, fast_path=True):
+        """Blocking transform, served from the cache when possible.
+
+        With fast_path=False the analyzer's fast path is skipped and a cache miss always goes to Gemini.
+        """
+        trace = trace or RequestTrace("blocking")
+        cached, trace.cache = self._lookup(raw_prompt)
+        if cached is not None:
+            trace.complete()
+            return cached
+        local = self.assemble_locally(raw_prompt, trace) if fast_path else None
+        if local is not None:
+            trace.complete()
+            return local
+        # Identical prompts submitted concurrently share one upstream call;
+        # the leader overwrites this outcome, so it only sticks for followers
+        trace.cache = "coalesced"
+        waiting_since = trace.clock()
+        try:
+            result = self.flights.do(self.cache_key(raw_prompt), lambda: self._transform_uncached(raw_prompt, trace))
+        except Exception as e:
+            trace.record_error(e)
+            raise
+        if trace.cache == "coalesced":
+            trace.add_span("queue_wait", trace.clock() - waiting_since)
+        trace.complete()
+        return result
+
+    def _transform_uncached(self, raw_prompt, trace):
+        # A flight may have finished between our cache miss and our claim
+        cached, trace.cache = self._lookup(raw_prompt)
+        if cached is not None:
+            return cached
+        with self._replica_flight(raw_prompt, trace) as generated_elsewhere:
+            if generated_elsewhere is not None:
+                return generated_elsewhere
+            user_prompt = self.prepare(raw_prompt, trace)
+            response = self._send(user_prompt, trace)
+            self._record_usage(user_prompt, response, trace)
+            # A truncated response is still returned, but not served to later requests
+            if is_complete(response):
+                self.store(raw_prompt, response.text)
+            return response.text
+
+    def stream(self, raw_prompt, trace=None):
+        """Yield the structured prompt chunk by chunk as Gemini produces it"""
+        trace = trace or RequestTrace("stream")
+        cached, trace.cache = self._lookup(raw_prompt)
+        if cached is None:
+            cached = self.assemble_locally(raw_prompt, trace)
+        if cached is not None:
+            trace.first_chunk()
+            trace.complete()
+            yield cached
+            return
+        cache_key = self.cache_key(raw_prompt)
+        while True:
+            future, leader = self.flights.claim(cache_key)
+            if leader:
+                break
+            # Someone else is already generating this prompt; wait for it
+            trace.cache = "coalesced"
+            try:
+                with trace.span("queue_wait"):
+                    structured_prompt = future.result()
+            except LeaderInterrupted:
+                # The leading stream was abandoned; claim the prompt again
+                continue
+            except Exception as e:
+                trace.record_error(e)
+                raise
+            trace.first_chunk()
+            trace.complete()
+            yield structured_prompt
+            return
+        try:
+            structured_prompt, trace.cache = self._lookup(raw_prompt)
+            if structured_prompt is not None:
+                trace.first_chunk()
+                trace.complete()
+                yield structured_prompt
+                self.flights.resolve(cache_key, future, result=structured_prompt)
+                return
+            with self._replica_flight(raw_prompt, trace) as structured_prompt:
+                if structured_prompt is not None:
+                    trace.first_chunk()
+                    trace.complete()
+                    yield structured_prompt
+                else:
+                    # The SDK fetches the first chunk inside generate_content, so retries
+                    # cover failures up to the first token; later ones surface to the caller
+                    user_prompt = self.prepare(raw_prompt, trace)
+                    response = self._send(user_prompt, trace, stream=True)
+                    chunks = []
+                    for chunk in response:
+                        trace.first_chunk()
+                        chunks.append(chunk.text)
+                        yield chunk.text
+                    structured_prompt = "".join(chunks)
+                    trace.complete()
+                    self._record_usage(user_prompt, response, trace)
+                    # Only complete responses are cached; an aborted stream never reaches here,
+                    # and the finish reason of the last chunk tells whether Gemini cut it short
+                    if is_complete(response):
+                        self.store(raw_prompt, structured_prompt)
+        except BaseException as e:
+            if isinstance(e, Exception):
+                trace.record_error(e)
+            self.flights.resolve(cache_key, future, error=e)
+            raise
+        self.flights.resolve(cache_key, future, result=structured_prompt)
+
+    def transform_candidates(self, raw_prompt, count, trace=None):
+        """`count` fresh generations sent concurrently, ranked best first.
+
+        Wall time stays close to one call. The cache is bypassed, since the
+        point is to get new variants, but the best one is stored for later
+        plain transforms unless Gemini cut it short. Failed generations are dropped; if all fail, the
+        first error is raised.
+        """
+        trace = trace or RequestTrace("candidates")
+        trace.cache = "bypass"
+        try:
+            user_prompt = self.prepare(raw_prompt, trace)
+        except Exception as e:
+            trace.record_error(e)
+            raise
+        # The first generation fills the request's spans; the others keep their own
+        traces = [trace] + [RequestTrace(trace.mode) for _ in range(count - 1)]
+
+        def generate(candidate_trace):
+            response = self._send(user_prompt, candidate_trace)
+            self._record_usage(user_prompt, response, candidate_trace)
+            return response.text, is_complete(response)
+
+        texts, truncated, errors = [], set(), []
+        with ThreadPoolExecutor(max_workers=count, thread_name_prefix="candidate") as executor:
+            futures = [executor.submit(generate, candidate_trace) for candidate_trace in traces]
+            for future in as_completed(futures):
+                try:
+                    text, complete = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                texts.append(text)
+                if not complete:
+                    truncated.add(text)
+        for candidate_trace in traces[1:]:
+            for kind, tokens in candidate_trace.tokens.items():
+                trace.tokens[kind] = trace.tokens.get(kind, 0) + tokens
+        candidates = rank_candidates(texts)
+        if not candidates:
+            error = errors[0] if errors else ValueError("Gemini returned no candidates")
+            trace.record_error(error)
+            raise error
+        trace.complete()
+        if candidates[0].text not in truncated:
+            self.store(raw_prompt, candidates[0].text)
+        return candidates
+
+    async def transform_async(self, raw_prompt, trace=None):
+        """Non-blocking transform for asyncio callers such as the batch CLI"""
+        trace = trace or RequestTrace("async")
+        cached, trace.cache = await self._lookup_async(raw_prompt)
+        if cached is not None:
+            trace.complete()
+            return cached
+        local = self.assemble_locally(raw_prompt, trace)
+        if local is not None:
+            trace.complete()
+            return local
+        trace.cache = "coalesced"
+        waiting_since = trace.clock()
+        try:
+            result = await self.flights.do_async(
+                self.cache_key(raw_prompt), lambda: self._transform_uncached_async(raw_prompt, trace)
+            )
+        except Exception as e:
+            trace.record_error(e)
+            raise
+        if trace.cache == "coalesced":
+            trace.add_span("queue_wait", trace.clock() - waiting_since)
+        trace.complete()
+        return result
+
+    async def _transform_uncached_async(self, raw_prompt, trace):
+        cached, trace.cache = await self._lookup_async(raw_prompt)
+        if cached is not None:
+            return cached
+        async with self._replica_flight_async(raw_prompt, trace) as generated_elsewhere:
+            if generated_elsewhere is not None:
+                return generated_elsewhere
+            if self._needs_exact_count(raw_prompt):
+                # count_tokens is a blocking API call; keep it off the event loop
+                user_prompt = await asyncio.to_thread(self.prepare, raw_prompt, trace)
+            else:
+                user_prompt = self.prepare(raw_prompt, trace)
+            response = await self._send_async(user_prompt, trace)
+            self._record_usage(user_prompt, response, trace)
+            if is_complete(response):
+                await self._store_async(raw_prompt, response.text)
+            return response.text
@@ -0,0 +1,139 @@
+"""Transforms run on a process-wide worker pool instead of inside a script run.
+
+Streamlit stops the running script whenever the user touches a widget, so
+a transform done inline under st.spinner was thrown away, Gemini response
+and all. A job keeps running on its worker thread however many reruns
+happen. The session only holds the job id; a later run (the polling fragment
+or any other interaction) picks up the result once the job is done.
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+KINDS = ("blocking", "stream", "candidates")
+
+
+class TransformJob:
+    """One transform on the worker pool; chunks fill in as a streamed job runs"""
+
+    def __init__(self, kind, raw_prompt, trace, count=1):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.raw_prompt = raw_prompt
+        self.trace = trace
+        self.count = count
+        self.status = "queued"
+        # The structured prompt, or the ranked candidates for a "candidates" job
+        self.result = None
+        self.error = None
+        self.chunks = []
+        self.collected = False
+        self.created_at = time.monotonic()
+        self.finished_at = None
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def partial_text(self):
+        return "".join(self.chunks)
+
+    def same_request(self, kind, raw_prompt, count):
+        return (self.kind, self.raw_prompt, self.count) == (kind, raw_prompt, count)
+
+
+class JobRunner:
+    """Runs transform jobs on a bounded thread pool and keeps them until collected or expired"""
+
+    def __init__(self, engine, telemetry=None, max_workers=16, retention_seconds=600.0):
+        self.engine = engine
+        self.telemetry = telemetry
+        self.retention_seconds = retention_seconds
+        self.submitted = 0
+        self.abandoned = 0
+        self._jobs = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="transform-job")
+        self._lock = threading.Lock()
+
+    def submit(self, kind, raw_prompt, trace, count=1):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown transform job kind: {kind}")
+        job = TransformJob(kind, raw_prompt, trace, count)
+        with self._lock:
+            self._prune(time.monotonic())
+            self._jobs[job.id] = job
+            self.submitted += 1
+        self._executor.submit(self._run, job)
+        return job
+
+    def _run(self, job):
+        job.status = "running"
+        try:
+            if job.kind == "stream":
+                for chunk in self.engine.stream(job.raw_prompt, job.trace):
+                    job.chunks.append(chunk)
+                job.result = job.partial_text()
+            elif job.kind == "candidates":
+                job.result = self.engine.transform_candidates(job.raw_prompt, job.count, job.trace)
+            else:
+                job.result = self.engine.transform(job.raw_prompt, job.trace)
+            job.status = "done"
+        except Exception as e:
+            job.error = e
+            job.status = "failed"
+        finally:
+            job.finished_at = time.monotonic()
+            job._done.set()
+
+    def get(self, job_id):
+        if job_id is None:
+            return None
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def collect(self, job):
+        """Hand a finished job to its session; it is then dropped from the runner"""
+        with self._lock:
+            job.collected = True
+            self._jobs.pop(job.id, None)
+
+    def _prune(self, now):
+        # Jobs whose session never came back, for example a closed tab; the
+        # result is still in the response cache, only the job record goes
+        expired = [
+            job for job in self._jobs.values()
+            if job.done and now - job.finished_at > self.retention_seconds
+        ]
+        for job in expired:
+            del self._jobs[job.id]
+            self.abandoned += 1
+            if self.telemetry is not None:
+                self.telemetry.finish(job.trace)
+
+    def stats(self):
+        with self._lock:
+            self._prune(time.monotonic())
+            statuses = [job.status for job in self._jobs.values()]
+            return {
+                "queued": statuses.count("queued"),
+                "running": statuses.count("running"),
+                "waiting_pickup": statuses.count("done") + statuses.count("failed"),
+                "submitted": self.submitted,
+                "abandoned": self.abandoned,
+            }
+
+
+def build_job_runner(engine, telemetry=None):
+    """Create the runner from TRANSFORM_* environment variables"""
+    return JobRunner(
+        engine,
+        telemetry=telemetry,
+        max_workers=int(os.getenv("TRANSFORM_WORKERS", "16")),
+        retention_seconds=float(os.getenv("TRANSFORM_JOB_RETENTION_SECONDS", "600")),
+    )